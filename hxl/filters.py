@@ -38,7 +38,7 @@ lower-level L{AbstractBaseFilter} directly for especially-complex cases.
 """
 
 import hxl, hxl.formulas.eval as feval
-import abc, copy, dateutil.parser, itertools, json, jsonpath_ng.ext, logging, re, six, sys
+import abc, collections, concurrent.futures, copy, dateutil.parser, hashlib, heapq, itertools, json, jsonpath_ng.ext, logging, multiprocessing, operator, os, pickle, re, six, sqlite3, sys, tempfile, warnings
 
 from hxl.util import logup
 
@@ -222,6 +222,11 @@ class AbstractStreamingFilter(AbstractBaseFilter):
 
     __metaclass__ = abc.ABCMeta
 
+    is_stateless = False
+    """True if L{filter_row} depends only on the row passed to it,
+    without keeping any state from one row to the next, so that
+    batches of rows can be filtered independently (see L{ParallelFilter})."""
+
     def __init__(self, source):
         """Construct a new streaming filter.
         @param source: the source dataset
@@ -237,17 +242,77 @@ class AbstractStreamingFilter(AbstractBaseFilter):
         rows on the fly, without having to keep a copy of the entire
         dataset in memory.
 
+        A subclass that doesn't change the values may return the
+        original row itself, and the output row will share its list
+        of values (copy on write) rather than copying it. A subclass
+        that changes the values must not modify the original row's
+        list in place; use L{hxl.model.Row.copy_values} to get a
+        private copy first.
+
         @param row: the original L{hxl.model.Row} object.
-        @returns: A list of string values (I{not} a Row object) or
-        C{None} to skip the row.
+        @returns: A list of string values, the original row (to
+        pass its values through unchanged), or C{None} to skip the
+        row.
         @see: L{AbstractBaseFilter.filter_columns}
 
         """
         return row.values
 
+    def filter_batch(self, rows):
+        """Filter a batch of rows together.
+
+        By default, this method calls L{filter_row} for each row in
+        the batch. Subclasses can override it to process the whole
+        batch in one call, which saves a method call per row and
+        lets them set up any per-batch state only once. See
+        L{hxl.model.Dataset.iter_batches}.
+
+        @param rows: a list of L{hxl.model.Row} objects
+        @returns: a list with one item for each row not skipped, in
+        order, as returned by L{filter_row} (a list of values or the
+        original row)
+        """
+        result = []
+        for row in rows:
+            values = self.filter_row(row)
+            if values is not None:
+                result.append(values)
+        return result
+
+    def iter_batches(self, size=hxl.model.BATCH_SIZE):
+        """Get an iterator over the filtered rows in batches.
+        Reads batches from the source, and filters each one with L{filter_batch}.
+        Batches may be shorter than I{size} after filtering, but are never empty.
+        @param size: the maximum number of rows in each batch
+        @returns: an iterator that returns lists of L{hxl.model.Row} objects
+        @see: L{hxl.model.Dataset.iter_batches}
+        """
+        columns = self.columns
+        row_number = -1
+        for batch in self.source.iter_batches(size):
+            rows = []
+            for values in self.filter_batch(batch):
+                row_number += 1
+                if isinstance(values, hxl.model.Row):
+                    # unchanged, so pass the same list along
+                    values = values.share_values()
+                rows.append(hxl.model.Row(columns, values, row_number, shared=True))
+            if rows:
+                yield rows
+
     def __iter__(self):
+        # if the chain can select and project rows at the data source, skip the rows in between
+        values_iter = self.push_down()
+        if values_iter is not None:
+            return self._iter_pushed_down(values_iter)
         return AbstractStreamingFilter._Iterator(self)
 
+    def _iter_pushed_down(self, values_iter):
+        """Generate rows from lists of values produced by L{push_down}."""
+        columns = self.columns
+        for row_number, values in enumerate(values_iter):
+            yield hxl.model.Row(columns, values, row_number, shared=True)
+
     class _Iterator:
         """Internal iterator class to return the filtered rows.
         Note that the filtering happens here, not in the main class.
@@ -270,7 +335,9 @@ class AbstractStreamingFilter(AbstractBaseFilter):
             Uses the L{AbstractStreamingFilter.filter_row} method. The
             returned row is always a new object, so that if the client
             changes it, it won't change the version visible upstream
-            in the filter chain.
+            in the filter chain. The new row shares its list of values
+            (copy on write), so stages that don't change the values
+            don't copy them.
 
             @returns: a L{hxl.model.Row} object
 
@@ -285,8 +352,11 @@ class AbstractStreamingFilter(AbstractBaseFilter):
                 if values is not None:
                     # keep looping if filter_row(row) returned None
                     self.row_number += 1
+                    if values is row:
+                        # unchanged, so pass the same list along
+                        values = row.share_values()
                     # create a new Row object
-                    return hxl.model.Row(columns, values, self.row_number)
+                    return hxl.model.Row(columns, values, self.row_number, shared=True)
 
 
 class AbstractCachingFilter(AbstractBaseFilter):
@@ -339,6 +409,19 @@ class AbstractCachingFilter(AbstractBaseFilter):
         self._saved_rows = None
         """Cache of the output rows, for replaying."""
 
+        self._run_files = None
+        """Temporary files holding intermediate runs, for filters that can work beyond a memory limit"""
+
+        self._run_serial = 0
+
+        self._temp_dir = None
+
+    SPILL_CHUNK_SIZE = 1000
+    """Number of items to pickle together when saving a run to a temporary file"""
+
+    MERGE_FAN_IN = 64
+    """Maximum number of runs to merge (and keep open) at once"""
+
     @property
     def is_cached(self):
         """Test if the input is cached.
@@ -397,15 +480,286 @@ class AbstractCachingFilter(AbstractBaseFilter):
             self.row_number += 1
             return hxl.model.Row(self.outer.columns, next(self.values_iter), self.row_number)
 
+    def _save_run(self, run):
+        """Save a sorted run of items to a temporary file, in pickled chunks, and add it to L{_run_files}.
+        @param run: a list of picklable items
+        """
+        self._run_files.append(self._write_run(run))
+
+    def _write_run(self, items):
+        """Write items to a new temporary file, in pickled chunks.
+        @param items: an iterable of picklable items
+        @returns: the name of the new file
+        """
+        if self._temp_dir is None:
+            # removed automatically when the filter is garbage-collected
+            self._temp_dir = tempfile.TemporaryDirectory(prefix='hxl-')
+        self._run_serial += 1
+        filename = os.path.join(self._temp_dir.name, 'run{}'.format(self._run_serial))
+        items = iter(items)
+        with open(filename, 'wb') as output:
+            while True:
+                chunk = list(itertools.islice(items, self.SPILL_CHUNK_SIZE))
+                if not chunk:
+                    break
+                pickle.dump(chunk, output, pickle.HIGHEST_PROTOCOL)
+        return filename
+
+    def _merge_saved_runs(self, key, reverse=False):
+        """Merge the runs in L{_run_files}, with no more than L{MERGE_FAN_IN} files open at once.
+        If there are too many runs, merge groups of neighbouring runs into
+        longer runs first (replacing them in L{_run_files}), as many times
+        as needed. Like heapq.merge, the result keeps equal items in run order.
+        @param key: the key function for the sort order of the runs
+        @param reverse: True if the runs are sorted in reverse order
+        @returns: an iterator over the merged items
+        """
+        while len(self._run_files) > self.MERGE_FAN_IN:
+            merged_files = []
+            for i in range(0, len(self._run_files), self.MERGE_FAN_IN):
+                group = self._run_files[i:i+self.MERGE_FAN_IN]
+                if len(group) == 1:
+                    merged_files.append(group[0])
+                    continue
+                runs = [self._read_run(filename) for filename in group]
+                merged_files.append(self._write_run(heapq.merge(*runs, key=key, reverse=reverse)))
+                for filename in group:
+                    os.remove(filename)
+            self._run_files = merged_files
+        runs = [self._read_run(filename) for filename in self._run_files]
+        return heapq.merge(*runs, key=key, reverse=reverse)
+
+    @staticmethod
+    def _read_run(filename):
+        """Generate the items in a saved run, reading one chunk at a time.
+        @param filename: the name of a file written by L{_save_run}
+        """
+        with open(filename, 'rb') as input:
+            while True:
+                try:
+                    chunk = pickle.load(input)
+                except EOFError:
+                    return
+                yield from chunk
+
 
 #
 # Utility classes
 #
+class _AggregatorState(object):
+    """Base class for the running result of one aggregator for one group.
+
+    Subclasses use C{__slots__} to keep the per-group memory small,
+    and must be picklable (for saving partial results to disk, or
+    passing them between processes).
+    """
+
+    __slots__ = ()
+
+    input = 'value'
+    """What L{add} needs from each row: C{None} for nothing, C{'number'} for numbers only,
+    C{'text'} for whitespace-normalised strings, or C{'value'} for any normalised value"""
+
+    def add(self, value, normalised):
+        """Add a single value.
+        @param value: the original value
+        @param normalised: the normalised value
+        """
+        raise NotImplementedError()
+
+    def merge(self, other):
+        """Merge another state for the same group into this one.
+        The other state must come from rows I{after} the ones this state has already seen.
+        @param other: a state of the same class
+        """
+        raise NotImplementedError()
+
+    def finalise(self):
+        """@returns: the aggregated value, or C{None} if there were no usable values"""
+        raise NotImplementedError()
+
+
+class _CountState(_AggregatorState):
+    """Count rows."""
+    __slots__ = ('count',)
+    input = None
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value, normalised):
+        self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def finalise(self):
+        return self.count
+
+
+class _SumState(_AggregatorState):
+    """Sum of numeric values."""
+    __slots__ = ('total', 'count',)
+    input = 'number'
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value, normalised):
+        self.total += normalised
+        self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def finalise(self):
+        return self.total if self.count else None
+
+
+class _AverageState(_SumState):
+    """Mean of numeric values."""
+    __slots__ = ()
+
+    def finalise(self):
+        return self.total / self.count if self.count else None
+
+
+class _MinState(_AggregatorState):
+    """Minimum value (the first one seen, in case of ties)."""
+    __slots__ = ('value', 'normalised',)
+
+    def __init__(self):
+        self.value = None
+        self.normalised = None
+
+    @staticmethod
+    def _is_better(a, b):
+        """@returns: True if a should replace b"""
+        try:
+            return a < b
+        except TypeError:
+            return str(a) < str(b)
+
+    def add(self, value, normalised):
+        if self.value is None or self._is_better(normalised, self.normalised):
+            self.value = value
+            self.normalised = normalised
+
+    def merge(self, other):
+        if other.value is not None:
+            self.add(other.value, other.normalised)
+
+    def finalise(self):
+        return self.value
+
+
+class _MaxState(_MinState):
+    """Maximum value (the first one seen, in case of ties)."""
+    __slots__ = ()
+
+    @staticmethod
+    def _is_better(a, b):
+        try:
+            return a > b
+        except TypeError:
+            return str(a) > str(b)
+
+
+class _ConcatState(_AggregatorState):
+    """Sorted list of unique values, separated by "|"."""
+    __slots__ = ('values',)
+    input = 'text'
+
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value, normalised):
+        self.values.add(normalised)
+
+    def merge(self, other):
+        self.values.update(other.values)
+
+    def finalise(self):
+        return "|".join(sorted(self.values)) if self.values else None
+
+
+class _CountDistinctState(_ConcatState):
+    """Number of unique values."""
+    __slots__ = ()
+
+    def finalise(self):
+        return len(self.values)
+
+
+class _MedianState(_AggregatorState):
+    """Median of numeric values (the mean of the middle two, for an even number of values)."""
+    __slots__ = ('values',)
+    input = 'number'
+
+    def __init__(self):
+        self.values = []
+
+    def add(self, value, normalised):
+        self.values.append(normalised)
+
+    def merge(self, other):
+        self.values.extend(other.values)
+
+    def finalise(self):
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        else:
+            return (values[middle - 1] + values[middle]) / 2
+
+
+class _StddevState(_AggregatorState):
+    """Population standard deviation of numeric values.
+    Uses Welford's online algorithm, and Chan et al's formula for merging.
+    """
+    __slots__ = ('count', 'mean', 'm2',)
+    input = 'number'
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value, normalised):
+        self.count += 1
+        delta = normalised - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (normalised - self.mean)
+
+    def merge(self, other):
+        if other.count:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.count = count
+
+    def finalise(self):
+        return (self.m2 / self.count) ** 0.5 if self.count else None
+
+
 class Aggregator(object):
     """Class for aggregating a single value vertically through a dataset
 .
     This is the class that accumulates a line count, sum, min, max, or average value
-    across all rows of a dataset. Add any new aggregator types here.
+    across all rows of a dataset. Add any new aggregator types to L{STATE_CLASSES}.
+
+    The aggregator itself holds only the specification; the running
+    result for each group lives in a small state object from
+    L{make_state}, which the aggregator updates row by row. States for
+    the same group from different parts of a dataset can be combined
+    with their C{merge} method, and produce the final value only at
+    the end, with C{finalise}.
     """
 
     def __init__(self, type='count', pattern=None, column=None):
@@ -414,10 +768,14 @@ class Aggregator(object):
         @param type: the aggregator type to create, as a string
         @param pattern: the tag pattern for disaggregation (may be C{None} for just counting lines)
         @param column: the hashtag and attributes for the output column with aggregated values
-        @exception HXLFilterException: if C{pattern} is C{None} and C{type} isn't C{"count"}
+        @exception HXLFilterException: if C{pattern} is C{None} and C{type} isn't C{"count"}, or for an unrecognised aggregator type
         """
         super().__init__()
         self.type = type.lower()
+        self.state_class = Aggregator.STATE_CLASSES.get(self.type)
+        """The class of the state objects for this aggregator type"""
+        if self.state_class is None:
+            raise HXLFilterException("Bad aggregator type for count filter: {}".format(type))
         if pattern:
             self.pattern = hxl.model.TagPattern.parse(pattern)
         elif type == 'count':
@@ -427,32 +785,26 @@ class Aggregator(object):
         if not column:
             column = '{type}#meta+{type}'.format(type=self.type)
         self.column = hxl.model.Column.parse_spec(column)
+        self._state = None
 
-        self.total = 0
-        """Total number of rows used."""
-
-        self.value = None
-        """Resulting aggregation value."""
-
-        self.normalised = None
-        """Normalised value to use for internal comparison"""
-
-        self.values = set()
-        """Unique values seen (for concat)"""
+    def make_state(self):
+        """Make an empty state for aggregating a new group.
+        @returns: a new state object
+        """
+        return self.state_class()
 
-    def evaluate_row(self, row):
-        """Evaluate a single row of HXL data against this aggregator.
+    def update(self, state, row):
+        """Evaluate a single row of HXL data against a group's state.
+        @param state: the state for the row's group, from L{make_state}
         @param row: the input row to read
-        @exception HXLFilterException: for an unrecognised aggregator type
         """
+        input = self.state_class.input
 
         #
         # Shortcut: just counting rows
         #
-        if self.type == 'count':
-            if self.value is None:
-                self.value = 0
-            self.value += 1
+        if input is None:
+            state.add(None, None)
             return
 
         #
@@ -464,53 +816,57 @@ class Aggregator(object):
         if hxl.datatypes.is_empty(value):
             return
 
-        # Numbers only for sum and average
-        datatype = hxl.datatypes.typeof(value, self.pattern)
-        if self.type in ['sum', 'average'] and datatype != 'number':
-            logup("Cannot use as a numeric value for aggregation; skipping.", {"value": value})
-            logger.warning("Cannot use %s as a numeric value for aggregation; skipping.", value)
-            return
-
-        normalised = hxl.datatypes.normalise(value, self.pattern)
-        self.total += 1
-
-        # aggregate as appropriate
-        # note that we track a separate normalised value for strings and dates
-        if self.type == 'sum':
-            if self.value is None:
-                self.value = 0
-            self.value += normalised
-        elif self.type == 'average':
-            if self.value is None:
-                self.value = 0
-            self.value = ((self.value * (self.total - 1)) + normalised) / self.total
-        elif self.type == 'min':
-            def gt(a, b):
-                try:
-                    return a > b
-                except TypeError:
-                    return str(a) > str(b)
-            if self.normalised is None or gt(self.normalised, normalised):
-                self.value = value
-                self.normalised = normalised
-        elif self.type == 'max':
-            def lt(a, b):
-                try:
-                    return a < b
-                except TypeError:
-                    return str(a) < str(b)
-            if self.normalised is None or lt(self.normalised, normalised):
-                self.value = value
-                self.normalised = normalised
-        elif self.type == 'concat':
-            if not hxl.datatypes.is_empty(value):
-                value = hxl.datatypes.normalise_space(value)
-                if value not in self.values:
-                    # regenerate the list if it's a new value
-                    self.values.add(value)
-                    self.value = "|".join(sorted(self.values))
+        if input == 'number':
+            # Numbers only for sum, average, etc.
+            if hxl.datatypes.typeof(value, self.pattern) != 'number':
+                logup("Cannot use as a numeric value for aggregation; skipping.", {"value": value})
+                logger.warning("Cannot use %s as a numeric value for aggregation; skipping.", value)
+                return
+            state.add(value, hxl.datatypes.normalise_number(value))
+        elif input == 'text':
+            state.add(value, hxl.datatypes.normalise_space(value))
         else:
-            raise HXLFilterException("Bad aggregator type for count filter: {}".format(type))
+            # note that we track a separate normalised value for strings and dates
+            state.add(value, hxl.datatypes.normalise(value, self.pattern))
+
+    def evaluate_row(self, row):
+        """Evaluate a single row of HXL data against the aggregator's own running state.
+        Deprecated: use L{make_state} and L{update} instead, so that each group keeps its own state.
+        @param row: the input row to read
+        """
+        warnings.warn(
+            "Aggregator.evaluate_row() is deprecated; use make_state() and update() instead",
+            DeprecationWarning, stacklevel=2
+        )
+        if self._state is None:
+            self._state = self.make_state()
+        self.update(self._state, row)
+
+    @property
+    def value(self):
+        """The aggregated value of the rows seen by L{evaluate_row} (C{None} before the first row).
+        Deprecated: use C{finalise} on a state from L{make_state} instead.
+        """
+        warnings.warn(
+            "Aggregator.value is deprecated; use finalise() on a state from make_state() instead",
+            DeprecationWarning, stacklevel=2
+        )
+        if self._state is None:
+            return None
+        return self._state.finalise()
+
+    STATE_CLASSES = {
+        'count': _CountState,
+        'sum': _SumState,
+        'average': _AverageState,
+        'min': _MinState,
+        'max': _MaxState,
+        'concat': _ConcatState,
+        'count_distinct': _CountDistinctState,
+        'median': _MedianState,
+        'stddev': _StddevState,
+    }
+    """Map of aggregator types to classes for their per-group state"""
 
     TAG_PATTERN = r'#?{token}(?:\s*[+-]{token})*!?'.format(token=hxl.datatypes.TOKEN_PATTERN)
     """Regular expression for a tag pattern"""
@@ -593,6 +949,8 @@ class AddColumnsFilter(AbstractStreamingFilter):
 
     """
 
+    is_stateless = True
+
     def __init__(self, source, specs, before=False):
         """Construct a new AddColumnsFilter.
 
@@ -637,7 +995,9 @@ class AddColumnsFilter(AbstractStreamingFilter):
             new_columns = new_columns + self.source.columns
         else:
             new_columns = self.source.columns + new_columns
-        self.const_values = [spec[1] for spec in self.specs]
+        self.const_values = [
+            AddColumnsFilter._parse_subst(spec[1], self.source.columns) for spec in self.specs
+        ]
         return new_columns
 
     def filter_row(self, row):
@@ -645,7 +1005,7 @@ class AddColumnsFilter(AbstractStreamingFilter):
         Will execute pattern substitutions inside double braces for the fixed values.
         @returns: a list of values, including the fixed values for new columns
         """
-        values = copy.copy(row.values)
+        values = row.share_values() # not modified
         if self.before:
             return self._subst(row, self.const_values) + values
         else:
@@ -654,21 +1014,37 @@ class AddColumnsFilter(AbstractStreamingFilter):
     _SUBST_PATTERN = r'{{(.+?)}}' # non-greedy expression
     """Regular expression to parse a substitution pattern in the fixed contents for the new cell"""
 
+    @staticmethod
+    def _parse_subst(value, columns):
+        """Split a fixed value into literal text and pre-parsed formulas.
+        @param value: the fixed value, possibly containing substitutions in double braces
+        @param columns: the source columns, for resolving tag patterns in the formulas
+        @returns: the value itself if there are no substitutions, or a list
+        alternating literal strings and L{hxl.formulas.eval.Formula} objects
+        """
+        parts = re.split(AddColumnsFilter._SUBST_PATTERN, value)
+        if len(parts) == 1:
+            return value
+        for i in range(1, len(parts), 2):
+            parts[i] = feval.compile(parts[i]).bind(columns)
+        return parts
+
     def _subst(self, row, const_values):
         """Execute pattern substitutions for fixed values for the new columns.
         Substitutions are tag patterns inside double braces. Example: "X-{{#country+code}}"
         @param row: the row to search for matches to any patterns.
-        @param const_values: the constant values to scan for patterns
+        @param const_values: the constant values, as prepared by L{_parse_subst}
         @returns: the constant values (only) with substitutions executed
         """
-        def do_sub(match_object):
-            # FIXME don't want to reparse the formula for every row
-            # Need to pre-parse and pre-chunk the replacement string
-            result = feval.eval(row, match_object.group(1))
-            return str(result)
         values = []
         for value in const_values:
-            values.append(re.sub(AddColumnsFilter._SUBST_PATTERN, do_sub, value))
+            if isinstance(value, list):
+                # odd-numbered parts are formulas
+                values.append(''.join(
+                    str(part.eval(row)) if i % 2 else part for i, part in enumerate(value)
+                ))
+            else:
+                values.append(value)
         return values
 
     SPEC_PATTERN = r'^\s*(?:([^#]*?)#)?({token}(?:\s*\+{token})*)=(.*)\s*$'.format(token=hxl.datatypes.TOKEN_PATTERN)
@@ -763,6 +1139,14 @@ class AppendFilter(AbstractBaseFilter):
     In the second dataset, this filter will include I{only} rows where
     the value "UNICEF" appears under the C{#org} tag.
 
+    Append sources given as URLs or filenames (rather than
+    L{hxl.model.Dataset} objects) are opened, and their headers read,
+    concurrently in up to I{workers} background threads, so that
+    a long list of remote sources doesn't have to download one after
+    another. The constructor waits for all of them, and raises the
+    first error in source order (as it would opening them one at a
+    time). The rows still come out in the original order.
+
     This class class is a special case, neither a L{streaming
     filter<AbstractStreamingFilter>} nor a L{caching
     filter<AbstractCachingFilter>}; instead, it streams two separate
@@ -775,7 +1159,10 @@ class AppendFilter(AbstractBaseFilter):
 
     """
 
-    def __init__(self, source, append_sources, add_columns=True, queries=[]):
+    PREFETCH_WORKERS = 4
+    """Default maximum number of threads for opening append sources concurrently"""
+
+    def __init__(self, source, append_sources, add_columns=True, queries=[], workers=None, input_options=None):
         """Construct a new I{AppendFilter}
         @param source: a L{hxl.model.Dataset} object for the principal data
         @param append_sources: one or more L{hxl.model.Dataset} objects for the dataset to append (or strings containing URLs)
@@ -783,13 +1170,19 @@ class AppendFilter(AbstractBaseFilter):
         @param queries: optional list of L{hxl.model.RowQuery} objects
         (or a single strig) to select which rows to include from the
         second dataset
+        @param workers: maximum number of threads for opening append sources concurrently (1 to open them one at a time)
+        @param input_options: optional L{hxl.input.InputOptions} for opening append sources given as URLs or filenames
         """
         super(AppendFilter, self).__init__(source)
 
         # parameters
         if is_sourcey(append_sources):
             append_sources = [append_sources]
-        self.append_sources = [hxl.data(src) for src in append_sources] # so that we can take a plain URL
+        self.workers = workers if workers is not None else AppendFilter.PREFETCH_WORKERS
+        """Maximum number of threads for opening append sources"""
+        self.input_options = input_options
+        """Options for opening append sources"""
+        self.append_sources = self._open_sources(list(append_sources)) # so that we can take a plain URL
         """The sources to append to this source"""
         self.add_extra_columns = add_columns
         """If true, always add new columns instead of replacing existing ones"""
@@ -802,6 +1195,39 @@ class AppendFilter(AbstractBaseFilter):
         self._template_row = []
         """Empty template for appending to each row (will copy and fill in as needed"""
 
+    def _open_sources(self, append_sources):
+        """Open append sources and read their columns, using background threads.
+        Sources that are already L{hxl.model.Dataset} objects are used as-is.
+        If a source fails, cancels the sources that haven't started opening yet.
+        @param append_sources: a list of append sources
+        @returns: a list of datasets, in the original order
+        @exception: the first exception from opening a source, in source order
+        """
+        if self.workers <= 1 or all(isinstance(src, hxl.model.Dataset) for src in append_sources):
+            return [hxl.data(src, self.input_options) for src in append_sources]
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hxl-append')
+        pending = [
+            src if isinstance(src, hxl.model.Dataset) else executor.submit(self._open_source, src)
+            for src in append_sources
+        ]
+        try:
+            return [src.result() if isinstance(src, concurrent.futures.Future) else src for src in pending]
+        except:
+            for src in pending:
+                if isinstance(src, concurrent.futures.Future):
+                    src.cancel()
+            raise
+        finally:
+            # don't wait for sources still opening after an error
+            executor.shutdown(wait=False)
+
+    def _open_source(self, src):
+        """Open an append source and read its columns (runs in a background thread)."""
+        source = hxl.data(src, self.input_options)
+        source.columns
+        return source
+
     def filter_columns(self):
         """Internal: generate the columns for the combined dataset
         We expect this method to run only once.
@@ -920,7 +1346,8 @@ class AppendFilter(AbstractBaseFilter):
             source=source,
             append_sources=append_sources,
             add_columns=opt_arg(spec, 'add_columns', True),
-            queries=opt_arg(spec, 'queries', [])
+            queries=opt_arg(spec, 'queries', []),
+            workers=opt_arg(spec, 'workers', None)
         )
 
 
@@ -966,22 +1393,43 @@ class CacheFilter(AbstractBaseFilter):
 
       filter = hxl.data(url).replace_data_map(map_url).cache().with_rows('org=UNICEF')
 
+    To cache datasets too large for memory, set I{max_memory} (in
+    bytes). The filter keeps rows in memory up to that limit, then
+    saves the rest to a temporary file and reads them back from there
+    on every iteration after the first::
+
+      filter = hxl.data(url).cache(max_memory=500000000)
+
     """
 
-    def __init__(self, source, max_rows=None):
+    SPILL_CHUNK_SIZE = 1000
+    """Number of rows to pickle together when saving rows to the temporary file"""
+
+    def __init__(self, source, max_rows=None, max_memory=None):
         """Constructor
         @param source: the upstream data source
         @param max_rows: if >0, maximum number of rows to cache
+        @param max_memory: if set, the approximate maximum memory in bytes to use for rows, saving the rest to a temporary file
         """
         super().__init__(source)
 
         self.max_rows = max_rows
         """Maximum number of rows to keep in the cache (-1 means no limit)"""
 
+        self.max_memory = max_memory
+        """Approximate maximum memory to use for the rows in L{cached_rows} (None means no limit)"""
+
         self.overflow = False
         """Flag for whether there were more rows than L{max_rows} available."""
 
         self.cached_rows = None
+        """Rows cached in memory"""
+
+        self._spill_path = None
+        """Temporary file with rows after L{cached_rows}, if they didn't fit in memory"""
+
+        self._spill_columns = None
+        self._temp_dir = None
 
     @property
     def is_cached(self):
@@ -995,24 +1443,79 @@ class CacheFilter(AbstractBaseFilter):
 
         # if we haven't read the source yet, cache some rows
         if self.cached_rows is None:
-            self.cached_rows = []
+            self._read_source()
+
+        # return the iterator over the cached rows (repeatable)
+        if self._spill_path is None:
+            return iter(self.cached_rows)
+        else:
+            return itertools.chain(self.cached_rows, self._read_spilled())
+
+    def _read_source(self):
+        """Read and cache the rows from the source, saving them to a temporary file beyond L{max_memory}."""
+        self.cached_rows = []
+        memory = 0
+        output = None
+        chunk = []
+
+        try:
             for row_number, row in enumerate(self.source):
                 # is there a limit?
                 if self.max_rows is not None and row_number >= self.max_rows:
                     self.overflow = True
                     break
+                elif output is not None:
+                    chunk.append((row._values, row.row_number, row.source_row_number,))
+                    if len(chunk) >= self.SPILL_CHUNK_SIZE:
+                        pickle.dump(chunk, output, pickle.HIGHEST_PROTOCOL)
+                        chunk = []
                 else:
                     self.cached_rows.append(row)
-
-        # return the iterator over the cached rows (repeatable)
-        return iter(self.cached_rows)
+                    if self.max_memory is not None:
+                        memory += _estimate_memory(row._values)
+                        if memory >= self.max_memory:
+                            # no more room: save the rest to disk
+                            output = self._open_spill(row.columns)
+            if chunk:
+                pickle.dump(chunk, output, pickle.HIGHEST_PROTOCOL)
+        finally:
+            if output is not None:
+                output.close()
+
+    def _open_spill(self, columns):
+        """Open the temporary file for rows that don't fit in memory.
+        @param columns: the columns for the saved rows
+        @returns: the open file, for writing
+        """
+        # removed automatically when the filter is garbage-collected
+        self._temp_dir = tempfile.TemporaryDirectory(prefix='hxl-')
+        self._spill_path = os.path.join(self._temp_dir.name, 'cache')
+        self._spill_columns = columns
+        return open(self._spill_path, 'wb')
+
+    def _read_spilled(self):
+        """Generate the rows saved to the temporary file, with their original row numbers."""
+        columns = self._spill_columns
+        with open(self._spill_path, 'rb') as input:
+            while True:
+                try:
+                    chunk = pickle.load(input)
+                except EOFError:
+                    return
+                for values, row_number, source_row_number in chunk:
+                    yield hxl.model.Row(columns, values, row_number, source_row_number)
 
     @staticmethod
     def _load(source, spec):
-        """Create a new CacheFilter from a dict spec."""
+        """Create a new CacheFilter from a dict spec.
+        If the spec has a true "columnar" property, create a L{ColumnarCacheFilter} instead.
+        """
+        if opt_arg(spec, 'columnar', False):
+            return ColumnarCacheFilter._load(source, spec)
         return CacheFilter(
             source=source,
-            max_rows=opt_arg(spec, 'max_rows', None)
+            max_rows=opt_arg(spec, 'max_rows', None),
+            max_memory=opt_arg(spec, 'max_memory', None)
         )
 
 
@@ -1068,6 +1571,17 @@ class CleanDataFilter(AbstractStreamingFilter):
     replacements using string and regular-expression patterns.
     """
 
+    is_stateless = True
+
+    DATE_CACHE_SIZE = 4096
+    """Maximum number of distinct date strings to remember normalised values for"""
+
+    WHITESPACE_REGEX = re.compile(r'\s+')
+
+    NON_NUMBER_REGEX = re.compile(r'[^\de.]+')
+
+    DAYFIRST_REGEX = re.compile(r'^[^\d]*(\d\d?)[^\d]+(\d\d?)[^\d].*$')
+
     def __init__(
             self, source, whitespace=False, upper=[], lower=[], date=[], date_format=None,
             number=[], number_format=None, latlon=[], purge=False, queries=[]):
@@ -1110,19 +1624,93 @@ class CleanDataFilter(AbstractStreamingFilter):
         if date:
             self.source = self.source.cache();
             self.date_dayfirst = self._guess_dayfirst()
+        self._date_cache = {}
+
+        self._plan = self._compile_plan(self.columns)
+        """List of (column index, tuple of cleaning operations) for the columns to clean"""
 
     def filter_row(self, row):
         """@returns: cleaned row data"""
-        if hxl.model.RowQuery.match_list(row, self.queries):
+        if self._plan and hxl.model.RowQuery.match_list(row, self.queries):
             # if there are no queries, or row matches at least one
-            columns = self.columns
-            values = copy.copy(row.values)
-            for i in range(min(len(values), len(columns))):
-                values[i] = self._clean_value(values[i], columns[i])
-            return values
+            return self._clean_values(row.copy_values())
         else:
             # otherwise, leave as-is
-            return row.values
+            return row
+
+    def filter_batch(self, rows):
+        """@returns: cleaned data for a batch of rows"""
+        if not self._plan:
+            return list(rows)
+        match_list = hxl.model.RowQuery.match_list
+        clean_values = self._clean_values
+        queries = self.queries
+        return [clean_values(row.copy_values()) if match_list(row, queries) else row for row in rows]
+
+    def _clean_values(self, values):
+        """Apply the cleaning plan to a list of row values, in place.
+        Columns without any cleaning operations are left untouched.
+        @param values: a private copy of the row values
+        @returns: the same list, cleaned
+        """
+        width = len(values)
+        for index, operations in self._plan:
+            if index < width:
+                value = str(values[index])
+                for operation in operations:
+                    value = operation(value)
+                values[index] = value
+        return values
+
+    def _compile_plan(self, columns):
+        """Work out once which cleaning operations apply to each column.
+        @param columns: the list of columns
+        @returns: a list of (column index, tuple of operations) for columns with at least one operation
+        """
+        plan = []
+        for index, column in enumerate(columns):
+            operations = self._make_operations(column)
+            if operations:
+                plan.append((index, operations,))
+        return plan
+
+    def _make_operations(self, column):
+        """Choose the cleaning operations for a column, in the order they apply.
+        @param column: the column definition
+        @returns: a tuple of functions, each taking and returning a string value
+        """
+        operations = []
+
+        # Whitespace (-w)
+        if self._match_patterns(self.whitespace, column):
+            operations.append(self._clean_whitespace)
+
+        # Uppercase (-u)
+        if self._match_patterns(self.upper, column):
+            operations.append(str.upper)
+
+        # Lowercase (-l)
+        if self._match_patterns(self.lower, column):
+            operations.append(str.lower)
+
+        # Date
+        if self._match_patterns(self.date, column):
+            operations.append(self._clean_date)
+
+        # Number
+        if self._match_patterns(self.number, column):
+            operations.append(self._clean_number)
+
+        # Latlon
+        if self._match_patterns(self.latlon, column):
+            if 'lat' in column.attributes:
+                operations.append(self._clean_lat)
+            elif 'lon' in column.attributes:
+                operations.append(self._clean_lon)
+            elif 'coord' in column.attributes:
+                operations.append(self._clean_coord)
+
+        return tuple(operations)
 
     def _guess_dayfirst(self):
         """Guess whether the default should be DD-MM-YYYY or MM-DD-YYYY
@@ -1141,9 +1729,9 @@ class CleanDataFilter(AbstractStreamingFilter):
         if indices:
             for row in self.source:
                 for i in indices:
-                    value = row.values[i]
+                    value = row[i]
                     if value:
-                        result = re.match(r'^[^\d]*(\d\d?)[^\d]+(\d\d?)[^\d].*$', hxl.datatypes.normalise_string(value))
+                        result = self.DAYFIRST_REGEX.match(hxl.datatypes.normalise_string(value))
                         if result:
                             if int(result.group(1)) > 12:
                                 ddmm_count += 1
@@ -1153,98 +1741,98 @@ class CleanDataFilter(AbstractStreamingFilter):
         return (ddmm_count >= mmdd_count)
 
 
-    def _clean_value(self, value, column):
-        """Clean a single value, using the column def for guidance.
-        @returns: a single cleaned value
-        """
-        value = str(value)
-
-        # Whitespace (-w)
-        if self._match_patterns(self.whitespace, column):
-            value = re.sub(r'^\s+', '', value)
-            value = re.sub(r'\s+$', '', value)
-            value = re.sub(r'\s+', ' ', value)
+    def _clean_whitespace(self, value):
+        """Strip leading and trailing whitespace, and normalise internal whitespace to a single space."""
+        return self.WHITESPACE_REGEX.sub(' ', value.strip())
 
-        # Uppercase (-u)
-        if self._match_patterns(self.upper, column):
-            value = value.upper()
+    def _clean_date(self, value):
+        """Normalise a date (memoised, since date columns tend to repeat the same values)."""
+        if not value:
+            return value
+        result = self._date_cache.get(value)
+        if result is None:
+            if len(self._date_cache) >= self.DATE_CACHE_SIZE:
+                self._date_cache.clear()
+            result = self._date_cache[value] = self._normalise_date(value)
+        return result
 
-        # Lowercase (-l)
-        if self._match_patterns(self.lower, column):
-            value = value.lower()
+    def _normalise_date(self, value):
+        """Normalise a non-empty date string (see L{_clean_date})."""
+        try:
+            value = hxl.datatypes.normalise_date(value, self.date_dayfirst)
+            if self.date_format is not None:
+                value = dateutil.parser.parse(value).strftime(self.date_format)
+        except ValueError:
+            logup("Cannot use as a date", {"value": value})
+            logger.warning('Cannot parse %s as a date', str(value))
+            if self.purge:
+                value = ''
+        return value
 
-        # Date
-        if self._match_patterns(self.date, column):
-            if value:
-                try:
-                    value = hxl.datatypes.normalise_date(value, self.date_dayfirst)
-                    if self.date_format is not None:
-                        value = dateutil.parser.parse(value).strftime(self.date_format)
-                except ValueError:
-                    logup("Cannot use as a date", {"value": value})
-                    logger.warning('Cannot parse %s as a date', str(value))
-                    if self.purge:
-                        value = ''
+    def _clean_number(self, value):
+        """Normalise a number."""
 
-        # Number
-        if self._match_patterns(self.number, column):
+        def try_number(s):
+            try:
+                n = float(s)
+                if self.number_format:
+                    return format(n, self.number_format)
+                elif n.is_integer():
+                    return str(int(n))
+                else:
+                    return str(n)
+            except:
+                return None
 
-            def try_number(s):
-                try:
-                    n = float(s)
-                    if self.number_format:
-                        return format(n, self.number_format)
-                    elif n.is_integer():
-                        return str(int(n))
-                    else:
-                        return str(n)
-                except:
-                    return None
+        # fixme - get much smarter about numbers
+        if value:
+            n = try_number(value)
+            if n is None:
+                s = self.NON_NUMBER_REGEX.sub('', value)
+                n = try_number(s) # OK, try again
+            if n is not None:
+                value = n
+            else:
+                logup('Cannot parse as a number', {"value": value})
+                logger.warning('Cannot parse %s as a number', str(value))
+                if self.purge:
+                    value = ''
+        return value
 
-                # fixme - get much smarter about numbers
-            if value:
-                n = try_number(value)
-                if n is None:
-                    s = re.sub(r'[^\de.]+', '', value)
-                    n = try_number(s) # OK, try again
-                if n is not None:
-                    value = n
-                else:
-                    logup('Cannot parse as a number', {"value": value})
-                    logger.warning('Cannot parse %s as a number', str(value))
-                    if self.purge:
-                        value = ''
+    def _clean_lat(self, value):
+        """Normalise a latitude."""
+        lat = hxl.geo.parse_lat(value)
+        if lat is not None:
+            value = format(lat, '0.4f')
+        else:
+            logup('Cannot parse as a latitude', {"value": value})
+            logger.warning('Cannot parse %s as a latitude', str(value))
+            if self.purge:
+                value = ''
+        return value
 
-        # Latlon
-        if self._match_patterns(self.latlon, column):
-            if 'lat' in column.attributes:
-                lat = hxl.geo.parse_lat(value)
-                if lat is not None:
-                    value = format(lat, '0.4f')
-                else:
-                    logup('Cannot parse as a latitude', {"value": value})
-                    logger.warning('Cannot parse %s as a latitude', str(value))
-                    if self.purge:
-                        value = ''
-            elif 'lon' in column.attributes:
-                lon = hxl.geo.parse_lon(value)
-                if lon is not None:
-                    value = format(lon, '0.4f')
-                else:
-                    logup('Cannot parse as a longitude', {"value": value})
-                    logger.warning('Cannot parse %s as a longitude', str(value))
-                    if self.purge:
-                        value = ''
-            elif 'coord' in column. attributes:
-                coord = hxl.geo.parse_coord(value)
-                if coord is not None:
-                    value = '{:.4f},{:.4f}'.format(coord[0], coord[1])
-                else:
-                    logup('Cannot parse as geographical coordinates', {"value": value})
-                    logger.warning('Cannot parse %s as geographical coordinates', str(value))
-                    if self.purge:
-                        value = ''
+    def _clean_lon(self, value):
+        """Normalise a longitude."""
+        lon = hxl.geo.parse_lon(value)
+        if lon is not None:
+            value = format(lon, '0.4f')
+        else:
+            logup('Cannot parse as a longitude', {"value": value})
+            logger.warning('Cannot parse %s as a longitude', str(value))
+            if self.purge:
+                value = ''
+        return value
 
+    def _clean_coord(self, value):
+        """Normalise geographical coordinates."""
+        coord = hxl.geo.parse_coord(value)
+        if coord is not None:
+            value = '{:.4f},{:.4f}'.format(coord[0], coord[1])
+        else:
+            logup('Cannot parse as geographical coordinates', {"value": value})
+            logger.warning('Cannot parse %s as geographical coordinates', str(value))
+            if self.purge:
+                value = ''
         return value
 
     def _match_patterns(self, patterns, column):
@@ -1313,6 +1901,8 @@ class ColumnFilter(AbstractStreamingFilter):
 
     """
 
+    is_stateless = True
+
     def __init__(self, source, include_tags=[], exclude_tags=[], skip_untagged=False):
         """Construct a column filter.
         @param source: a L{hxl.model.Dataset}
@@ -1338,14 +1928,51 @@ class ColumnFilter(AbstractStreamingFilter):
 
     def filter_row(self, row):
         """@returns: filtered list of row values"""
+        row_values = row.share_values() # not modified
         values = []
         for i in self.indices:
             try:
-                values.append(row.values[i])
+                values.append(row_values[i])
             except IndexError:
                 pass # don't add anything
         return values
 
+    def filter_batch(self, rows):
+        """@returns: filtered lists of row values for a batch of rows"""
+        indices = self.indices
+        if not indices:
+            return [[] for row in rows]
+        width = max(indices) + 1
+        if len(indices) == 1:
+            index = indices[0]
+            get_values = lambda values: [values[index]]
+        else:
+            getter = operator.itemgetter(*indices)
+            get_values = lambda values: list(getter(values))
+        result = []
+        for row in rows:
+            values = row.share_values() # not modified
+            if len(values) >= width:
+                result.append(get_values(values))
+            else:
+                # short row: skip the missing values
+                result.append([values[i] for i in indices if i < len(values)])
+        return result
+
+    def push_down(self, predicate=None, indices=None):
+        """Pass the column selection down to the source, if it supports it.
+        Predicates can't be passed through (they apply to this filter's columns, not the source's).
+        @see: L{hxl.model.Dataset.push_down}
+        """
+        if predicate is not None or type(self).filter_row is not ColumnFilter.filter_row:
+            return None
+        self.columns # make sure we have the indices
+        if indices is None:
+            indices = self.indices
+        else:
+            indices = [self.indices[i] for i in indices if i < len(self.indices)]
+        return self.source.push_down(None, indices)
+
     def _test_column(self, column):
         """Test whether a column should be included in the output.  If there
         is an include list, it must be in that list; if there is an
@@ -1397,46 +2024,292 @@ class ColumnFilter(AbstractStreamingFilter):
             )
 
 
-class CountFilter(AbstractCachingFilter):
-    """Composable filter class to aggregate rows in a HXL dataset (like a pivot table)
+class ColumnarCacheFilter(AbstractBaseFilter):
+    """Composable filter to cache HXL data in memory, column by column.
 
-    This class supports the L{hxl.model.Dataset.count} convenience
-    method and the L{hxl.scripts.hxlcount} command-line script.
+    This filter supports the L{hxl.model.Dataset.cache} method with
+    C{columnar=True}, and has no corresponding command-line script.
 
-    This is a L{caching filter<AbstractCachingFilter>} that performs
-    aggregate actions such as counting, summing, and averaging across
-    multiple rows of data. For example, it can reduce a dataset to a
-    list of the number of times that each organisation or sector
-    appears. This is the main filter for producing reports, or the
-    data underlying charts and other visualisations; it is also useful
-    for anonymising data by rolling it up to higher levels of
-    abstraction.
+    Like L{CacheFilter}, this filter reads its source only once, and
+    can replay the data as often as needed; unlike L{CacheFilter}, it
+    stores each column as a single list of interned strings rather
+    than keeping a L{hxl.model.Row} object for every row. Repeated
+    values (like organisation or sector names) share the same string
+    object, so the cache uses much less memory for typical
+    humanitarian data.
 
-    This example counts the number of rows for each organisation::
+    Iterating over the filter still produces ordinary
+    L{hxl.model.Row} objects, so it works anywhere in a filter
+    chain, but some operations recognise the
+    L{columnar<hxl.model.Dataset.is_columnar>} protocol and work a
+    column at a time instead: L{hxl.model.Dataset.min},
+    L{hxl.model.Dataset.max}, L{hxl.model.Dataset.get_value_set},
+    L{SortFilter}, and L{CountFilter}.
 
-      filter = CountFilter(hxl.data(url), 'org')
+    Usage::
 
-      # or
+      source = hxl.data(url).cache(columnar=True)
+      total = source.count('org')
+      latest = source.max('#date')
 
-      filter = hxl.data(url).count('org')
+    The filter can also produce typed versions of a column on request
+    (see L{get_column_numbers} and L{get_column_dates}). These are
+    computed once per distinct value, the first time they're needed.
 
-    You can do multiple levels of counting like this::
+    """
 
-      filter = hxl.data(url).count(['org', 'sector'])
+    def __init__(self, source):
+        """Constructor
+        @param source: the upstream data source
+        """
+        super().__init__(source)
 
-    You can also use the I{queries} argument to limit the counting to
-    specific fields. This example will count only the rows where C{#adm1} is set to "Coast"::
+        self.row_count = None
+        """Number of rows in the cache (None until the source is read)"""
 
-      filter = hxl.data(url).count('org', queries='adm1=Coast')
-    """
+        self.min_length = 0
+        """Length of the shortest row in the cache (cells below this index are never missing)"""
 
-    def __init__(self, source, patterns, aggregators=None, queries=[]):
-        """Construct a new count filter
+        self.data = None
+        """List of columns, each one a list of values (None for a cell missing from a short row)"""
+
+        self.lengths = None
+        """Original length of each row"""
+
+        self.row_numbers = None
+        """Original logical row number for each row (-1 for None)"""
+
+        self.source_row_numbers = None
+        """Original source row number for each row (-1 for None)"""
+
+        self._numbers = {}
+        """Lazily-computed number values, by column index"""
+
+        self._dates = {}
+        """Lazily-computed date values, by column index"""
+
+    @property
+    def is_cached(self):
+        return True
+
+    @property
+    def is_columnar(self):
+        return True
+
+    def filter_columns(self):
+        """@returns: a deep copy of the source columns"""
+        return copy.deepcopy(self.source.columns)
+
+    def __iter__(self):
+        self._read_source()
+        columns = self.columns
+        data = self.data
+        for row_index in range(self.row_count):
+            yield hxl.model.Row(
+                columns,
+                self._get_row_values(row_index),
+                ColumnarCacheFilter._unpack_number(self.row_numbers[row_index]),
+                ColumnarCacheFilter._unpack_number(self.source_row_numbers[row_index])
+            )
+
+    def get_column_count(self):
+        """Get the number of data columns in the cache.
+        This may be more than the number of L{columns<hxl.model.Dataset.columns>}, if
+        some rows have extra, untagged values.
+        @returns: the number of data columns
+        """
+        self._read_source()
+        return len(self.data)
+
+    def get_column_values(self, index):
+        """Get all of the values in a single column.
+        The list is shared with the cache, so callers must not modify it.
+        @param index: the 0-based column index
+        @returns: a list of values, one for each row (None for cells missing from short rows)
+        """
+        self._read_source()
+        return self.data[index]
+
+    def get_column_value_set(self, index):
+        """Get the distinct values in a single column.
+        @param index: the 0-based column index
+        @returns: a set of values, excluding cells missing from short rows
+        """
+        value_set = set(self.get_column_values(index))
+        value_set.discard(None)
+        return value_set
+
+    def get_column_numbers(self, index):
+        """Get the numeric values in a single column.
+        Computed once per distinct value, and saved for future calls.
+        @param index: the 0-based column index
+        @returns: a list of numbers, one for each row (None for non-numeric values)
+        @see: L{hxl.datatypes.normalise_number}
+        """
+        numbers = self._numbers.get(index)
+        if numbers is None:
+            numbers = self._numbers[index] = ColumnarCacheFilter._map_column(
+                self.get_column_values(index), hxl.datatypes.normalise_number
+            )
+        return numbers
+
+    def get_column_dates(self, index):
+        """Get the date values in a single column, as ISO 8601 strings.
+        Computed once per distinct value, and saved for future calls.
+        @param index: the 0-based column index
+        @returns: a list of date strings, one for each row (None for non-date values)
+        @see: L{hxl.datatypes.normalise_date}
+        """
+        dates = self._dates.get(index)
+        if dates is None:
+            dates = self._dates[index] = ColumnarCacheFilter._map_column(
+                self.get_column_values(index), hxl.datatypes.normalise_date
+            )
+        return dates
+
+    def _read_source(self):
+        """Read the source into the column lists, if we haven't already."""
+        if self.data is not None:
+            return
+
+        data = []
+        lengths = []
+        row_numbers = []
+        source_row_numbers = []
+        interned = {}
+        min_length = None
+
+        for row_index, row in enumerate(self.source):
+            values = row.share_values() # not modified
+            length = len(values)
+            # add any new columns, padded for earlier rows
+            while len(data) < length:
+                data.append([None] * row_index)
+            for column_index, column in enumerate(data):
+                if column_index < length:
+                    value = values[column_index]
+                    # intern strings so that repeated values share storage
+                    if isinstance(value, str):
+                        value = interned.setdefault(value, value)
+                    column.append(value)
+                else:
+                    column.append(None)
+            lengths.append(length)
+            row_numbers.append(ColumnarCacheFilter._pack_number(row.row_number))
+            source_row_numbers.append(ColumnarCacheFilter._pack_number(row.source_row_number))
+            if min_length is None or length < min_length:
+                min_length = length
+
+        self.lengths = lengths
+        self.row_numbers = row_numbers
+        self.source_row_numbers = source_row_numbers
+        self.row_count = len(lengths)
+        self.min_length = min_length or 0
+        self.data = data
+
+    def _get_row_values(self, row_index):
+        """Reconstruct the list of values for a single row."""
+        return [column[row_index] for column in self.data[:self.lengths[row_index]]]
+
+    @staticmethod
+    def _map_column(values, f):
+        """Apply a conversion function to every value in a column, once per distinct value.
+        @param values: the column values
+        @param f: the function to apply (returns the converted value or raises ValueError)
+        @returns: a list of converted values (None where the conversion failed)
+        """
+        converted = {None: None}
+        def convert(value):
+            try:
+                return f(value)
+            except (ValueError, TypeError, OverflowError):
+                return None
+        result = []
+        for value in values:
+            if value not in converted:
+                converted[value] = convert(value)
+            result.append(converted[value])
+        return result
+
+    @staticmethod
+    def _pack_number(n):
+        return -1 if n is None else n
+
+    @staticmethod
+    def _unpack_number(n):
+        return None if n == -1 else n
+
+    @staticmethod
+    def _load(source, spec):
+        """Create a new ColumnarCacheFilter from a dict spec."""
+        return ColumnarCacheFilter(
+            source=source
+        )
+
+
+class CountFilter(AbstractCachingFilter):
+    """Composable filter class to aggregate rows in a HXL dataset (like a pivot table)
+
+    This class supports the L{hxl.model.Dataset.count} convenience
+    method and the L{hxl.scripts.hxlcount} command-line script.
+
+    This is a L{caching filter<AbstractCachingFilter>} that performs
+    aggregate actions such as counting, summing, and averaging across
+    multiple rows of data. For example, it can reduce a dataset to a
+    list of the number of times that each organisation or sector
+    appears. This is the main filter for producing reports, or the
+    data underlying charts and other visualisations; it is also useful
+    for anonymising data by rolling it up to higher levels of
+    abstraction.
+
+    This example counts the number of rows for each organisation::
+
+      filter = CountFilter(hxl.data(url), 'org')
+
+      # or
+
+      filter = hxl.data(url).count('org')
+
+    You can do multiple levels of counting like this::
+
+      filter = hxl.data(url).count(['org', 'sector'])
+
+    You can also use the I{queries} argument to limit the counting to
+    specific fields. This example will count only the rows where C{#adm1} is set to "Coast"::
+
+      filter = hxl.data(url).count('org', queries='adm1=Coast')
+
+    If there are too many groups to fit in memory, set I{memory_limit}
+    (in bytes) or I{max_groups}. When the filter reaches the limit, it
+    saves its partial results, sorted by key, to a temporary file and
+    starts again; at the end, it merges the saved partial results,
+    producing the same output without holding all of the groups in
+    memory.
+
+    If the source is already sorted on the grouping patterns (for
+    example, by a L{SortFilter}), set I{presorted} to stream the
+    output instead: the filter emits each group as soon as its key
+    changes, using memory for only one group at a time, and leaves the
+    groups in their input order. Set I{check_sorted} as well to raise
+    an exception if the input turns out not to be sorted the way
+    L{SortFilter} would sort it (in either direction).
+    """
+
+    GROUP_MEMORY = 100
+    """Approximate memory used by each aggregator state for a single group, in bytes (for I{memory_limit})"""
+
+    def __init__(self, source, patterns, aggregators=None, queries=[], memory_limit=None, max_groups=None,
+                 presorted=False, check_sorted=False):
+        """Construct a new count filter
         If the caller does not supply any aggregators, use "count() as Count#meta+count"
         @param source: a L{hxl.model.Dataset}
         @param patterns: a single L{tag pattern<hxl.model.TagPattern>} or list of tag patterns that, together, form a unique key for counting.
         @param aggregators: one or more Aggregator objects or string representations to define the output.
         @param queries: an optional list of L{row queries<hxl.model.RowQuery>} to filter the rows being counted.
+        @param memory_limit: if set, the approximate maximum memory in bytes to use for groups being aggregated
+        @param max_groups: if set, the maximum number of groups to aggregate in memory at once
+        @param presorted: if True, the source is already sorted on the patterns, so stream the groups
+        @param check_sorted: if True (with I{presorted}), raise an exception if the source isn't sorted
         """
         super().__init__(source)
         self.patterns = hxl.model.TagPattern.parse_list(patterns)
@@ -1444,6 +2317,20 @@ class CountFilter(AbstractCachingFilter):
             aggregators = 'count() as Count#meta+count'
         self.aggregators = Aggregator.parse_list(aggregators)
         self.queries = self._setup_queries(queries)
+        self.memory_limit = memory_limit
+        self.max_groups = max_groups
+        self.presorted = presorted
+        self.check_sorted = check_sorted
+
+    @property
+    def is_cached(self):
+        """Test if the output can be replayed.
+        @returns: C{True}, unless I{presorted} is set and the source can't be replayed
+        """
+        if self.presorted:
+            return self.source.is_cached
+        else:
+            return True
 
     def filter_columns(self):
         """@returns: the filtered columns"""
@@ -1466,37 +2353,219 @@ class CountFilter(AbstractCachingFilter):
     def filter_rows(self):
         """@returns: the filtered row values"""
 
-        raw_data = []
+        # each item is a sequence containing a tuple of key values and a list of aggregator states
+        return [CountFilter._make_values(key, states) for key, states in self._aggregate_data()]
 
-        # each item is a sequence containing a tuple of key values and an _Aggregator object
-        for aggregate in self._aggregate_data():
-            raw_data.append(
-                list(aggregate[0]) + [aggregator.value if aggregator.value is not None else '' for aggregator in aggregate[1]]
-            )
+    def __iter__(self):
+        if self.presorted:
+            return self._iter_presorted()
+        elif self.memory_limit is None and self.max_groups is None:
+            return super().__iter__()
+        else:
+            return self._iter_external()
+
+    @staticmethod
+    def _make_values(key, states):
+        """Make a row of output values from a key and its aggregator states."""
+        values = list(key)
+        for state in states:
+            value = state.finalise()
+            values.append(value if value is not None else '')
+        return values
+
+    def _make_states(self):
+        """Make a fresh set of aggregator states for a new group."""
+        return [aggregator.make_state() for aggregator in self.aggregators]
 
-        return raw_data
+    def _update_states(self, states, row):
+        """Evaluate a row against a group's aggregator states."""
+        for aggregator, state in zip(self.aggregators, states):
+            aggregator.update(state, row)
+
+    def _make_key(self, row):
+        """Make the grouping key for a row."""
+        return tuple(hxl.datatypes.normalise_space(row.get(pattern, default='')) for pattern in self.patterns)
 
     def _aggregate_data(self):
         """Read the entire source dataset and produce saved aggregate data.
         @returns: the aggregated values as raw data
         """
-        aggregators = {}
+        groups = {}
+
+        def get_states(key):
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = self._make_states()
+            return states
+
+        if self.source.is_columnar and self.patterns:
+            # build the keys a column at a time
+            keys = zip(*[self._get_columnar_keys(pattern) for pattern in self.patterns])
+            if not self.queries and all(aggregator.type == 'count' for aggregator in self.aggregators):
+                # just counting: no need to look at the rows at all
+                for key, count in collections.Counter(keys).items():
+                    for state in get_states(key):
+                        state.count = count
+            else:
+                for key, row in zip(keys, self.source):
+                    if hxl.model.RowQuery.match_list(row, self.queries):
+                        self._update_states(get_states(key), row)
+        else:
+            # read the whole source dataset at once
+            for row in self.source:
+                # will always match if there are no queries
+                if hxl.model.RowQuery.match_list(row, self.queries):
+                    self._update_states(get_states(self._make_key(row)), row)
+
+        # sort the groups by their keys
+        return sorted(groups.items())
+
+    def _iter_presorted(self):
+        """Generate aggregated rows from a source sorted on the patterns, one group at a time."""
+        columns = self.columns
+        check = self._make_sort_check() if self.check_sorted else None
+        row_number = 0
+        key = None
+        states = None
+
+        for row in self.source:
+            if hxl.model.RowQuery.match_list(row, self.queries):
+                row_key = self._make_key(row)
+                if states is None or row_key != key:
+                    if check:
+                        check(row_key)
+                    if states is not None:
+                        # the previous group is complete
+                        yield hxl.model.Row(columns, CountFilter._make_values(key, states), row_number)
+                        row_number += 1
+                    key = row_key
+                    states = self._make_states()
+                self._update_states(states, row)
+
+        if states is not None:
+            yield hxl.model.Row(columns, CountFilter._make_values(key, states), row_number)
+
+    def _make_sort_check(self):
+        """Make a function to check that each new group key follows the previous one in sort order.
+        The function raises L{HXLFilterException} if the key is out of order.
+        Keys that sort the same (e.g. differing only in case) may appear in any order, but must not repeat.
+        """
+        tags = []
+        for pattern in self.patterns:
+            column = pattern.find_column(self.source.columns)
+            tags.append(column.tag if column else None)
+
+        previous_key = None
+        previous_sort_value = None
+        direction = 0 # 1 for ascending, -1 for descending, 0 until known
+        seen_keys = set() # keys with the current sort value
+
+        def check(key):
+            nonlocal previous_key, previous_sort_value, direction, seen_keys
+            sort_value = tuple(SortFilter._make_sort_value(tag, value) for tag, value in zip(tags, key))
+            if previous_key is not None:
+                if sort_value != previous_sort_value:
+                    key_direction = 1 if sort_value > previous_sort_value else -1
+                    if direction and key_direction != direction:
+                        raise HXLFilterException("Count filter input is not sorted: {} appears after {}".format(
+                            list(key), list(previous_key)
+                        ))
+                    direction = key_direction
+                    seen_keys = set()
+                elif key in seen_keys:
+                    raise HXLFilterException("Count filter input is not sorted: {} appears more than once".format(list(key)))
+            previous_key = key
+            previous_sort_value = sort_value
+            seen_keys.add(key)
+
+        return check
+
+    def _iter_external(self):
+        """Generate aggregated rows, saving partial results to temporary files beyond the memory limit."""
+        if self._run_files is None:
+            self._aggregate_runs()
+
+        if self._saved_rows is not None:
+            # everything fit in memory
+            values_iter = iter(self._saved_rows)
+        else:
+            values_iter = (CountFilter._make_values(key, states) for key, states in self._merge_runs())
+
+        columns = self.columns
+        for row_number, values in enumerate(values_iter):
+            yield hxl.model.Row(columns, values, row_number)
+
+    def _aggregate_runs(self):
+        """Aggregate the source, saving the partial results to a sorted run whenever the groups reach the memory limit.
+        If all of the groups fit in memory, keep the result in L{_saved_rows} instead of saving it.
+        """
+        self._run_files = []
+        groups = {}
+        memory = 0
+        group_memory = CountFilter.GROUP_MEMORY * len(self.aggregators)
 
-        # read the whole source dataset at once
         for row in self.source:
-            # will always match if there are no queries
             if hxl.model.RowQuery.match_list(row, self.queries):
-                # get the values in the order we need them
-                values = [hxl.datatypes.normalise_space(row.get(pattern, default='')) for pattern in self.patterns]
-                # make a dict key for the aggregator
-                key = tuple(values)
-                if not key in aggregators:
-                    aggregators[key] = [copy.deepcopy(aggregator) for aggregator in self.aggregators]
-                for aggregator in aggregators[key]:
-                    aggregator.evaluate_row(row)
-
-        # sort the aggregators by their keys
-        return sorted(aggregators.items())
+                key = self._make_key(row)
+                states = groups.get(key)
+                if states is None:
+                    if ((self.memory_limit is not None and memory >= self.memory_limit) or
+                        (self.max_groups is not None and len(groups) >= self.max_groups)):
+                        self._save_run(sorted(groups.items()))
+                        groups = {}
+                        memory = 0
+                    states = groups[key] = self._make_states()
+                    if self.memory_limit is not None:
+                        memory += group_memory + sys.getsizeof(key) + sum(sys.getsizeof(value) for value in key)
+                self._update_states(states, row)
+
+        if not self._run_files:
+            self._saved_rows = [CountFilter._make_values(key, states) for key, states in sorted(groups.items())]
+        elif groups:
+            self._save_run(sorted(groups.items()))
+
+    def _merge_runs(self):
+        """Merge the saved partial results, in key order.
+        @returns: an iterator of key, aggregator states tuples
+        """
+        # the merge keeps equal keys in run order, so partial results merge in source order
+        merged = self._merge_saved_runs(operator.itemgetter(0))
+        for key, items in itertools.groupby(merged, key=operator.itemgetter(0)):
+            states = next(items)[1]
+            for item in items:
+                for state, other in zip(states, item[1]):
+                    state.merge(other)
+            yield key, states
+
+    def _get_columnar_keys(self, pattern):
+        """Get the key values for a single pattern from a columnar source.
+        Uses the same logic as C{row.get(pattern, default='')}, normalising each distinct value only once.
+        @param pattern: the tag pattern for the key
+        @returns: a list of normalised key values, one for each row
+        """
+        columns = [self.source.get_column_values(i) for i in hxl.model.get_pattern_indices(pattern, self.source.columns)]
+
+        def first_value(*values):
+            for value in values:
+                if value:
+                    return value
+            return ''
+
+        if not columns:
+            raw_values = ['' for row in self.source]
+        elif len(columns) == 1:
+            raw_values = columns[0]
+        else:
+            raw_values = map(first_value, *columns)
+
+        normalised = {}
+        result = []
+        for value in raw_values:
+            key = normalised.get(value)
+            if key is None:
+                key = normalised[value] = hxl.datatypes.normalise_space(value if value else '')
+            result.append(key)
+        return result
 
     @staticmethod
     def _load(source, spec):
@@ -1508,7 +2577,11 @@ class CountFilter(AbstractCachingFilter):
             source = source,
             patterns=opt_arg(spec, 'patterns'),
             aggregators=opt_arg(spec, 'aggregators', None),
-            queries=opt_arg(spec, 'queries', [])
+            queries=opt_arg(spec, 'queries', []),
+            memory_limit=opt_arg(spec, 'memory_limit', None),
+            max_groups=opt_arg(spec, 'max_groups', None),
+            presorted=opt_arg(spec, 'presorted', False),
+            check_sorted=opt_arg(spec, 'check_sorted', False)
         )
 
 
@@ -1523,34 +2596,79 @@ class DeduplicationFilter(AbstractStreamingFilter):
 
     Supports the hxldedup command-line script.
 
+    To save memory, the filter remembers each row's key as a 16-byte
+    BLAKE2 digest rather than the key itself. If there are too many
+    distinct keys to remember even that way, set I{memory_limit} (in
+    bytes): beyond the limit, the filter moves the digests it has seen
+    to a temporary on-disk index, and checks there as well.
+
     TODO: add more-sophisticated matching, edit distance, etc.
     """
 
-    def __init__(self, source, patterns=None, queries=[]):
+    DIGEST_SIZE = 16
+    """Size of the digest for each row key, in bytes"""
+
+    DIGEST_MEMORY = 100
+    """Approximate memory used for each digest in memory, in bytes (for I{memory_limit})"""
+
+    def __init__(self, source, patterns=None, queries=[], memory_limit=None):
         """
         Constructor
         @param source: the upstream source dataset
         @param patterns: if provided, a list of tag patterns for columns to use for uniqueness testing.
         @param filters: optional list of filter queries for columns to be considered for deduplication.
+        @param memory_limit: if set, the approximate maximum memory in bytes to use for row digests, moving them to disk beyond that
         """
         super().__init__(source)
         self.patterns = hxl.model.TagPattern.parse_list(patterns)
-        self.seen_map = set() # row signatures that we've seen so far
+        self.seen_map = set() # digests of row signatures that we've seen so far
         self.queries = self._setup_queries(queries)
+        self.memory_limit = memory_limit
+        self._spilled = None
+        """Connection to the on-disk index of digests moved out of seen_map (if any)"""
+        self._temp_dir = None
 
     def filter_row(self, row):
-        """@returns: the row's values, or C{None} if it's a duplicate"""
+        """@returns: the row, or C{None} if it's a duplicate"""
         if hxl.model.RowQuery.match_list(row, self.queries):
             if not row:
                 return None
-            key = row.key(self.patterns)
-            if key in self.seen_map:
+            digest = DeduplicationFilter._make_digest(row.key(self.patterns))
+            if digest in self.seen_map or self._is_spilled(digest):
                 return None
             # if we get to here, we haven't seen the row before
-            self.seen_map.add(key)
-            return copy.copy(row.values)
-        else:
-            return row.values
+            self.seen_map.add(digest)
+            if self.memory_limit is not None and len(self.seen_map) * DeduplicationFilter.DIGEST_MEMORY >= self.memory_limit:
+                self._spill()
+        return row
+
+    @staticmethod
+    def _make_digest(key):
+        """Make a compact digest of a row key.
+        @param key: the key tuple from L{hxl.model.Row.key}
+        @returns: the digest, as bytes
+        """
+        # repr distinguishes strings from numbers, and the boundaries between values
+        return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=DeduplicationFilter.DIGEST_SIZE).digest()
+
+    def _is_spilled(self, digest):
+        """Check if a digest is in the on-disk index."""
+        if self._spilled is None:
+            return False
+        return self._spilled.execute('SELECT 1 FROM seen WHERE digest=?', (digest,)).fetchone() is not None
+
+    def _spill(self):
+        """Move the digests in memory to the on-disk index, creating it if necessary."""
+        if self._spilled is None:
+            # removed automatically when the filter is garbage-collected
+            self._temp_dir = tempfile.TemporaryDirectory(prefix='hxl-')
+            self._spilled = sqlite3.connect(os.path.join(self._temp_dir.name, 'dedup.sqlite'))
+            self._spilled.execute('PRAGMA journal_mode=OFF')
+            self._spilled.execute('PRAGMA synchronous=OFF')
+            self._spilled.execute('CREATE TABLE seen (digest BLOB PRIMARY KEY) WITHOUT ROWID')
+        self._spilled.executemany('INSERT INTO seen VALUES (?)', ((digest,) for digest in self.seen_map))
+        self._spilled.commit()
+        self.seen_map.clear()
 
     @staticmethod
     def _load(source, spec):
@@ -1562,21 +2680,38 @@ class DeduplicationFilter(AbstractStreamingFilter):
         return DeduplicationFilter(
             source = source,
             patterns=opt_arg(spec, 'patterns', []),
-            queries=opt_arg(spec, 'queries', [])
+            queries=opt_arg(spec, 'queries', []),
+            memory_limit=opt_arg(spec, 'memory_limit', None)
         )
 
 
 class ExpandListsFilter(AbstractBaseFilter):
     """Expand in-cell lists by duplicating data rows.
+
+    The output rows for each input row are generated lazily, as
+    shallow copies of a single template row, so a row with several
+    long lists doesn't allocate its whole cartesian product at once.
+    Set I{max_rows} to cap the number of output rows from any
+    single input row (extra rows are dropped with a warning).
     """
 
-    def __init__(self, source, patterns=None, separator="|", correlate=False, queries=[]):
+    def __init__(self, source, patterns=None, separator="|", correlate=False, queries=[], max_rows=None):
+        """
+        @param source: the upstream data source
+        @param patterns: a single tag pattern or list of tag patterns for columns to expand (default: columns with +list)
+        @param separator: the list-item separator (default "|")
+        @param correlate: if True, correlate list values instead of producing a cartesian product
+        @param queries: optional list of L{hxl.model.RowQuery} objects to limit where we expand lists
+        @param max_rows: the maximum number of output rows to generate from a single input row (default: no limit)
+        """
         super().__init__(source)
         self.separator = str(separator)
         self.scan_columns(patterns)
         self.correlate = correlate
         self.queries = self._setup_queries(queries)
         """The row queries to limit where we expand lists"""
+        self.max_rows = max_rows
+        """The maximum number of output rows for a single input row, or None for no limit"""
 
     def filter_columns(self):
         """ Remove the +list attribute from targeted columns """
@@ -1625,46 +2760,49 @@ class ExpandListsFilter(AbstractBaseFilter):
             for index in self.column_indices:
                 if index < len(row.values):
                     values = str(row.values[index]).split(self.separator)
-                    value_lists.append(list(map(hxl.datatypes.normalise_space, values)))
+                    value_lists.append([hxl.datatypes.normalise_space(value) for value in values])
                 else:
                     value_lists.append([""])
 
-            if (self.correlate):
-                # correlate the lists
-
-                nrows = max([len(item) for item in value_lists])
-
-                for i in range(0, nrows):
-                    values = copy.deepcopy(row.values)
-                    for j, v in enumerate(value_lists):
-                        index = self.column_indices[j]
-                        if len(v) <= i:
-                            values[index] = ""
-                        else:
-                            values[index] = v[i]
-                    yield hxl.model.Row(self.columns, values)
+            # template for the output rows, long enough to hold every list column
+            template = list(row.values)
+            if len(template) < min_length:
+                template += [""] * (min_length - len(template))
 
+            if self.correlate:
+                # correlate the lists (shorter lists are padded with "")
+                combinations = itertools.zip_longest(*value_lists, fillvalue="")
             else:
                 # generate the cartesian product of all the lists
+                combinations = itertools.product(*value_lists)
 
-                # generate the cartesian product of the values
-                row_value_list = list(itertools.product(*value_lists))
+            if self.max_rows is not None:
+                combinations = itertools.islice(combinations, self.max_rows)
+                self._check_fan_out(row, value_lists)
 
-                # yield all of the resulting rows
-                for row_values in row_value_list:
-                    values = copy.deepcopy(row.values)
-
-                    # make sure the value list is long enough
-                    if len(values) < min_length:
-                        values += [""] * (min_length - len(values))
-
-                    # replace the list values
-                    for i, value in enumerate(row_values):
-                        values[self.column_indices[i]] = value
-
-                    # yield a new row
-                    yield hxl.model.Row(self.columns, values)
+            # yield all of the resulting rows
+            for combination in combinations:
+                values = list(template)
+                for index, value in zip(self.column_indices, combination):
+                    values[index] = value
+                yield hxl.model.Row(self.columns, values)
 
+    def _check_fan_out(self, row, value_lists):
+        """Warn if expanding a row would produce more than I{max_rows} rows.
+        @param row: the input row
+        @param value_lists: the parsed lists for the row
+        """
+        if self.correlate:
+            count = max(len(values) for values in value_lists)
+        else:
+            count = 1
+            for values in value_lists:
+                count *= len(values)
+        if count > self.max_rows:
+            logger.warning(
+                'Row %s would expand to %d rows; keeping only the first %d',
+                row.source_row_number, count, self.max_rows
+            )
 
     @staticmethod
     def _load(source, spec):
@@ -1677,7 +2815,8 @@ class ExpandListsFilter(AbstractBaseFilter):
             patterns=opt_arg(spec, 'patterns'),
             separator=opt_arg(spec, 'separator'),
             correlate=opt_arg(spec, 'correlate'),
-            queries=opt_arg(spec, 'queries')
+            queries=opt_arg(spec, 'queries'),
+            max_rows=opt_arg(spec, 'max_rows')
         )
 
 
@@ -1736,31 +2875,36 @@ class ExplodeFilter(AbstractBaseFilter):
 
     def __iter__(self):
         """Custom iterator to produce exploded rows."""
+        templates = self._compile_plan(self._plan)
+        width = len(self.source.columns)
         for row in self.source:
-            for values in self._expand(row, self._plan):
+            values_in = row.values
+            if len(values_in) < width:
+                values_in = values_in + [''] * (width - len(values_in))
+            for slots in templates:
+                values = [values_in[index] if index is not None else constant for constant, index in slots]
                 yield hxl.model.Row(self.columns, values)
 
-    def _expand(self, row, plan, values_in=[]):
-        """Recursive generator for the row data.
-        https://wiki.python.org/moin/Generators
-        @param row: the row to expland
-        @param plan: the pre-generated expansion plan
-        @param values_in: the input values
+    def _compile_plan(self, plan):
+        """Flatten an expansion plan into one template for each output variant.
+        Each template is a tuple of (constant, index) slots: if index is None, the
+        slot holds the constant (a former header); otherwise it holds the
+        value from that column of the input row.
+        @param plan: the expansion plan from L{_make_plan}
+        @returns: a list of templates, in output order
         """
-        if not plan: # terminal condition
-            yield values_in
-        else:
-            spec = plan[0]
-            plan = plan[1:]
-            if isinstance(spec, list): # multiple branches
-                for index in spec:
-                    values = values_in + [row.columns[index].header, row.values[index]]
-                    for values_out in self._expand(row, plan, values):
-                        yield values_out
-            else: # continue on a single branch
-                values = values_in + [row.values[spec]]
-                for values_out in self._expand(row, plan, values):
-                    yield values_out
+        choices = []
+        for spec in plan:
+            if isinstance(spec, list): # multiple branches: header and value side by side
+                choices.append([
+                    ((self.source.columns[index].header, None), (None, index),) for index in spec
+                ])
+            else: # a single branch
+                choices.append([((None, spec),)])
+        return [
+            tuple(slot for slots in variant for slot in slots)
+            for variant in itertools.product(*choices)
+        ]
 
     def _make_plan(self):
         """Create an expansion plan
@@ -1812,41 +2956,55 @@ class ImplodeFilter(AbstractBaseFilter):
     #country,#affected+label,#affected+label,#affected+label
     Cameroon,100,150,120
 
+    By default, the filter reads the whole dataset into memory before
+    producing any rows. If the input is already grouped by the key
+    columns (everything except the label and value columns), as it is
+    after L{ExplodeFilter}, set I{presorted} to stream it instead: each
+    wide row comes out as soon as the key changes. The labels then
+    come from I{labels}, or from a quick first pass over the source,
+    which must be cached (see L{hxl.model.Dataset.cache}).
+
     @see: hxl.model.Dataset.implode
     @see: hxl.filters.ExplodeFilter
     """
 
-    def __init__(self, source, label_pattern, value_pattern):
+    def __init__(self, source, label_pattern, value_pattern, presorted=False, labels=None):
         """ Constructor
         @param source: the upstream source dataset
-        @param pattern: the tag pattern to use for the labels
-        @param output_tagspec: the tagspec to use for the repeated, wide columns
+        @param label_pattern: the tag pattern to use for the labels
+        @param value_pattern: the tag pattern to use for the values
+        @param presorted: if True, the source is already grouped by its key columns, so stream the output (default: False)
+        @param labels: optional list of labels to use for the wide columns, in order (default: all labels in the source, sorted)
         """
         super(ImplodeFilter, self).__init__(source)
         self.label_pattern = label_pattern
         self.value_pattern = value_pattern
+        self.presorted = presorted
+        """If True, the source is already grouped by its key columns"""
+        self.fixed_labels = list(labels) if labels is not None else None
+        """The labels supplied by the caller, or None to read them from the source"""
 
         self.processed = False
         self.label_index = -1
         self.value_index = -1
+        self.key_indices = None
+        self._width = 0
         self.labels = set()
         self.rows = dict()
         self.new_columns = None
         self.source_iterator = None
+        self._output_labels = None
 
     def filter_columns(self):
         """@returns: the new (exploded) column headers"""
         if self.new_columns is None:
-            self.process()
+            self._find_columns()
             # add existing columns (excluding label and value columns)
-            self.new_columns = []
-            for i, column in enumerate(self.source.columns):
-                if i != self.label_index and i != self.value_index:
-                    self.new_columns.append(column)
+            self.new_columns = [self.source.columns[i] for i in self.key_indices]
 
             # add extra columns for new, "wide" data
             model = self.source.columns[self.value_index]
-            for label in sorted(self.labels):
+            for label in self._get_labels():
                 attributes = set(model.attributes)
                 attributes.add("label")
                 column = hxl.model.Column(tag=model.tag, attributes=attributes, header=label)
@@ -1856,17 +3014,94 @@ class ImplodeFilter(AbstractBaseFilter):
 
     def __iter__(self):
         """Custom iterator to produce exploded rows."""
-        self.process()
-        for key in self.rows:
-            values = list(key)
-            # extra, wide values
-            for label in sorted(self.labels):
-                values.append(self.rows[key].get(label, ""))
-            yield hxl.model.Row(self.columns, values)
+        columns = self.columns
+        labels = self._get_labels()
+        if self.presorted:
+            for values in self._iter_presorted(labels):
+                yield hxl.model.Row(columns, values)
+        else:
+            self.process()
+            for key in self.rows:
+                values = list(key)
+                # extra, wide values
+                for label in labels:
+                    values.append(self.rows[key].get(label, ""))
+                yield hxl.model.Row(columns, values)
+
+    def _iter_presorted(self, labels):
+        """Stream wide rows from a source already grouped by its key columns.
+        Memory use is a single wide row.
+        @param labels: the labels for the wide columns, in order
+        @returns: an iterator over lists of output values
+        """
+        positions = {label: i for i, label in enumerate(labels)}
+        current_key = None
+        wide_values = None
+        filled = None
 
-    def process(self):
+        for row in self.source:
+            label, value, key = self._split_row(row)
+
+            # yield the previous wide row as soon as the key changes
+            if key != current_key:
+                if current_key is not None:
+                    yield list(current_key) + wide_values
+                current_key = key
+                wide_values = [""] * len(labels)
+                filled = [False] * len(labels)
+
+            position = positions.get(label)
+            if position is None:
+                logger.warning("Label %s is not in the list of implode labels; skipping", label)
+            elif filled[position]:
+                logup('Multiple values in implode filter; using first match', {"value": label, "value_used": wide_values[position]})
+                logger.error("Multiple values for %s in implode filter; using %s", label, wide_values[position])
+            else:
+                wide_values[position] = value
+                filled[position] = True
+
+        if current_key is not None:
+            yield list(current_key) + wide_values
+
+    def _get_labels(self):
+        """Get the labels for the wide columns, in output order.
+        Uses the labels supplied to the constructor if available; otherwise,
+        reads them in a first pass (for presorted input) or while processing
+        the whole dataset.
+        @returns: a list of labels
+        @exception HXLFilterException: if the labels need a first pass over a source that isn't cached
+        """
+        if self._output_labels is None:
+            if self.fixed_labels is not None:
+                self._output_labels = self.fixed_labels
+            elif self.presorted:
+                if not self.source.is_cached:
+                    raise HXLFilterException(
+                        "Streaming implode needs explicit labels or a cached (repeatable) source"
+                    )
+                self._find_columns()
+                self._output_labels = sorted(set(self._split_row(row)[0] for row in self.source))
+            else:
+                self.process()
+                self._output_labels = sorted(self.labels)
+        return self._output_labels
+
+    def _split_row(self, row):
+        """Split a row into its label, value, and key.
+        @param row: the input row
+        @returns: a tuple of the label, the value, and a key tuple of the remaining values
+        """
+        values = row.values
+        if len(values) < self._width:
+            values = values + [""] * (self._width - len(values))
+        return values[self.label_index], values[self.value_index], tuple([values[i] for i in self.key_indices])
+
+    def _find_columns(self):
+        """Determine the indices of the label, value, and key columns.
+        @exception HXLFilterException: if there is no label or value column
+        """
         # check if we've already done all this
-        if self.processed:
+        if self.key_indices is not None:
             return
 
         # determine the indices of the label and value columns
@@ -1907,29 +3142,26 @@ class ImplodeFilter(AbstractBaseFilter):
         if self.value_index == -1:
             raise HXLFilterException("No matching value column for {}".format(self.value_pattern))
 
-        # iterate through the dataset
-        for row in self.source:
+        # the key is every other column
+        self._width = len(self.source.columns)
+        self.key_indices = [
+            i for i in range(self._width) if i != self.label_index and i != self.value_index
+        ]
 
-            values = list(row.values)
+    def process(self):
+        """Read the whole dataset into memory, grouped by key."""
+        # check if we've already done all this
+        if self.processed:
+            return
+        self._find_columns()
 
-            # get the "wide" label and value
-            label = ""
-            if self.label_index < len(values):
-                label = values[self.label_index]
+        # iterate through the dataset
+        for row in self.source:
 
+            # get the "wide" label and value, and a key tuple excluding them
+            label, value, key = self._split_row(row)
             self.labels.add(label)
 
-            value = ""
-            if self.value_index < len(values):
-                value = values[self.value_index]
-
-            # make a key tuple, excluding the label and value columns
-            values = []
-            for i, value in enumerate(row.values):
-                if i != self.label_index and i != self.value_index:
-                    values.append(value)
-            key = tuple(values)
-
             # check to see if we already have data for that key
             if key not in self.rows:
                 self.rows[key] = {}
@@ -1939,6 +3171,8 @@ class ImplodeFilter(AbstractBaseFilter):
             else:
                 self.rows[key][label] = value
 
+        self.processed = True
+
     @staticmethod
     def _load(source, spec):
         """Create an implode filter from a dict spec.
@@ -1949,7 +3183,9 @@ class ImplodeFilter(AbstractBaseFilter):
         return ImplodeFilter(
             source=source,
             label_pattern=req_arg(spec, 'label_pattern'),
-            value_pattern=req_arg(spec, 'value_pattern')
+            value_pattern=req_arg(spec, 'value_pattern'),
+            presorted=opt_arg(spec, 'presorted', False),
+            labels=opt_arg(spec, 'labels')
         )
 
 
@@ -1979,11 +3215,26 @@ class MergeDataFilter(AbstractStreamingFilter):
     source dataset, syncing the rows using the value of #adm1+code in
     each dataset.)
 
+    For large merge datasets that you use repeatedly (such as
+    gazetteers), set I{index_dir} to keep a persistent SQLite index of
+    the merge values on disk instead of in memory, and I{index_key}
+    to a string that changes whenever the merge dataset's content
+    does (such as a version number or checksum). The index is built
+    once for each key and set of merge settings, and later runs with
+    the same key use it without reading the merge dataset's rows at
+    all (so a stale key gives stale values). Only the
+    L{INDEX_MAX_FILES} most-recently used indices are kept in the
+    directory.
+
     @see hxl.model.Dataset.merge_data
     @see hxl.scripts.hxlmerge_main
     """
 
-    def __init__(self, source, merge_source, keys, tags, replace=False, overwrite=False, queries=[]):
+    INDEX_MAX_FILES = 16
+    """Maximum number of persistent indices to keep in I{index_dir} (least-recently used go first)"""
+
+    def __init__(self, source, merge_source, keys, tags, replace=False, overwrite=False, queries=[],
+                 index_dir=None, index_key=None):
         """
         Constructor.
         @param source: the HXL data source.
@@ -1993,8 +3244,13 @@ class MergeDataFilter(AbstractStreamingFilter):
         @param replace: if True, replace existing columns when possible
         @param overwrite: if True, overwrite non-empty values in existing columns
         @param queries: optional list of filter queries for rows to be considered from the merge dataset.
+        @param index_dir: if set, a directory for persistent on-disk indices of merge values
+        @param index_key: a string that identifies the merge dataset's content (required with I{index_dir})
+        @exception HXLFilterException: if I{index_dir} is set without I{index_key}
         """
         super().__init__(source)
+        if index_dir is not None and index_key is None:
+            raise HXLFilterException("A persistent merge index (index_dir) needs an index_key to identify the merge dataset's content")
         self.merge_source = merge_source
         """The source dataset for pulling merged values"""
         self.keys = hxl.model.TagPattern.parse_list(keys)
@@ -2011,8 +3267,12 @@ class MergeDataFilter(AbstractStreamingFilter):
         """Indices for mapping columns from merge source to output dataset
         [source_index, output_index, overwrite_ok]
         """
+        self.index_dir = index_dir
+        """Directory for persistent indices (if None, keep the merge values in memory)"""
+        self.index_key = index_key
+        """String identifying the merge source's content, for the persistent index"""
         self._merge_values = None
-        """Dictionary of values from merge source, indexed by key."""
+        """Dictionary (or L{_MergeIndex}) of values from merge source, indexed by key."""
 
     def filter_columns(self):
         """Filter the columns to add newly-merged ones.
@@ -2054,6 +3314,18 @@ class MergeDataFilter(AbstractStreamingFilter):
 
         return new_columns
 
+    def __iter__(self):
+        try:
+            yield from super().__iter__()
+        finally:
+            self._close_index()
+
+    def iter_batches(self, size=hxl.model.BATCH_SIZE):
+        try:
+            yield from super().iter_batches(size)
+        finally:
+            self._close_index()
+
     def filter_row(self, row):
         """Set up a merged data row, replacing existing values if requested.
         Uses the _merge_indices map created by filter_columns.
@@ -2064,11 +3336,14 @@ class MergeDataFilter(AbstractStreamingFilter):
 
         # First, check if we already have the merge map, and read it if not
         if self._merge_values is None:
-            self._merge_values = self._read_merge()
+            if self.index_dir is None:
+                self._merge_values = self._read_merge()
+            else:
+                self._merge_values = self._open_index()
 
         # Make an initial array of the correct length
-        values = copy.copy(row.values)
-        values += ([''] * (len(self.columns) - len(row.values)))
+        values = row.copy_values()
+        values += ([''] * (len(self.columns) - len(values)))
 
         # Look up the merge values, based on the keys
         for key in self._make_keys(row):
@@ -2096,11 +3371,20 @@ class MergeDataFilter(AbstractStreamingFilter):
         @returns: a map of merge values
         """
 
-        self.columns # make sure we've created the _merge_indices map
-
         merge_values = {}
         """Map of keys to merge values from the merge source."""
 
+        for key, values in self._iter_merge():
+            merge_values[key] = values
+
+        return merge_values
+
+    def _iter_merge(self):
+        """Generate the keys and merge values from the merge dataset, in order.
+        @returns: an iterator of key, values tuples
+        """
+        self.columns # make sure we've created the _merge_indices map
+
         for row in self.merge_source:
             if hxl.model.RowQuery.match_list(row, self.queries):
                 values = []
@@ -2112,11 +3396,90 @@ class MergeDataFilter(AbstractStreamingFilter):
                     except IndexError:
                         values.append('')
 
-                # Generate a key tuple and add to the map
+                # Generate a key tuple for each
                 for key in self._make_keys(row):
-                    merge_values[key] = values
+                    yield key, values
 
-        return merge_values
+    def _get_index_path(self, content_key):
+        """Get the filename for a persistent index.
+        The name depends on the merge source's content, and on everything that affects the values saved.
+        @param content_key: a string identifying the merge source's content
+        @returns: the full path to the index file
+        """
+        self.columns # make sure we've created the _merge_indices map
+        settings = json.dumps([
+            content_key,
+            [str(pattern) for pattern in self.keys],
+            [spec[0] for spec in self._merge_indices],
+            [[str(query.pattern), getattr(query.op, '__name__', ''), str(query.value)] for query in self.queries],
+        ])
+        return os.path.join(self.index_dir, 'merge-{}.sqlite'.format(hashlib.sha256(settings.encode('utf-8')).hexdigest()))
+
+    def _open_index(self):
+        """Open the persistent index for the merge source, building it first if necessary.
+        @returns: a L{_MergeIndex} object
+        """
+        path = self._get_index_path(self.index_key)
+        try:
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self._build_index(path)
+            self._evict_indices(path)
+        return _MergeIndex(path)
+
+    def _close_index(self):
+        """Close the persistent index, if open (it will reopen if needed)."""
+        if isinstance(self._merge_values, _MergeIndex):
+            self._merge_values.close()
+            self._merge_values = None
+
+    def _evict_indices(self, keep_path):
+        """Remove the least-recently used indices beyond L{INDEX_MAX_FILES}.
+        @param keep_path: the path of the index in use, never removed
+        """
+        paths = []
+        for filename in os.listdir(self.index_dir):
+            if filename.startswith('merge-') and filename.endswith('.sqlite'):
+                path = os.path.join(self.index_dir, filename)
+                try:
+                    paths.append((os.path.getmtime(path), path,))
+                except OSError:
+                    pass # removed by another process
+        paths.sort(reverse=True)
+        for mtime, path in paths[self.INDEX_MAX_FILES:]:
+            if path != keep_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # removed by another process, or still open elsewhere
+
+    def _build_index(self, path):
+        """Build a persistent index of the merge values.
+        Builds in a temporary file, then moves it into place, so that other processes never see a partial index.
+        @param path: the final path of the index
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='merge-', suffix='.tmp', dir=self.index_dir)
+        os.close(fd)
+        try:
+            connection = sqlite3.connect(temp_path)
+            try:
+                connection.execute('PRAGMA journal_mode=OFF')
+                connection.execute('PRAGMA synchronous=OFF')
+                connection.execute('CREATE TABLE merge_values (key TEXT PRIMARY KEY, merge_values TEXT)')
+                # "or replace" keeps the *last* matching row for each key, like _read_merge
+                connection.executemany(
+                    'INSERT OR REPLACE INTO merge_values VALUES (?, ?)',
+                    ((_MergeIndex.encode_key(key), json.dumps(values),) for key, values in self._iter_merge())
+                )
+                connection.commit()
+            finally:
+                connection.close()
+            os.replace(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
 
     @staticmethod
     def _load(source, spec):
@@ -2132,10 +3495,185 @@ class MergeDataFilter(AbstractStreamingFilter):
             tags=req_arg(spec, 'tags'),
             replace=opt_arg(spec, 'replace', False),
             overwrite=opt_arg(spec, 'overwrite', False),
-            queries=opt_arg(spec, 'queries', [])
+            queries=opt_arg(spec, 'queries', []),
+            index_dir=opt_arg(spec, 'index_dir', None),
+            index_key=opt_arg(spec, 'index_key', None)
+        )
+
+
+class _MergeIndex(object):
+    """Read-only lookup of merge values in a persistent SQLite index.
+    Has the same C{get} method as the in-memory dict that L{MergeDataFilter} uses otherwise.
+    """
+
+    def __init__(self, path):
+        """@param path: the path to an index built by L{MergeDataFilter._build_index}"""
+        self.path = path
+        self.connection = sqlite3.connect(path)
+
+    @staticmethod
+    def encode_key(key):
+        """Encode a key tuple for storage."""
+        return json.dumps(key)
+
+    def get(self, key, default=None):
+        """Look up the merge values for a key tuple.
+        @returns: the list of merge values, or I{default} if not found
+        """
+        result = self.connection.execute(
+            'SELECT merge_values FROM merge_values WHERE key=?', (_MergeIndex.encode_key(key),)
+        ).fetchone()
+        return json.loads(result[0]) if result else default
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+
+class ParallelFilter(AbstractBaseFilter):
+    """Composable filter to run stateless streaming filters in parallel.
+
+    This filter supports the L{hxl.model.Dataset.parallel} method and
+    the C{parallel} recipe step, and has no corresponding
+    command-line script.
+
+    Some streaming filters, like L{CleanDataFilter} and
+    L{ReplaceDataFilter}, do a lot of work for each row, but don't
+    keep any state from one row to the next (see
+    L{AbstractStreamingFilter.is_stateless}). This filter takes the
+    unbroken run of stateless filters directly upstream, and runs
+    them in a pool of worker processes: it reads batches of rows from
+    the source below them, sends each batch to a worker, and
+    reassembles the results in the original order. The output is
+    the same as running the filters directly.
+
+    Usage::
+
+      source = hxl.data(url).clean_data(date='#date').replace_data_map(map_url).parallel(workers=8)
+
+    If there are no stateless filters upstream, or only one worker,
+    this filter simply passes through the upstream data.
+
+    The filters must be picklable (to send them to the worker
+    processes) on platforms that don't fork new processes.
+
+    """
+
+    def __init__(self, source, workers=None, batch_size=hxl.model.BATCH_SIZE):
+        """Constructor
+        @param source: the upstream data source (normally ending with one or more stateless streaming filters)
+        @param workers: the number of worker processes (default: the number of CPUs)
+        @param batch_size: the number of rows to send to a worker at once
+        """
+        super().__init__(source)
+
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        """Number of worker processes"""
+
+        self.batch_size = batch_size
+        """Number of rows in each batch sent to a worker"""
+
+        self.stages = []
+        """Stateless filters to run in the workers, from the most upstream"""
+
+        self.base = source
+        """Dataset supplying the input for the first stage"""
+
+        while isinstance(self.base, AbstractStreamingFilter) and self.base.is_stateless:
+            self.stages.insert(0, self.base)
+            self.base = self.base.source
+
+    def __iter__(self):
+        if not self.stages or self.workers < 2:
+            return iter(self.source)
+        return self._iter_parallel()
+
+    def _iter_parallel(self):
+        """Generate the output rows, using a pool of worker processes."""
+        columns = self.columns
+        stages = [ParallelFilter._detach_stage(stage) for stage in self.stages]
+        # keep a few batches in flight per worker, without reading ahead through the whole source
+        max_pending = self.workers * 2
+        pending = collections.deque()
+        row_number = -1
+
+        pool = multiprocessing.Pool(self.workers, _init_parallel_worker, (stages,))
+        try:
+            for batch in self.base.iter_batches(self.batch_size):
+                pending.append(pool.apply_async(_run_parallel_batch, ([row.share_values() for row in batch],)))
+                while len(pending) >= max_pending or (pending and pending[0].ready()):
+                    for values in pending.popleft().get():
+                        row_number += 1
+                        yield hxl.model.Row(columns, values, row_number, shared=True)
+            while pending:
+                for values in pending.popleft().get():
+                    row_number += 1
+                    yield hxl.model.Row(columns, values, row_number, shared=True)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _detach_stage(stage):
+        """Make a copy of a filter that doesn't refer to its source data, for sending to a worker.
+        The copy's source is replaced by a placeholder with the same columns.
+        """
+        stage.columns # make sure the output columns are set up
+        detached = copy.copy(stage)
+        detached.source = _ColumnsOnly(stage.source.columns)
+        return detached
+
+    @staticmethod
+    def _load(source, spec):
+        """Create a new parallel filter from a dict spec.
+        @param spec: the JSON-like spec
+        @returns: a new L{ParallelFilter} object
+        """
+        return ParallelFilter(
+            source=source,
+            workers=opt_arg(spec, 'workers', None),
+            batch_size=opt_arg(spec, 'batch_size', hxl.model.BATCH_SIZE)
         )
 
 
+class _ColumnsOnly(hxl.model.Dataset):
+    """Placeholder dataset with columns but no rows, used by L{ParallelFilter}."""
+
+    def __init__(self, columns):
+        super().__init__()
+        self._columns = columns
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def __iter__(self):
+        return iter([])
+
+
+_parallel_stages = None
+"""Filter stages for a L{ParallelFilter} worker process"""
+
+
+def _init_parallel_worker(stages):
+    """Set up a L{ParallelFilter} worker process."""
+    global _parallel_stages
+    _parallel_stages = stages
+
+
+def _run_parallel_batch(batch):
+    """Run a batch of value lists through the worker's filter stages.
+    @param batch: a list of lists of values
+    @returns: a list of lists of filtered values
+    """
+    for stage in _parallel_stages:
+        columns = stage.source.columns
+        rows = [hxl.model.Row(columns, values, shared=True) for values in batch]
+        batch = [values.share_values() if isinstance(values, hxl.model.Row) else values for values in stage.filter_batch(rows)]
+    return batch
+
+
 class RenameFilter(AbstractStreamingFilter):
     """
     Composable filter class to rename columns in a HXL dataset.
@@ -2149,6 +3687,8 @@ class RenameFilter(AbstractStreamingFilter):
     </pre>
     """
 
+    is_stateless = True
+
     def __init__(self, source, rename=[]):
         """
         Constructor
@@ -2165,8 +3705,8 @@ class RenameFilter(AbstractStreamingFilter):
         return [self._rename_column(column) for column in self.source.columns]
 
     def filter_row(self, row):
-        """@returns: a deep copy of the row's values"""
-        return copy.copy(row.values)
+        """@returns: the row, unchanged (only the columns are renamed)"""
+        return row
 
     def _rename_column(self, column):
         """@returns: a copy of the column object, with a new name if needed"""
@@ -2222,6 +3762,8 @@ class JSONPathFilter(AbstractStreamingFilter):
     Optionally restrict to specific columns and/or rows
     """
 
+    is_stateless = True
+
     def __init__(self, source, path, patterns=None, queries=[], use_json=True):
         """Constructor
         @param source: the upstream data source
@@ -2241,7 +3783,7 @@ class JSONPathFilter(AbstractStreamingFilter):
         if self._indices is None:
             self._indices = self._get_indices(self.patterns)
 
-        values = list(row.values)
+        values = row.copy_values()
 
         if hxl.model.RowQuery.match_list(row, self.queries):
 
@@ -2296,7 +3838,7 @@ class FillDataFilter(AbstractStreamingFilter):
 
     def filter_row(self, row):
         """@returns: row values with some empty values possibly filled in"""
-        values = list(row.values)
+        values = row.copy_values()
 
         # Guessing at empty cells (column-wise only)
         if self._indices is None:
@@ -2325,6 +3867,74 @@ class FillDataFilter(AbstractStreamingFilter):
         )
 
 
+class _ReplacementTable:
+    """Internal: all the replacements for a group of columns, compiled for lookup.
+
+    Exact (non-regex) replacements go into a dict keyed by the
+    normalised original, so a cell needs one normalisation and one
+    lookup however many there are. Regex replacements are kept in
+    order, behind a single combined pattern that skips them all when
+    none can match. Each replacement remembers its position in the
+    original list, so the first applicable replacement still wins.
+    """
+
+    __slots__ = ('exact', 'regexes', 'prefilter',)
+
+    UNSAFE_REGEX = re.compile(r'\\\d|\(\?P=|\(\?\(|\(\?[aiLmsux-]')
+    """Regex constructs that can't be combined into an alternation safely (backreferences, conditionals, inline flags)"""
+
+    def __init__(self, replacements):
+        """
+        @param replacements: a list of (position, L{ReplaceDataFilter.Replacement}) tuples, in order
+        """
+        self.exact = {}
+        self.regexes = []
+        for position, replacement in replacements:
+            if replacement.is_regex:
+                self.regexes.append((position, replacement.regex, replacement.replacement,))
+            elif replacement.original not in self.exact:
+                self.exact[replacement.original] = (position, replacement.replacement,)
+        self.prefilter = self._make_prefilter([replacement.regex.pattern for _, replacement in replacements if replacement.is_regex])
+
+    def _make_prefilter(self, patterns):
+        """Combine the regex patterns into one alternation, if it's worth it and safe.
+        @param patterns: the regex patterns
+        @returns: a compiled regex matching wherever any of the patterns matches, or None
+        """
+        if len(patterns) < 2:
+            return None
+        for pattern in patterns:
+            if not isinstance(pattern, str) or self.UNSAFE_REGEX.search(pattern):
+                return None
+        try:
+            return re.compile('|'.join('(?:{})'.format(pattern) for pattern in patterns))
+        except re.error:
+            # e.g. the same group name in two patterns
+            return None
+
+    def sub(self, value):
+        """Apply the first matching replacement to a value.
+        @param value: the cell value
+        @returns: the new value if changed; False otherwise
+        """
+        exact_match = None
+        if self.exact:
+            exact_match = self.exact.get(hxl.datatypes.normalise_string(value))
+        if self.regexes:
+            text = str(value)
+            if self.prefilter is None or self.prefilter.search(text):
+                for position, regex, replacement in self.regexes:
+                    if exact_match is not None and position > exact_match[0]:
+                        # an earlier exact replacement takes precedence
+                        break
+                    result, count = regex.subn(replacement, text)
+                    if count > 0:
+                        return result
+        if exact_match is not None:
+            return exact_match[1]
+        return False
+
+
 class ReplaceDataFilter(AbstractStreamingFilter):
     """
     Composable filter class to replace values in a HXL dataset.
@@ -2336,8 +3946,15 @@ class ReplaceDataFilter(AbstractStreamingFilter):
     <pre>
     hxl.data(url).replace_data('foo', 'bar', '#activity')
     </pre>
+
+    The replacements are compiled once into a table for each group of
+    columns they apply to, so a large replacement map costs a single
+    normalisation and dict lookup per cell, plus any regular
+    expressions.
     """
 
+    is_stateless = True
+
     def __init__(self, source, replacements, queries=[]):
         """
         Constructor
@@ -2352,24 +3969,64 @@ class ReplaceDataFilter(AbstractStreamingFilter):
             self.replacements = [self.replacements]
         self.queries = self._setup_queries(queries)
         self.indices = self._setup_indices(self.replacements, self.columns)
+        self._plan = self._compile_plan(self.replacements, self.indices)
+        """List of (column index, substitution function) for the columns with replacements"""
 
 
     def filter_row(self, row):
-        """@returns: the row values with replacements"""
-        if hxl.model.RowQuery.match_list(row, self.queries):
-            replaced = set()
-            values = copy.copy(row.values)
-            for i, replacement in enumerate(self.replacements):
-                indices = self.indices[i]
-                for index in indices:
-                    if index not in replaced and index < len(values):
-                        new_value = replacement.sub(values[index])
-                        if new_value is not False:
-                            replaced.add(index)
-                            values[index] = new_value
-            return values
+        """@returns: the row values with replacements (or the original row, if nothing changed)"""
+        if self._plan and hxl.model.RowQuery.match_list(row, self.queries):
+            return self._replace(row)
         else:
-            return row.values
+            return row
+
+    def filter_batch(self, rows):
+        """@returns: the values with replacements for a batch of rows (or the original rows, if nothing changed)"""
+        if not self._plan:
+            return list(rows)
+        match_list = hxl.model.RowQuery.match_list
+        queries = self.queries
+        return [self._replace(row) if match_list(row, queries) else row for row in rows]
+
+    def _replace(self, row):
+        """Apply the compiled replacements to a row.
+        @param row: the row to process
+        @returns: a new list of values if anything changed; otherwise, the original row
+        """
+        values = row.share_values()
+        width = len(values)
+        changed = False
+        for index, sub in self._plan:
+            if index < width:
+                new_value = sub(values[index])
+                if new_value is not False:
+                    if not changed:
+                        # copy only when there's a change
+                        values = row.copy_values()
+                        changed = True
+                    values[index] = new_value
+        return values if changed else row
+
+    def _compile_plan(self, replacements, indices):
+        """Compile the replacements into one table for each distinct set of applicable replacements.
+        Columns with the same replacements share a table.
+        @param replacements: the list of replacements
+        @param indices: the list of matching column indices for each replacement
+        @returns: a list of (column index, substitution function) tuples
+        """
+        applicable = collections.defaultdict(list)
+        for position, column_indices in enumerate(indices):
+            for index in column_indices:
+                applicable[index].append(position)
+
+        tables = {}
+        plan = []
+        for index in sorted(applicable):
+            positions = tuple(applicable[index])
+            if positions not in tables:
+                tables[positions] = _ReplacementTable([(position, replacements[position]) for position in positions])
+            plan.append((index, tables[positions].sub,))
+        return plan
 
 
     def _setup_indices(self, replacements, columns):
@@ -2404,7 +4061,11 @@ class ReplaceDataFilter(AbstractStreamingFilter):
             else:
                 self.patterns = None
             self.is_regex = is_regex
-            if not self.is_regex:
+            if self.is_regex:
+                self.regex = re.compile(self.original)
+                """The compiled regular expression"""
+            else:
+                self.regex = None
                 self.original = hxl.datatypes.normalise_string(self.original)
 
         def matches(self, column):
@@ -2422,7 +4083,7 @@ class ReplaceDataFilter(AbstractStreamingFilter):
             """
 
             if self.is_regex:
-                result = re.subn(self.original, self.replacement, str(value))
+                result = self.regex.subn(self.replacement, str(value))
                 if result[1] > 0:
                     return result[0]
             elif self.original == hxl.datatypes.normalise_string(value):
@@ -2501,7 +4162,7 @@ class RowCountFilter(AbstractStreamingFilter):
     def filter_row(self, row):
         if hxl.model.RowQuery.match_list(row, self.queries):
             self.row_count += 1
-        return row.values
+        return row
 
 
 class RowFilter(AbstractStreamingFilter):
@@ -2519,6 +4180,8 @@ class RowFilter(AbstractStreamingFilter):
     </pre>
     """
 
+    is_stateless = True
+
     def __init__(self, source, queries=[], reverse=False, mask=[]):
         """
         Constructor
@@ -2541,12 +4204,65 @@ class RowFilter(AbstractStreamingFilter):
     def filter_row(self, row):
         """Filter data row-wise.
         @param row: the row to filter
-        @returns: the row's values as an array, or None if it fails the filters
+        @returns: the row, or None if it fails the filters
         """
         if hxl.model.RowQuery.match_list(row, self.mask):
             if not hxl.model.RowQuery.match_list(row, self.queries, self.reverse):
                 return None
-        return row.values
+        return row
+
+    def push_down(self, predicate=None, indices=None):
+        """Pass the row selection down to the source, if it supports it.
+        Works only if none of the queries uses a formula.
+        @see: L{hxl.model.Dataset.push_down}
+        """
+        if type(self).filter_row is not RowFilter.filter_row:
+            # a subclass might do something different
+            return None
+        own_predicate = self._make_predicate(self.source.columns)
+        if own_predicate is None:
+            return None
+        elif predicate is None:
+            combined_predicate = own_predicate
+        else:
+            combined_predicate = lambda values: own_predicate(values) and predicate(values)
+        return self.source.push_down(combined_predicate, indices)
+
+    def _make_predicate(self, columns):
+        """Compile the mask and queries into a single test for lists of values.
+        Uses the same logic as L{filter_row}.
+        @param columns: the columns for the values
+        @returns: a function that takes a list of values, or None if a query needs a full row
+        """
+        match_mask = [query.compile_values(columns) for query in self.mask]
+        match_queries = [query.compile_values(columns) for query in self.queries]
+        if None in match_mask or None in match_queries:
+            return None
+        reverse = self.reverse
+
+        def predicate(values):
+            if match_mask and not any(match(values) for match in match_mask):
+                # not subject to the filter
+                return True
+            if not match_queries:
+                return True
+            for match in match_queries:
+                if match(values):
+                    return not reverse
+            return reverse
+
+        return predicate
+
+    def filter_batch(self, rows):
+        """Filter a batch of rows together.
+        @param rows: the rows to filter
+        @returns: the rows that pass the filters
+        """
+        match_list = hxl.model.RowQuery.match_list
+        mask = self.mask
+        queries = self.queries
+        reverse = self.reverse
+        return [row for row in rows if not match_list(row, mask) or match_list(row, queries, reverse)]
 
     @staticmethod
     def _load(source, spec):
@@ -2575,17 +4291,28 @@ class SortFilter(AbstractCachingFilter):
     <pre>
     hxl.data(url).sort('sector,org,adm1')
     </pre>
+
+    By default, the filter sorts the whole dataset in memory. For
+    datasets too large for that, set a I{memory_limit} (in bytes) or
+    I{run_size} (in rows): the filter will then sort the data in runs
+    that fit inside the limit, save each run to a temporary file, and
+    merge the runs as it returns rows. The order is the same either
+    way.
     """
 
-    def __init__(self, source, tags=[], reverse=False):
+    def __init__(self, source, tags=[], reverse=False, memory_limit=None, run_size=None):
         """
         @param source: a HXL data source
         @param tags: list of TagPattern objects for sorting
         @param reverse: True to reverse the sort order
+        @param memory_limit: if set, the approximate maximum memory in bytes to use for rows being sorted
+        @param run_size: if set, the maximum number of rows to sort in memory at once
         """
         super(SortFilter, self).__init__(source)
         self.sort_tags = hxl.model.TagPattern.parse_list(tags)
         self.reverse = reverse
+        self.memory_limit = memory_limit
+        self.run_size = run_size
         self._iter = None
 
     def filter_rows(self):
@@ -2594,12 +4321,103 @@ class SortFilter(AbstractCachingFilter):
         # Figure out the indices for sort keys
         indices = self._make_indices()
 
+        if self.source.is_columnar:
+            values = self._sort_columnar(indices)
+            if values is not None:
+                return values
+
         def make_key(values):
             """Closure, to get the object reference into the key method."""
             return self._make_key(indices, values)
 
         return sorted(self.source.values, key=make_key, reverse=self.reverse)
 
+    def __iter__(self):
+        if self.memory_limit is None and self.run_size is None:
+            return super().__iter__()
+        else:
+            return self._iter_external()
+
+    def _iter_external(self):
+        """Generate sorted rows with a bounded-memory external merge sort."""
+        indices = self._make_indices()
+
+        def make_key(values):
+            return self._make_key(indices, values)
+
+        if self._run_files is None:
+            self._make_runs(make_key)
+
+        if self._saved_rows is not None:
+            # everything fit in a single run
+            values_iter = iter(self._saved_rows)
+        else:
+            # the merge is stable, like sorted(), as long as the runs stay in source order
+            values_iter = self._merge_saved_runs(make_key, reverse=self.reverse)
+
+        columns = self.columns
+        for row_number, values in enumerate(values_iter):
+            yield hxl.model.Row(columns, values, row_number)
+
+    def _make_runs(self, make_key):
+        """Read the source, and sort it in runs that fit inside the memory limit.
+        If all of the data fits in a single run, keep it in L{_saved_rows} instead of saving it.
+        """
+        self._run_files = []
+        run = []
+        run_memory = 0
+
+        for row in self.source:
+            values = row.share_values() # not modified
+            run.append(values)
+            if self.memory_limit is not None:
+                # allow about as much again for the sort key
+                run_memory += _estimate_memory(values) * 2
+            if ((self.memory_limit is not None and run_memory >= self.memory_limit) or
+                (self.run_size is not None and len(run) >= self.run_size)):
+                self._save_run(sorted(run, key=make_key, reverse=self.reverse))
+                run = []
+                run_memory = 0
+
+        if not self._run_files:
+            self._saved_rows = sorted(run, key=make_key, reverse=self.reverse)
+        elif run:
+            self._save_run(sorted(run, key=make_key, reverse=self.reverse))
+
+    def _sort_columnar(self, indices):
+        """Sort a columnar source, making each sort value only once per distinct value.
+        Produces the same order as the row-by-row sort in L{filter_rows}.
+        @param indices: an array of indices for the sort key (if empty, use all columns).
+        @returns: a sorted list of values, row by row, or None if some rows are too short for the fast path
+        """
+        if not indices:
+            indices = range(len(self.columns))
+
+        sort_columns = []
+        for index in indices:
+            if index >= self.source.get_column_count():
+                return None
+            values = self.source.get_column_values(index)
+            tag = self.columns[index].tag
+            sort_values = {}
+            sort_column = []
+            for value in values:
+                if value is None:
+                    # missing from a short row
+                    return None
+                sort_value = sort_values.get(value)
+                if sort_value is None:
+                    sort_value = sort_values[value] = SortFilter._make_sort_value(tag, value)
+                sort_column.append(sort_value)
+            sort_columns.append(sort_column)
+
+        rows = self.source.values
+        keys = list(zip(*sort_columns))
+        if not keys:
+            return rows
+        order = sorted(range(len(rows)), key=keys.__getitem__, reverse=self.reverse)
+        return [rows[i] for i in order]
+
     def _make_indices(self):
         """Determine the indices of the data to sort."""
         indices = []
@@ -2658,6 +4476,62 @@ class SortFilter(AbstractCachingFilter):
         return SortFilter(
             source = source,
             tags=opt_arg(spec, 'tags', []),
+            reverse=opt_arg(spec, 'reverse', False),
+            memory_limit=opt_arg(spec, 'memory_limit', None),
+            run_size=opt_arg(spec, 'run_size', None)
+        )
+
+
+class TopFilter(SortFilter):
+    """
+    Composable filter class to keep only the first rows of a sorted HXL dataset.
+
+    The result is the same as sorting the whole dataset and keeping
+    the first I{n} rows (rows that sort equal stay in their original
+    order), but the filter streams through the source keeping only
+    the best I{n} rows seen so far, so it needs memory only for those.
+
+    Usage:
+
+    <pre>
+    hxl.data(url).top(20, '#affected', reverse=True)
+    </pre>
+    """
+
+    def __init__(self, source, n, tags=[], reverse=False):
+        """
+        @param source: a HXL data source
+        @param n: the maximum number of rows to keep
+        @param tags: list of TagPattern objects for sorting
+        @param reverse: True to reverse the sort order (e.g. to keep the largest values)
+        """
+        super(TopFilter, self).__init__(source, tags=tags, reverse=reverse)
+        self.n = int(n)
+        if self.n < 0:
+            raise HXLFilterException("Number of rows for top filter must not be negative: {}".format(n))
+
+    def filter_rows(self):
+        """Return the first n rows in sort order."""
+        indices = self._make_indices()
+
+        def make_key(values):
+            return self._make_key(indices, values)
+
+        values_iter = (row.share_values() for row in self.source) # not modified
+
+        # like sorted(...)[:n], the heapq functions keep equal rows in source order
+        if self.reverse:
+            return heapq.nlargest(self.n, values_iter, key=make_key)
+        else:
+            return heapq.nsmallest(self.n, values_iter, key=make_key)
+
+    @staticmethod
+    def _load(source, spec):
+        """Create a top filter from a dict spec."""
+        return TopFilter(
+            source=source,
+            n=req_arg(spec, 'n'),
+            tags=opt_arg(spec, 'tags', []),
             reverse=opt_arg(spec, 'reverse', False)
         )
 
@@ -2680,10 +4554,12 @@ LOAD_MAP = {
     'implode': ImplodeFilter._load,
     'jsonpath': JSONPathFilter._load,
     'merge_data': MergeDataFilter._load,
+    'parallel': ParallelFilter._load,
     'rename_columns': RenameFilter._load,
     'replace_data': ReplaceDataFilter._load,
     'replace_data_map': ReplaceDataFilter._load,
     'sort': SortFilter._load,
+    'top': TopFilter._load,
     'with_columns': ColumnFilter._load,
     'with_rows': RowFilter._load,
     'without_columns': ColumnFilter._load,
@@ -2692,6 +4568,17 @@ LOAD_MAP = {
 """Static functions for creating filters from dicts (from JSON, typically)."""
 
 
+def _estimate_memory(values):
+    """Estimate the memory used by a row of values, in bytes (for memory limits).
+    @param values: a list of values
+    @returns: the approximate size
+    """
+    size = sys.getsizeof(values)
+    for value in values:
+        size += sys.getsizeof(value)
+    return size
+
+
 def req_arg(spec, property):
     """Get a required property, and raise an exception if missing.
     @param spec: the JSON-like filter spec (a dict)
@@ -2719,7 +4606,7 @@ def opt_arg(spec, property, default_value=None):
         return value
 
 
-def from_recipe(source, recipe):
+def from_recipe(source, recipe, optimise=True):
     """Build a filter chain from a JSON-like list of filter specs.
 
     Each recipe dictionary contains the property 'filter', describing
@@ -2727,8 +4614,15 @@ def from_recipe(source, recipe):
     parameters for the filter. Filter and parameter names are the same
     as the methods and arguments in hxl.model.Dataset.
 
+    Unless I{optimise} is False, the recipe is first rewritten with
+    L{optimise_recipe}, which removes redundant steps and moves row
+    and column selection ahead of more-expensive steps when that
+    can't change the result. Use L{explain_recipe} to see the
+    rewritten recipe.
+
     @param source: a HXL data source, URL, etc.
     @param recipe: a list of dictionaries, each describing a filter.
+    @param optimise: if True (default), optimise the recipe before building the chain.
     @returns: the filter at the end of the new chain.
     """
     source = hxl.data(source)
@@ -2736,12 +4630,10 @@ def from_recipe(source, recipe):
     #
     # Clean up recipe if needed
     #
-    if isinstance(recipe, six.string_types):
-        # a JSON string (parse it first)
-        recipe = json.loads(recipe)
-    if isinstance(recipe, dict) and recipe.get('filter'):
-        # a single filter (make it into a list)
-        recipe = [recipe]
+    if optimise:
+        recipe = optimise_recipe(recipe)
+    else:
+        recipe = _normalise_recipe(recipe)
 
     # Process each filter in turn
     for spec in recipe:
@@ -2758,6 +4650,268 @@ def from_recipe(source, recipe):
     return source
 
 
+#
+# Optimise a filter chain
+#
+
+def optimise_recipe(recipe, notes=None):
+    """Rewrite a recipe into an equivalent one that is cheaper to run.
+
+    L{from_recipe} calls this function automatically (unless asked
+    not to). It applies only rewrites that can't change the output
+    data:
+
+      - adjacent C{without_rows} filters are fused into one, as are
+        adjacent C{without_columns} filters;
+      - a row or column filter repeated immediately is dropped, as is
+        a C{without_columns} filter that can't match anything left
+        by the C{with_columns} filter before it;
+      - row filters move ahead of C{sort}, and ahead of C{clean_data}
+        and C{replace_data} steps that can't change the columns that
+        the row queries test;
+      - column filters move ahead of C{clean_data} and
+        C{replace_data} steps that don't depend on other columns;
+      - a C{sort} immediately before a C{count} is dropped, when the
+        count's results don't depend on row order.
+
+    Two tag patterns are treated as independent only if they have
+    different (non-wildcard) hashtags, so the optimiser is
+    conservative: when in doubt, it leaves the recipe as written.
+
+    @param recipe: a list of dicts, a single dict, or a JSON literal string.
+    @param notes: an optional list; the function will append a description of each rewrite.
+    @returns: a new list of filter specs
+    @see: L{explain_recipe}
+    """
+    specs = list(_normalise_recipe(recipe))
+    if notes is None:
+        notes = []
+
+    # keep applying rewrites until nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(specs) - 1):
+            result = _optimise_pair(specs[i], specs[i+1])
+            if result is not None:
+                specs[i:i+2], note = result
+                notes.append(note)
+                changed = True
+                break
+
+    return specs
+
+
+def explain_recipe(recipe):
+    """Describe how L{from_recipe} will run a recipe, after optimisation.
+    @param recipe: a list of dicts, a single dict, or a JSON literal string.
+    @returns: a printable string listing the steps to run, followed by the rewrites applied
+    """
+    notes = []
+    specs = optimise_recipe(recipe, notes)
+    lines = []
+    for i, spec in enumerate(specs):
+        lines.append('{}. {}'.format(i + 1, json.dumps(spec, sort_keys=True, default=str)))
+    if notes:
+        lines.append('')
+        lines.append('Rewrites applied:')
+        for note in notes:
+            lines.append('- ' + note)
+    else:
+        lines.append('')
+        lines.append('No rewrites applied.')
+    return "\n".join(lines) + "\n"
+
+
+def _normalise_recipe(recipe):
+    """Convert a JSON string or a single filter spec to a list of filter specs."""
+    if isinstance(recipe, six.string_types):
+        # a JSON string (parse it first)
+        recipe = json.loads(recipe)
+    if isinstance(recipe, dict) and recipe.get('filter'):
+        # a single filter (make it into a list)
+        recipe = [recipe]
+    return recipe
+
+
+_ROW_FILTERS = ('with_rows', 'without_rows',)
+_COLUMN_FILTERS = ('with_columns', 'without_columns',)
+_CELL_FILTERS = ('clean_data', 'replace_data',)
+_CLEAN_PROPERTIES = ('whitespace', 'upper', 'lower', 'date', 'number', 'latlon',)
+_ORDER_FREE_AGGREGATORS = ('count', 'concat', 'count_distinct', 'median',)
+
+
+def _optimise_pair(first, second):
+    """Try to rewrite two adjacent filter specs.
+    @returns: a tuple of a list of replacement specs and a note, or None if there's no rewrite
+    """
+    if not isinstance(first, dict) or not isinstance(second, dict):
+        return None
+    type1 = first.get('filter')
+    type2 = second.get('filter')
+
+    if type1 in _ROW_FILTERS and type2 in _ROW_FILTERS:
+        if not (_queries_are_local(first) and _queries_are_local(second)):
+            return None
+        if first == second:
+            return ([first], 'Dropped repeated {}'.format(type1),)
+        if type1 == 'without_rows' and type2 == 'without_rows' and not first.get('mask') and not second.get('mask'):
+            fused = dict(first)
+            fused['queries'] = _as_list(first.get('queries')) + _as_list(second.get('queries'))
+            return ([fused], 'Fused adjacent without_rows filters',)
+
+    elif type1 in _COLUMN_FILTERS and type2 in _COLUMN_FILTERS:
+        if first == second:
+            return ([first], 'Dropped repeated {}'.format(type1),)
+        if type1 == 'without_columns' and type2 == 'without_columns':
+            fused = dict(first)
+            fused['excludes'] = _as_pattern_list(first.get('excludes')) + _as_pattern_list(second.get('excludes'))
+            if first.get('skip_untagged') or second.get('skip_untagged'):
+                fused['skip_untagged'] = True
+            return ([fused], 'Fused adjacent without_columns filters',)
+        if type1 == 'with_columns' and type2 == 'without_columns' and not second.get('skip_untagged'):
+            # every column left matches an include pattern, so excludes for other hashtags can't match
+            # (but with no include patterns, with_columns keeps every column)
+            includes = _parse_patterns(first.get('includes'))
+            if includes and _patterns_disjoint(includes, _parse_patterns(second.get('excludes'))):
+                return ([first], 'Dropped without_columns that could not match any column left by with_columns',)
+
+    elif type2 in _ROW_FILTERS:
+        if type1 == 'sort':
+            return ([second, first], 'Moved {} ahead of sort'.format(type2),)
+        if type1 in _CELL_FILTERS and _queries_are_local(second):
+            changed_patterns = _cell_filter_patterns(first)
+            if (_patterns_disjoint(_query_patterns(second.get('queries')), changed_patterns) and
+                _patterns_disjoint(_query_patterns(second.get('mask')), changed_patterns)):
+                return ([second, first], 'Moved {} ahead of {}'.format(type2, type1),)
+
+    elif type2 in _COLUMN_FILTERS:
+        if type1 in _CELL_FILTERS and _cell_filter_is_local(first):
+            return ([second, first], 'Moved {} ahead of {}'.format(type2, type1),)
+
+    elif type1 == 'sort' and type2 == 'count':
+        if second.get('presorted'):
+            # a presorted count relies on the sort to group its rows
+            return None
+        try:
+            aggregators = Aggregator.parse_list(second.get('aggregators') or 'count() as Count#meta+count')
+        except Exception:
+            return None
+        if all(aggregator.type in _ORDER_FREE_AGGREGATORS for aggregator in aggregators):
+            return ([second], 'Dropped sort before count (the count does not depend on row order)',)
+
+    return None
+
+
+def _as_list(value):
+    """Make a list from a single query (or pattern) or a list of them."""
+    if not value:
+        return []
+    elif isinstance(value, six.string_types) or not hasattr(value, '__len__'):
+        return [value]
+    else:
+        return list(value)
+
+
+def _as_pattern_list(value):
+    """Make a list from a comma-separated string of tag patterns or a list of them."""
+    if isinstance(value, six.string_types):
+        return value.split(',')
+    else:
+        return _as_list(value)
+
+
+def _parse_patterns(value):
+    """Parse tag patterns from a spec, or return None if they can't be parsed."""
+    try:
+        return hxl.model.TagPattern.parse_list(value)
+    except Exception:
+        return None
+
+
+def _parse_queries(value):
+    """Parse row queries from a spec, or return None if they can't be parsed."""
+    try:
+        return hxl.model.RowQuery.parse_list(value)
+    except Exception:
+        return None
+
+
+def _queries_are_local(spec):
+    """Check that a row filter's result for each row depends only on that row's values.
+    Aggregate queries (like "is max") and formulas can depend on other rows or columns.
+    """
+    for key in ('queries', 'mask',):
+        queries = _parse_queries(spec.get(key))
+        if queries is None:
+            return False
+        for query in queries:
+            if query.is_aggregate or query.formula:
+                return False
+    return True
+
+
+def _query_patterns(value):
+    """Get the tag patterns used by row queries in a spec, or None if unknown."""
+    queries = _parse_queries(value)
+    if queries is None:
+        return None
+    return [query.pattern for query in queries]
+
+
+def _cell_filter_patterns(spec):
+    """Get the tag patterns for the columns that a clean_data or replace_data step may change.
+    @returns: a list of patterns, or None if unknown (or if the step depends on values in other rows)
+    """
+    if spec.get('filter') == 'clean_data':
+        if spec.get('date'):
+            # dates are cleaned using a guess from the whole column
+            return None
+        patterns = []
+        for key in _CLEAN_PROPERTIES:
+            value = spec.get(key)
+            if value is True:
+                # all columns
+                return None
+            parsed = _parse_patterns(value)
+            if parsed is None:
+                return None
+            patterns += parsed
+        return patterns
+    elif spec.get('filter') == 'replace_data':
+        if not spec.get('pattern'):
+            # all columns
+            return None
+        return _parse_patterns(spec.get('pattern'))
+    else:
+        return None
+
+
+def _cell_filter_is_local(spec):
+    """Check that a clean_data or replace_data step changes each value using only that value and its column."""
+    if spec.get('queries'):
+        # the row selection might depend on other columns
+        return False
+    if spec.get('filter') == 'clean_data':
+        # dates are cleaned using a guess from the whole column
+        return not spec.get('date')
+    return spec.get('filter') == 'replace_data'
+
+
+def _patterns_disjoint(patterns1, patterns2):
+    """Check that no column can match patterns from both lists.
+    Only patterns with different, non-wildcard hashtags are known to be disjoint.
+    @returns: True if the lists are known to be disjoint (False if they might overlap, or are unknown)
+    """
+    if patterns1 is None or patterns2 is None:
+        return False
+    for pattern1 in patterns1:
+        for pattern2 in patterns2:
+            if pattern1.is_wildcard() or pattern2.is_wildcard() or pattern1.tag == pattern2.tag:
+                return False
+    return True
+
+
 def list_product(lists, head=[]):
     """Generate the cartesian product of a list of lists
     The elements of the result will be all possible combinations of the elements of
@@ -1,24 +1,92 @@
 """ Evaluate a formula against a row
 """
 
-import logging
+import functools, logging
+import hxl.model
 import hxl.formulas.parser as p, hxl.formulas.lexer as l
 
 from hxl.util import logup
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of distinct formula strings to keep parsed
+FORMULA_CACHE_SIZE = 256
+
+
+class Formula(object):
+    """A formula parsed once, for evaluating against many rows.
+
+    Usage:
+
+        formula = hxl.formulas.eval.compile("#affected+f + #affected+m")
+        formula.bind(source.columns)
+        for row in source:
+            total = formula.eval(row)
+
+    """
+
+    def __init__(self, formula):
+        """Parse the formula.
+        @param formula: the formula as a string
+        """
+        self.formula = formula
+        """The original formula string"""
+
+        self.statement = p.parser.parse(formula, lexer=l.lexer)
+        """The parse tree, as a [function, args] list (None if the formula didn't parse)"""
+
+        self.patterns = []
+        """All tag patterns referenced in the formula"""
+
+        if self.statement:
+            self._find_patterns(self.statement)
+
+    def bind(self, columns):
+        """Resolve the formula's tag patterns against a list of columns.
+        The indices go into the shared column-index cache, so evaluating
+        rows with the same columns needs no further pattern matching.
+        @param columns: a list of hxl.model.Column objects
+        @returns: this object, for chaining
+        """
+        for pattern in self.patterns:
+            hxl.model.get_pattern_indices(pattern, columns)
+        return self
+
+    def eval(self, row):
+        """Evaluate the formula against a row.
+        @param row: the HXL row object
+        @returns: a scalar result
+        """
+        if self.statement:
+            return self.statement[0](row, self.statement[1])
+        else:
+            logup('Cannot parse formula', {"formula": self.formula}, level='error')
+            logger.error("Cannot parse formula {{ {} }}".format(self.formula))
+            return "**ERROR**"
+
+    def _find_patterns(self, node):
+        """Collect the tag patterns in a parse-tree node."""
+        if isinstance(node, hxl.model.TagPattern):
+            self.patterns.append(node)
+        elif isinstance(node, list):
+            for item in node:
+                self._find_patterns(item)
+
+
+@functools.lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile(formula):
+    """Parse a formula once, for repeated evaluation.
+    Parsed formulas are shared, so the same string is parsed only once.
+    @param formula: the formula as a string
+    @returns: a Formula object
+    """
+    return Formula(formula)
+
+
 def eval(row, formula):
     """Parse a formula, then return the result of evaluating it against a row.
     @param row: the HXL row object
     @param formula: the formula as a string
     @return: a scalar result
     """
-    statement = p.parser.parse(formula, lexer=l.lexer)
-    if statement:
-        return statement[0](row, statement[1])
-    else:
-        logup('Cannot parse formula', {"formula": formula}, level='error')
-        logger.error("Cannot parse formula {{ {} }}".format(formula))
-        return "**ERROR**"
-
+    return compile(formula).eval(row)
@@ -218,7 +218,7 @@ def data(data, input_options=None):
                     except:
                         pass
 
-        return HXLReader(make_input(data, input_options))
+        return HXLReader(make_input(data, input_options), input_options)
 
     
 def info(data, input_options=None):
@@ -792,6 +792,8 @@ class InputOptions:
         encoding (str): force a character encoding, regardless of HTTP info etc
         expand_merged (bool): expand merged areas by repeating the value (Excel only)
         scan_ckan_resources (bool): for a CKAN dataset URL, scan all resources for the first HXLated one (defaults to just using first resource)
+        intern_values (bool): share one string object for each distinct value in a column, to save memory for categorical data (default: False)
+        intern_limit (int): maximum number of distinct values to share for each column; a column with more is left alone from then on (default: 10000)
     """
 
     def __init__ (
@@ -804,7 +806,9 @@ class InputOptions:
             selector=None,
             encoding=None,
             expand_merged=False,
-            scan_ckan_resources=False
+            scan_ckan_resources=False,
+            intern_values=False,
+            intern_limit=10000
             ):
         self.allow_local = allow_local
         self.sheet_index = sheet_index
@@ -815,6 +819,8 @@ class InputOptions:
         self.encoding = encoding
         self.expand_merged = expand_merged
         self.scan_ckan_resources = scan_ckan_resources
+        self.intern_values = intern_values
+        self.intern_limit = intern_limit
 
 
 # Deprecated - will remove in future release
@@ -1404,12 +1410,19 @@ class HXLReader(hxl.model.Dataset):
     hashtags and attributes. The object itself is a hxl.model.Dataset
     that's available for iteration and filter chaining.
 
+    If the ``intern_values`` input option is set, the reader keeps a
+    table of the distinct values in each column, and replaces each new
+    value with the first equal one it saw, so that rows (and anything
+    downstream that keeps them, like caches) share a single string
+    object for each repeated value.
+
     """
 
-    def __init__(self, input):
+    def __init__(self, input, input_options=None):
         """
         Args:
             input (hxl.input.AbstractInput): an input source for raw data rows
+            input_options (InputOptions): options for reading the data (only ``intern_values`` and ``intern_limit`` apply here)
 
         """
         self._input = input
@@ -1418,6 +1431,11 @@ class HXLReader(hxl.model.Dataset):
         self._iter = iter(self._input)
         self._columns = None
         self._source_row_number = -1 # TODO this belongs in the iterator
+        if input_options is not None and input_options.intern_values:
+            self._intern_limit = input_options.intern_limit
+            self._intern_tables = [] # one dict for each column (None once it's full)
+        else:
+            self._intern_tables = None
 
     def __enter__(self):
         """Context-start support."""
@@ -1463,6 +1481,40 @@ class HXLReader(hxl.model.Dataset):
             self._columns = self._find_tags()
         return self._columns
 
+    def push_down(self, predicate=None, indices=None):
+        """Iterate over the raw data, selecting and projecting rows before creating any row objects.
+
+        Filters call this method automatically when the reader is
+        directly upstream (see ``hxl.model.Dataset.push_down``), so
+        that rows that a filter would discard, and values that it
+        would drop, never become ``hxl.model.Row`` objects.
+
+        Args:
+            predicate (function): an optional function that takes a raw list of values and returns True to include the row
+            indices (list): an optional list of 0-based column indices to keep, in ascending order
+
+        Returns:
+            iterator: an iterator over lists of values
+
+        """
+        self.columns # read past the hashtag row first
+        return self._push_down(predicate, indices)
+
+    def _push_down(self, predicate, indices):
+        """Generator for push_down()"""
+        while True:
+            try:
+                values = self._get_row()
+            except StopIteration:
+                return
+            if self._intern_tables is not None:
+                values = self._intern(values)
+            if predicate is None or predicate(values):
+                if indices is None:
+                    yield values
+                else:
+                    yield [values[i] for i in indices if i < len(values)]
+
     def _find_tags(self):
         """
         Go fishing for the HXL hashtag row in the first 25 rows.
@@ -1488,6 +1540,35 @@ class HXLReader(hxl.model.Dataset):
         self._source_row_number += 1
         return next(self._iter)
 
+    def _intern(self, values):
+        """Replace values in a raw data row with equal values seen before in the same column.
+
+        Args:
+            values (list): the raw data row (modified in place, if it's a list)
+
+        Returns:
+            list: the row, with shared values
+
+        """
+        if not isinstance(values, list):
+            values = list(values)
+        tables = self._intern_tables
+        if len(tables) < len(values):
+            tables.extend({} for i in range(len(values) - len(tables)))
+        for i, value in enumerate(values):
+            table = tables[i]
+            if table is None or not isinstance(value, str):
+                continue
+            shared = table.get(value)
+            if shared is not None:
+                values[i] = shared
+            elif len(table) < self._intern_limit:
+                table[value] = value
+            else:
+                # too many distinct values to be worth sharing
+                tables[i] = None
+        return values
+
     class _HXLIter:
         """Internal iterator class"""
 
@@ -1502,6 +1583,8 @@ class HXLReader(hxl.model.Dataset):
             """
             columns = self.outer.columns
             values = self.outer._get_row()
+            if self.outer._intern_tables is not None:
+                values = self.outer._intern(values)
             self.row_number += 1
             return hxl.model.Row(columns=columns, values=values, row_number=self.row_number, source_row_number=self.outer._source_row_number)
 
@@ -1518,6 +1601,7 @@ def from_spec(spec, input=None, allow_local_ok=False):
     - **verify_ssl:** if 0 (false), do not verify SSL certificates. This is useful for self-signed certificates.
     - **http_headers:** an object (dictionary) of HTTP headers and values, e.g. for authorization.
     - **encoding:** the character encoding to use (e.g. "utf-8")
+    - **intern_values:** if 1 (true), share one string object for each distinct value in a column, to save memory
     - **tagger:** optional information for adding HXL hashtags to a non-HXL data source
     - **recipe:** the filters to apply to the HXL data
 
@@ -1574,31 +1658,34 @@ def from_spec(spec, input=None, allow_local_ok=False):
     encoding = spec.get('encoding', None)
     expand_merged = spec.get('expand_merged', False)
     scan_ckan_resources = spec.get('scan_ckan_resources', False)
+    intern_values = spec.get('intern_values', False)
 
     # recipe
     tagger_spec = spec.get('tagger', None)
     recipe_spec = spec.get('recipe', [])
 
     # set up the input
+    input_options = InputOptions(
+        allow_local=allow_local,
+        sheet_index=sheet_index,
+        timeout=timeout,
+        verify_ssl=verify_ssl,
+        http_headers=http_headers,
+        encoding=encoding,
+        expand_merged=expand_merged,
+        scan_ckan_resources=scan_ckan_resources,
+        intern_values=intern_values,
+    )
     input = make_input(
         raw_source=input if input else input_spec,
-        input_options = InputOptions(
-            allow_local=allow_local,
-            sheet_index=sheet_index,
-            timeout=timeout,
-            verify_ssl=verify_ssl,
-            http_headers=http_headers,
-            encoding=encoding,
-            expand_merged=expand_merged,
-            scan_ckan_resources=scan_ckan_resources,
-        )
+        input_options=input_options
     )
 
     # autotag if requested
     if tagger_spec:
         source = hxl.converters.Tagger._load(input, tagger_spec)
     else:
-        source = HXLReader(input)
+        source = HXLReader(input, input_options)
 
     # compile the main recipe
     return hxl.filters.from_recipe(
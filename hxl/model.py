@@ -19,7 +19,7 @@ This code is released into the Public Domain and comes with NO WARRANTY.
 
 """
 
-import abc, copy, csv, dateutil, hashlib, json, logging, operator, re, six
+import abc, collections, copy, csv, dateutil, functools, hashlib, json, logging, operator, re, six, threading
 
 import hxl
 
@@ -32,6 +32,63 @@ logger = logging.getLogger(__name__)
 # At least this percentage of cells must parse as HXL hashtags
 FUZZY_HASHTAG_PERCENTAGE = 0.5
 
+# Maximum number of distinct tag-pattern strings to keep parsed
+PARSE_CACHE_SIZE = 1024
+
+# Maximum number of distinct cell values to remember results for in a compiled row query
+QUERY_MEMO_SIZE = 10000
+
+# Default number of rows in each batch for Dataset.iter_batches()
+BATCH_SIZE = 2000
+
+# Default memory budget in bytes for Dataset.cache(), including caches
+# that filters add automatically (None for no limit)
+CACHE_MAX_MEMORY = None
+
+# Maximum number of distinct attributes to give bits for compiled tag
+# matching (patterns and columns with other attributes match using sets)
+ATTRIBUTE_VOCABULARY_SIZE = 1024
+
+
+#
+# Attribute vocabulary for compiled matching
+#
+
+_attribute_bits = {}
+"""Global map of attribute names to single-bit integer masks (at most L{ATTRIBUTE_VOCABULARY_SIZE})"""
+
+_attribute_bits_lock = threading.Lock()
+
+def get_attribute_bit(attribute):
+    """Get the bit assigned to an attribute in the global vocabulary.
+    A new bit is allocated the first time an attribute is seen, until
+    the vocabulary reaches L{ATTRIBUTE_VOCABULARY_SIZE}, so that masks
+    stay small in a long-running process that reads arbitrary data.
+    @param attribute: the attribute name (lower case, without "+")
+    @returns: an integer with exactly one bit set, or None if the vocabulary is full
+    """
+    bit = _attribute_bits.get(attribute)
+    if bit is None:
+        with _attribute_bits_lock:
+            bit = _attribute_bits.get(attribute)
+            if bit is None and len(_attribute_bits) < ATTRIBUTE_VOCABULARY_SIZE:
+                bit = 1 << len(_attribute_bits)
+                _attribute_bits[attribute] = bit
+    return bit
+
+def get_attribute_mask(attributes):
+    """Combine the bits for a collection of attributes.
+    @param attributes: an iterable of attribute names
+    @returns: an integer bitmask (0 if there are no attributes), or None if any attribute has no bit
+    """
+    mask = 0
+    for attribute in attributes:
+        bit = get_attribute_bit(attribute)
+        if bit is None:
+            return None
+        mask |= bit
+    return mask
+
 
 class TagPattern(object):
     """Pattern for matching a HXL hashtag and attributes
@@ -56,6 +113,11 @@ class TagPattern(object):
         exclude_attributes: a list of attributes that must not be present
         is_absolute: if True, no attributes are allowed except those in _include_attributes_
 
+    A pattern is compiled on its first match (see
+    [compile()](#hxl.model.TagPattern.compile)). The attribute sets
+    are frozensets, and assigning a new tag, attribute set, or
+    absolute flag discards the compiled form.
+
     """
 
 
@@ -64,44 +126,100 @@ class TagPattern(object):
     """
 
     def __init__(self, tag, include_attributes=[], exclude_attributes=[], is_absolute=False):
+        self._compiled = None
+        """Compiled form of the pattern, created on first use"""
+
         self.tag = tag
+        self.include_attributes = include_attributes
+        self.exclude_attributes = exclude_attributes
+        self.is_absolute = is_absolute
 
-        self.include_attributes = set(include_attributes)
-        """Set of all attributes that must be present"""
+    @property
+    def tag(self):
+        """The basic hashtag (or "#*" for a wildcard)"""
+        return self._tag
 
-        self.exclude_attributes = set(exclude_attributes)
-        """Set of all attributes that must not be present"""
+    @tag.setter
+    def tag(self, tag):
+        self._tag = tag
+        self._compiled = None
 
-        self.is_absolute = is_absolute
+    @property
+    def include_attributes(self):
+        """Frozen set of all attributes that must be present"""
+        return self._include_attributes
+
+    @include_attributes.setter
+    def include_attributes(self, attributes):
+        self._include_attributes = frozenset(attributes)
+        self._compiled = None
+
+    @property
+    def exclude_attributes(self):
+        """Frozen set of all attributes that must not be present"""
+        return self._exclude_attributes
+
+    @exclude_attributes.setter
+    def exclude_attributes(self, attributes):
+        self._exclude_attributes = frozenset(attributes)
+        self._compiled = None
+
+    @property
+    def is_absolute(self):
         """True if this pattern is absolute (no extra attributes allowed)"""
+        return self._is_absolute
+
+    @is_absolute.setter
+    def is_absolute(self, is_absolute):
+        self._is_absolute = is_absolute
+        self._compiled = None
 
     def is_wildcard(self):
         return self.tag == '#*'
 
+    def compile(self):
+        """Reduce the pattern to a tuple for fast matching.
+
+        The tuple contains the hashtag (None for a wildcard), the
+        bitmask of required attributes, the bitmask of forbidden
+        attributes, and the absolute flag. The masks are None if an
+        attribute is outside the vocabulary (see
+        L{get_attribute_bit}), and then matching uses sets instead.
+        The result is saved until one of the pattern's properties is
+        assigned a new value.
+
+        @returns: a tuple (tag, required_mask, forbidden_mask, is_absolute)
+        """
+        if self._compiled is None:
+            self._compiled = (
+                None if self.is_wildcard() else self.tag,
+                get_attribute_mask(self.include_attributes),
+                get_attribute_mask(self.exclude_attributes),
+                self.is_absolute,
+            )
+        return self._compiled
+
     def match(self, column):
         """Check whether a Column matches this pattern.
         @param column: the column to check
         @returns: True if the column is a match
         """
-        if column.tag and (self.is_wildcard() or self.tag == column.tag):
-            # all include_attributes must be present
-            if self.include_attributes:
-                for attribute in self.include_attributes:
-                    if attribute not in column.attributes:
-                        return False
-            # all exclude_attributes must be absent
-            if self.exclude_attributes:
-                for attribute in self.exclude_attributes:
-                    if attribute in column.attributes:
-                        return False
-            # if absolute, then only specified attributes may be present
-            if self.is_absolute:
-                for attribute in column.attributes:
-                    if attribute not in self.include_attributes:
-                        return False
-            return True
-        else:
+        tag, required_mask, forbidden_mask, is_absolute = self._compiled or self.compile()
+        if not column.tag or (tag is not None and tag != column.tag):
             return False
+        mask = column.attribute_mask
+        if mask is None or required_mask is None or forbidden_mask is None:
+            # attributes outside the vocabulary, so compare sets
+            if is_absolute:
+                return column.attributes == self.include_attributes
+            else:
+                return self.include_attributes <= column.attributes and not (self.exclude_attributes & column.attributes)
+        elif is_absolute:
+            # exactly the specified attributes, and no others
+            return mask == required_mask
+        else:
+            # all include_attributes present, and all exclude_attributes absent
+            return (mask & required_mask) == required_mask and not (mask & forbidden_mask)
 
     def get_matching_columns(self, columns):
         """Return a list of columns that match the pattern.
@@ -166,7 +284,19 @@ class TagPattern(object):
         elif isinstance(s, TagPattern):
             # edge case: already parsed
             return s
+        else:
+            # recipes reuse the same few patterns, so remember the parsed parts
+            # (but give each caller its own object)
+            tag, include_attributes, exclude_attributes, is_absolute = TagPattern._parse_string(s)
+            return TagPattern(tag, include_attributes, exclude_attributes, is_absolute)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def _parse_string(s):
+        """Parse a tag-pattern string into its parts (memoised by L{parse})
+        @param s: the tag-pattern string to parse
+        @returns: a tuple of the tag, a frozenset of included attributes, a frozenset of excluded attributes, and the absolute flag
+        """
         result = re.match(TagPattern.PATTERN, s)
         if result:
             tag = '#' + result.group(1).lower()
@@ -184,12 +314,7 @@ class TagPattern(object):
                     raise ValueError('Exclusions not allowed in absolute patterns')
             else:
                 is_absolute = False
-            return TagPattern(
-                tag,
-                include_attributes=include_attributes,
-                exclude_attributes=exclude_attributes,
-                is_absolute=is_absolute
-            )
+            return (tag, frozenset(include_attributes), frozenset(exclude_attributes), is_absolute,)
         else:
             raise hxl.HXLException('Malformed tag: ' + s)
 
@@ -270,6 +395,46 @@ class Dataset(object):
         """
         raise RuntimeException("child class must implement __iter__() method")
 
+    def iter_batches(self, size=BATCH_SIZE):
+        """Get an iterator over the rows in batches.
+        Produces the same rows as iterating over the dataset, in the
+        same order, but a list at a time, so that filters can
+        process a whole batch in a single call (see
+        L{hxl.filters.AbstractStreamingFilter.filter_batch}). Batches
+        may be shorter than I{size} (for example, after filtering), but
+        are never empty.
+        @param size: the maximum number of rows in each batch (default: L{BATCH_SIZE})
+        @returns: an iterator that returns lists of L{hxl.model.Row} objects
+        """
+        rows = iter(self)
+        batch = []
+        while True:
+            try:
+                batch.append(next(rows))
+            except StopIteration:
+                break
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def push_down(self, predicate=None, indices=None):
+        """Iterate over lists of values, selecting and projecting them at the source.
+
+        A data source that can test and trim its raw data before
+        creating L{Row} objects overrides this method, and filters
+        such as L{hxl.filters.RowFilter} and
+        L{hxl.filters.ColumnFilter} pass their work down to it
+        automatically. By default, this is not supported.
+
+        @param predicate: an optional function that takes a list of values (for this dataset's
+        columns) and returns True to include the row
+        @param indices: an optional list of 0-based column indices to keep, in ascending order
+        @returns: an iterator over lists of values, or None if the dataset doesn't support pushdown
+        """
+        return None
+
     @property
     def is_cached(self):
         """Test whether the source data is cached (replayable).
@@ -278,6 +443,19 @@ class Dataset(object):
         """
         return False
 
+    @property
+    def is_columnar(self):
+        """Test whether the dataset stores its values column by column.
+        A columnar dataset also provides the methods
+        C{get_column_count()}, C{get_column_values(index)},
+        C{get_column_value_set(index)}, C{get_column_numbers(index)}, and
+        C{get_column_dates(index)} for column-at-a-time processing.
+        By default, this is False, but some subclasses may override.
+        @returns: C{True} if the dataset is columnar; C{False} otherwise.
+        @see: L{hxl.filters.ColumnarCacheFilter}
+        """
+        return False
+
     @property
     @abc.abstractmethod
     def columns(self):
@@ -380,16 +558,27 @@ class Dataset(object):
         value_set = set([])
         if tag_pattern:
             tag_pattern = TagPattern.parse(tag_pattern)
+        if normalise:
+            normalise_value = hxl.datatypes.normalise
+        else:
+            normalise_value = hxl.datatypes.normalise_space
+
+        if self.is_columnar:
+            # normalise each distinct value only once
+            if tag_pattern:
+                indices = get_pattern_indices(tag_pattern, self.columns)
+            else:
+                indices = range(self.get_column_count())
+            for index in indices:
+                value_set.update([normalise_value(s) for s in self.get_column_value_set(index)])
+            return value_set
+
         for row in self:
             if tag_pattern:
                 new_values = row.get_all(tag_pattern)
             else:
-                new_values = row.values
-            if normalise:
-                new_values = [hxl.datatypes.normalise(s) for s in new_values]
-            else:
-                new_values = [hxl.datatypes.normalise_space(s) for s in new_values]
-            value_set.update(new_values)
+                new_values = row._values
+            value_set.update([normalise_value(s) for s in new_values])
         return value_set
 
 
@@ -423,34 +612,70 @@ class Dataset(object):
         result_raw = None # what's actually in the dataset
         result_normalised = None # normalised version for comparison
 
-        # Look at every row
-        for row in self:
-            # Look at every matching value in every row
-            for i, value in enumerate(row.get_all(pattern)):
-                # ignore empty values
-                if hxl.datatypes.is_empty(value):
-                    continue
-
-                # make a normalised value for comparison
-                normalised = hxl.datatypes.normalise(value, row.columns[i])
-
-                # first non-empty value is always a match
-                if result_normalised is None:
-                    result_raw = value
-                    result_normalised = normalised
-                else:
-                    # try comparing the normalised types first, then strings on failure
-                    try:
-                        if op(normalised, result_normalised):
-                            result_raw = value
-                            result_normalised = normalised
-                    except TypeError:
-                        if op(str(normalised), str(result_normalised)):
-                            result_raw = value
-                            result_normalised = normalised
+        def candidates():
+            """Generate (raw, normalised) tuples for every non-empty matching value, in row order"""
+            if self.is_columnar:
+                indices = get_pattern_indices(pattern, self.columns)
+                if len(indices) == 1:
+                    # with a single column, the row order is the column order
+                    yield from self._get_column_normalised(indices[0])
+                    return
+            # Look at every row
+            for row in self:
+                # Look at every matching value in every row
+                for i in get_pattern_indices(pattern, row.columns):
+                    if i >= len(row._values):
+                        break
+                    value = row._values[i]
+                    # ignore empty values
+                    if not hxl.datatypes.is_empty(value):
+                        # make a normalised value for comparison
+                        yield (value, hxl.datatypes.normalise(value, row.columns[i]),)
+
+        for value, normalised in candidates():
+            # first non-empty value is always a match
+            if result_normalised is None:
+                result_raw = value
+                result_normalised = normalised
+            else:
+                # try comparing the normalised types first, then strings on failure
+                try:
+                    if op(normalised, result_normalised):
+                        result_raw = value
+                        result_normalised = normalised
+                except TypeError:
+                    if op(str(normalised), str(result_normalised)):
+                        result_raw = value
+                        result_normalised = normalised
 
         return result_raw
 
+    def _get_column_normalised(self, index):
+        """Generate (raw, normalised) tuples for the non-empty values in a single column.
+        Only for columnar datasets; uses the typed values to avoid normalising every cell.
+        Normalisation is the same as L{hxl.datatypes.normalise}, using the column for hints.
+        @param index: the 0-based column index
+        """
+        values = self.get_column_values(index)
+        numbers = self.get_column_numbers(index)
+        if self.columns[index].tag == '#date':
+            dates = self.get_column_dates(index)
+        else:
+            dates = None
+        strings = {}
+        for row_index, value in enumerate(values):
+            if hxl.datatypes.is_empty(value):
+                continue
+            if dates is not None and dates[row_index] is not None:
+                yield (value, dates[row_index],)
+            elif numbers[row_index] is not None:
+                yield (value, numbers[row_index],)
+            else:
+                normalised = strings.get(value)
+                if normalised is None:
+                    normalised = strings[value] = hxl.datatypes.normalise_string(value)
+                yield (value, normalised,)
+
     def min(self, pattern):
         """Calculate the minimum value for a tag pattern
         Will iterate through the dataset, and use values from multiple matching columns.
@@ -492,21 +717,23 @@ class Dataset(object):
     # Filters
     #
 
-    def append(self, append_sources, add_columns=True, queries=[]):
+    def append(self, append_sources, add_columns=True, queries=[], workers=None):
         """Append additional datasets.
         @param append_sources: a list of sources to append
         @param add_columns: if True (default), include any extra columns in the append sources
         @param queries: a list of row queries to select rows for inclusion from the append sources.
+        @param workers: maximum number of threads for opening append sources concurrently
         @returns: a new HXL source for chaining
         """
         import hxl.filters
-        return hxl.filters.AppendFilter(self, append_sources, add_columns=add_columns, queries=queries)
+        return hxl.filters.AppendFilter(self, append_sources, add_columns=add_columns, queries=queries, workers=workers)
 
-    def append_external_list(self, source_list_url, add_columns=True, queries=[]):
+    def append_external_list(self, source_list_url, add_columns=True, queries=[], workers=None):
         """Append additional datasets from an external list
         @param source_list_url: URL of a HXL dataset containing a list of sources to append.
         @param add_columns: if True (default), include any extra columns in the append sources.
         @param queries: a list of row queries to select rows for inclusion from the append sources.
+        @param workers: maximum number of threads for opening append sources concurrently
         @returns: a new HXL source for chaining
         """
         import hxl.filters
@@ -515,17 +742,27 @@ class Dataset(object):
         append_sources = hxl.filters.AppendFilter.parse_external_source_list(source_list_url)
         logup('Done loading', {"list": source_list_url}, level='debug')
         logger.debug("Done loading")
-        return hxl.filters.AppendFilter(self, append_sources, add_columns=add_columns, queries=queries)
+        return hxl.filters.AppendFilter(self, append_sources, add_columns=add_columns, queries=queries, workers=workers)
 
-    def cache(self):
-        """Add a caching filter to the dataset."""
+    def cache(self, columnar=False, max_memory=None):
+        """Add a caching filter to the dataset.
+        @param columnar: if True, store the data column by column (see L{hxl.filters.ColumnarCacheFilter})
+        @param max_memory: if set, the approximate maximum memory in bytes to use, saving the rest to a temporary file (default: L{CACHE_MAX_MEMORY})
+        """
         import hxl.filters
-        return hxl.filters.CacheFilter(self)
+        if columnar:
+            return hxl.filters.ColumnarCacheFilter(self)
+        else:
+            if max_memory is None:
+                max_memory = CACHE_MAX_MEMORY
+            return hxl.filters.CacheFilter(self, max_memory=max_memory)
 
-    def dedup(self, patterns=[], queries=[]):
-        """Deduplicate a dataset."""
+    def dedup(self, patterns=[], queries=[], memory_limit=None):
+        """Deduplicate a dataset.
+        @param memory_limit: if set, the approximate maximum memory in bytes to use, moving row digests to disk beyond that
+        """
         import hxl.filters
-        return hxl.filters.DeduplicationFilter(self, patterns=patterns, queries=queries)
+        return hxl.filters.DeduplicationFilter(self, patterns=patterns, queries=queries, memory_limit=memory_limit)
 
     def with_columns(self, includes):
         """Select matching columns."""
@@ -555,16 +792,31 @@ class Dataset(object):
         import hxl.filters
         return hxl.filters.RowFilter(self, queries=queries, reverse=True, mask=mask)
 
-    def sort(self, keys=None, reverse=False):
-        """Sort the dataset (caching)."""
+    def sort(self, keys=None, reverse=False, memory_limit=None):
+        """Sort the dataset (caching).
+        @param memory_limit: if set, the approximate maximum memory in bytes to use, spilling to temporary files beyond that
+        """
+        import hxl.filters
+        return hxl.filters.SortFilter(self, tags=keys, reverse=reverse, memory_limit=memory_limit)
+
+    def top(self, n, keys=None, reverse=False):
+        """Keep only the first n rows in sort order (caching).
+        Uses memory only for n rows, rather than sorting the whole dataset.
+        @param n: the maximum number of rows to keep
+        """
         import hxl.filters
-        return hxl.filters.SortFilter(self, tags=keys, reverse=reverse)
+        return hxl.filters.TopFilter(self, n, tags=keys, reverse=reverse)
 
-    def count(self, patterns=[], aggregators=None, queries=[]):
-        """Count values in the dataset (caching)."""
+    def count(self, patterns=[], aggregators=None, queries=[], memory_limit=None, presorted=False, check_sorted=False):
+        """Count values in the dataset (caching, unless presorted).
+        @param memory_limit: if set, the approximate maximum memory in bytes to use, spilling to temporary files beyond that
+        @param presorted: if True, the dataset is already sorted on the patterns, so stream the groups in input order
+        @param check_sorted: if True (with I{presorted}), raise an exception if the dataset isn't sorted
+        """
         import hxl.filters
         return hxl.filters.CountFilter(
-            self, patterns=patterns, aggregators=aggregators, queries=queries
+            self, patterns=patterns, aggregators=aggregators, queries=queries, memory_limit=memory_limit,
+            presorted=presorted, check_sorted=check_sorted
         )
 
     def row_counter(self, queries=[]):
@@ -589,6 +841,16 @@ class Dataset(object):
         import hxl.filters
         return hxl.filters.AddColumnsFilter(self, specs=specs, before=before)
 
+    def parallel(self, workers=None, batch_size=BATCH_SIZE):
+        """Run the stateless streaming filters directly upstream in parallel worker processes.
+        @param workers: the number of worker processes (default: the number of CPUs)
+        @param batch_size: the number of rows to send to a worker at once
+        @returns: a new HXL source for chaining
+        @see: L{hxl.filters.ParallelFilter}
+        """
+        import hxl.filters
+        return hxl.filters.ParallelFilter(self, workers=workers, batch_size=batch_size)
+
     def rename_columns(self, specs):
         """Changes headers and tags on a column."""
         import hxl.filters
@@ -612,7 +874,7 @@ class Dataset(object):
             queries=queries
         )
 
-    def merge_data(self, merge_source, keys, tags, replace=False, overwrite=False, queries=[]):
+    def merge_data(self, merge_source, keys, tags, replace=False, overwrite=False, queries=[], index_dir=None, index_key=None):
         """Merges values from a second dataset.
         @param merge_source: the second HXL data source
         @param keys: a single tagspec or list of tagspecs for the shared keys
@@ -620,18 +882,23 @@ class Dataset(object):
         @param replace: if True, replace existing columns when present
         @param overwrite: if True, overwrite individual values in existing columns when available
         @param queries: optional row queries to control the merge
+        @param index_dir: if set, a directory for persistent on-disk indices of the merge values
+        @param index_key: a string that identifies the merge dataset's content (required with index_dir)
         """
         import hxl.filters
-        return hxl.filters.MergeDataFilter(self, merge_source, keys, tags, replace, overwrite, queries=queries)
+        return hxl.filters.MergeDataFilter(
+            self, merge_source, keys, tags, replace, overwrite, queries=queries, index_dir=index_dir, index_key=index_key
+        )
 
-    def expand_lists(self, patterns=None, separator="|", correlate=False, queries=[]):
+    def expand_lists(self, patterns=None, separator="|", correlate=False, queries=[], max_rows=None):
         """Expand lists by repeating rows.
         By default, applies to every column with a +list attribute, and uses "|" as the separator.
         @param patterns: a single tag pattern or list of tag patterns for columns to expand
         @param separator: the list-item separator
+        @param max_rows: the maximum number of rows to generate from a single input row (default: no limit)
         """
         import hxl.filters
-        return hxl.filters.ExpandListsFilter(self, patterns=patterns, separator=separator, correlate=correlate, queries=queries)
+        return hxl.filters.ExpandListsFilter(self, patterns=patterns, separator=separator, correlate=correlate, queries=queries, max_rows=max_rows)
 
     def explode(self, header_attribute='header', value_attribute='value'):
         """Explodes a wide dataset into a long datasets.
@@ -644,15 +911,17 @@ class Dataset(object):
         import hxl.filters
         return hxl.filters.ExplodeFilter(self, header_attribute, value_attribute)
 
-    def implode(self, label_pattern, value_pattern):
+    def implode(self, label_pattern, value_pattern, presorted=False, labels=None):
         """Implodes a long dataset into a wide dataset
         @param label_pattern: the tag pattern to match the label column
         @param value_pattern: the tag pattern to match the
+        @param presorted: if True, the dataset is already grouped by its other columns, so stream the output
+        @param labels: optional list of labels for the wide columns (required for presorted input unless the dataset is cached)
         @return: filtered dataset.
         @see hxl.filters.ImplodeFilter
         """
         import hxl.filters
-        return hxl.filters.ImplodeFilter(self, label_pattern=label_pattern, value_pattern=value_pattern)
+        return hxl.filters.ImplodeFilter(self, label_pattern=label_pattern, value_pattern=value_pattern, presorted=presorted, labels=labels)
 
     def jsonpath(self, path, patterns=[], queries=[], use_json=True):
         """Parse the value as a JSON expression and extract data from it.
@@ -738,7 +1007,7 @@ class Column(object):
     PATTERN = r'^\s*(#{token})((?:\s*\+{token})*)\s*$'.format(token=hxl.datatypes.TOKEN_PATTERN)
 
     # To tighten debugging (may reconsider later -- not really a question of memory efficiency here)
-    __slots__ = ['tag', 'attributes', 'attribute_list', 'header', 'column_number']
+    __slots__ = ['tag', '_attributes', 'attribute_list', 'header', 'column_number', '_attribute_mask']
 
     def __init__(self, tag=None, attributes=(), header=None, column_number=None):
         """
@@ -753,9 +1022,30 @@ class Column(object):
         self.tag = tag
         self.header = header
         self.column_number = column_number
-        self.attributes = set([a.lower() for a in attributes])
+        self.attributes = [a.lower() for a in attributes]
         self.attribute_list = [a.lower() for a in attributes] # to preserve order
 
+    @property
+    def attributes(self):
+        """Frozen set of the column's attributes (assign a new collection to change it)"""
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = frozenset(attributes)
+        self._attribute_mask = None
+
+    @property
+    def attribute_mask(self):
+        """Bitmask of the column's attributes, for compiled pattern matching.
+        None if any attribute is outside the vocabulary.
+        @see: L{TagPattern.compile}
+        """
+        if self._attribute_mask is None:
+            mask = get_attribute_mask(self.attributes)
+            self._attribute_mask = -1 if mask is None else mask # -1: no mask possible
+        return self._attribute_mask if self._attribute_mask >= 0 else None
+
     @property
     def display_tag(self):
         """Default display version of a HXL hashtag.
@@ -784,14 +1074,14 @@ class Column(object):
     def add_attribute(self, attribute):
         """Add an attribute to the column."""
         if attribute not in self.attributes:
-            self.attributes.add(attribute)
+            self.attributes = self.attributes | {attribute}
             self.attribute_list.append(attribute)
         return self
 
     def remove_attribute(self, attribute):
         """Remove an attribute from the column."""
         if attribute in self.attributes:
-            self.attributes.remove(attribute)
+            self.attributes = self.attributes - {attribute}
             self.attribute_list.remove(attribute)
         return self
 
@@ -947,21 +1237,66 @@ class Row(object):
     """
 
     # Predefine the slots for efficiency (may reconsider later)
-    __slots__ = ['columns', 'values', 'row_number', 'source_row_number']
+    __slots__ = ['columns', '_values', '_shared', 'row_number', 'source_row_number']
 
-    def __init__(self, columns, values=[], row_number=None, source_row_number=None):
+    def __init__(self, columns, values=[], row_number=None, source_row_number=None, shared=False):
         """
         Set up a new row.
+
+        Normally, the row makes its own copy of the values. If I{shared}
+        is True, the row uses the list provided, and treats it as
+        copy-on-write: the row will make a private copy the first time
+        a caller asks for L{values} (which might be modified), while
+        read-only methods like L{get}, L{get_all}, and L{key} use the
+        shared list directly. Filter chains use this to pass the same
+        list through stages that don't change the values.
+
         @param columns: The column definitions (array of Column objects).
         @param values: (optional) The string values for the row (default: [])
         @param row_number: (optional) The zero-based logical row number in the input dataset, if available (default: None)
         @param source_row_number: (optional) The zero-based source row number in the input dataset, if available (default: None)
+        @param shared: (optional) if True, share the values list rather than copying it (default: False)
         """
         self.columns = columns
-        self.values = copy.copy(values)
+        if shared:
+            self._values = values
+        else:
+            self._values = copy.copy(values)
+        self._shared = shared
         self.row_number = row_number
         self.source_row_number = source_row_number
 
+    @property
+    def values(self):
+        """The list of values in the row.
+        If the list is shared with other rows, make a private copy first, since the caller may modify it.
+        """
+        if self._shared:
+            self._values = copy.copy(self._values)
+            self._shared = False
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+        self._shared = False
+
+    def share_values(self):
+        """Get the list of values without copying it, for reading or for sharing with a new row.
+        The row will treat the list as copy-on-write afterwards.
+        @returns: the list of values, which the caller must not modify
+        @see: L{__init__}
+        """
+        self._shared = True
+        return self._values
+
+    def copy_values(self):
+        """Get a private copy of the values, for the caller to modify.
+        Unlike C{copy.copy(row.values)}, this never copies the list twice.
+        @returns: a new list of values
+        """
+        return copy.copy(self._values)
+
     def append(self, value):
         """
         Append a value to the row.
@@ -991,26 +1326,21 @@ class Row(object):
                     return [value]
             return value
 
-        if type(tag) is TagPattern:
-            pattern = tag
-        else:
-            pattern = TagPattern.parse(tag)
-
-        for i, column in enumerate(self.columns):
-            if i >= len(self.values):
+        values = self._values
+        for i in get_pattern_indices(tag, self.columns):
+            if i >= len(values):
                 break
-            if pattern.match(column):
-                if index is None:
-                    # None (the default) is a special case: it means look
-                    # for the first truthy value
-                    if self.values[i]:
-                        return parse(column, self.values[i])
+            if index is None:
+                # None (the default) is a special case: it means look
+                # for the first truthy value
+                if values[i]:
+                    return parse(self.columns[i], values[i])
+            else:
+                # Otherwise, look for a specific index
+                if index == 0:
+                    return parse(self.columns[i], values[i])
                 else:
-                    # Otherwise, look for a specific index
-                    if index == 0:
-                        return parse(column, self.values[i])
-                    else:
-                        index = index - 1
+                    index = index - 1
         return default
 
     def get_all(self, tag, default=None):
@@ -1020,20 +1350,15 @@ class Row(object):
         @return An array of values for the HXL hashtag.
         """
 
-        if type(tag) is TagPattern:
-            pattern = tag
-        else:
-            pattern = TagPattern.parse(tag)
-
+        values = self._values
         result = []
-        for i, column in enumerate(self.columns):
-            if i >= len(self.values):
+        for i in get_pattern_indices(tag, self.columns):
+            if i >= len(values):
                 break
-            if pattern.match(column):
-                value = self.values[i]
-                if default is not None and not value:
-                    value = default
-                result.append(value)
+            value = values[i]
+            if default is not None and not value:
+                value = default
+            result.append(value)
         return result
 
     def key(self, patterns=None, indices=None):
@@ -1046,16 +1371,16 @@ class Row(object):
 
         # if the user doesn't provide indices, get indices from the pattern
         if not indices and patterns:
-            indices = get_column_indices(patterns, self.columns)
+            indices = get_patterns_indices(patterns, self.columns)
 
         if indices:
             # if we have indices, use them to build the key
             for i in indices:
-                if i < len(self.values):
-                    key.append(hxl.datatypes.normalise(self.values[i], self.columns[i]))
+                if i < len(self._values):
+                    key.append(hxl.datatypes.normalise(self._values[i], self.columns[i]))
         else:
             # if there are still no indices, use the whole row for the key
-            for i, value in enumerate(self.values):
+            for i, value in enumerate(self._values):
                 key.append(hxl.datatypes.normalise(value, self.columns[i]))
 
         return tuple(key) # make it into a tuple so that it's hashable
@@ -1071,8 +1396,8 @@ class Row(object):
         data = {}
         for i, col in enumerate(self.columns):
             key = col.get_display_tag(sort_attributes=True)
-            if key and (not key in data) and (i < len(self.values)):
-                data[key] = self.values[i]
+            if key and (not key in data) and (i < len(self._values)):
+                data[key] = self._values[i]
         return data
 
     def __getitem__(self, index):
@@ -1082,14 +1407,14 @@ class Row(object):
         @return The value if it exists.
         @exception IndexError if the index is out of range.
         """
-        return self.values[index]
+        return self._values[index]
 
     def __str__(self):
         """
         Create a string representation of a row for debugging.
         """
         s = '<Row';
-        for column_number, value in enumerate(self.values):
+        for column_number, value in enumerate(self._values):
             s += "\n  " + str(self.columns[column_number]) + "=" + str(value)
         s += "\n>"
         return s
@@ -1125,7 +1450,15 @@ class RowQuery(object):
         # calculate later
         self.date_value = None
         self.number_value = None
-        self._saved_indices = None
+        self.string_value = None
+        self._compiled = None
+        """The compiled match function and the column list it's bound to"""
+
+    def __getstate__(self):
+        """Leave out the compiled functions when pickling (they'll be compiled again on demand)."""
+        state = dict(self.__dict__)
+        state['_compiled'] = None
+        return state
 
     def calc_aggregate(self, dataset):
         """Calculate the aggregate value that we need for the row query
@@ -1153,43 +1486,79 @@ class RowQuery(object):
         else:
             raise HXLException("Unrecognised aggregate: {}".format(value))
         self.needs_aggregate = False
+        self._compiled = None
 
     def match_row(self, row):
         """Check if a key-value pair appears in a HXL row"""
+        compiled = self._compiled
+        if compiled is None or compiled[0] is not row.columns:
+            return self.compile(row.columns)(row)
+        return compiled[1](row)
+
+    def compile(self, columns):
+        """Bind the query to a list of columns for fast repeated matching.
+
+        Resolves the matching column indices once, pre-normalises the
+        comparison value, precompiles regular expressions, and chooses
+        the comparison path (date, number, or string) that applies to
+        the value. Comparison results for repeated cell values are
+        remembered, so categorical columns need only one test per
+        distinct value. L{match_row} calls this method automatically
+        the first time it sees a new column list.
+
+        @param columns: the list of L{Column} objects for the rows to match
+        @returns: a function that takes a L{Row} and returns True if it matches
+        @exception HXLException: if the query needs an aggregate that hasn't been calculated
+        """
 
         # fail if we need an aggregate and haven't calculated it
-        if self.needs_aggregate and not self.aggregate_is_calculated:
-            raise HXLException("must call calc_aggregate before matching an 'is min' or 'is max' condition")
-
-        # initialise is this is the first time matching for the row query
-        if self._saved_indices is None or self.formula:
-
-            # if it's a row formula, evaluate first
-            if self.formula:
-                value = hxl.formulas.eval.eval(row, self.formula)
-            else:
-                value = self.value
-
-            if self.pattern.tag == '#date':
-                try:
-                    self.date_value = hxl.datatypes.normalise_date(value)
-                except ValueError:
-                    self.date_value = None
-
-            try:
-                self.number_value = hxl.datatypes.normalise_number(value)
-            except ValueError:
-                self.number_value = None
-
-            self.string_value = hxl.datatypes.normalise_string(value)
-
-        # try all the matching column values
-        indices = self._get_saved_indices(row.columns)
-        for i in indices:
-            if i < len(row.values) and self.match_value(row.values[i], self.op):
-                return True
-        return False
-
+        if self.needs_aggregate:
+            raise hxl.HXLException("must call calc_aggregate before matching an 'is min' or 'is max' condition")
+
+        indices = get_pattern_indices(self.pattern, columns)
+        is_date = (self.pattern.tag == '#date')
+        op = self.op
+
+        if self.formula:
+            # the comparison value depends on the row, so compare afresh each time
+            formula = hxl.formulas.eval.compile(self.formula).bind(columns)
+            def match(row):
+                compare = RowQuery._make_comparison(op, formula.eval(row), is_date)
+                values = row._values # read-only, so don't unshare
+                for i in indices:
+                    if i < len(values) and compare(values[i]):
+                        return True
+                return False
+            match_values = None
+        else:
+            (self.date_value, self.number_value, self.string_value,) = RowQuery._normalise_constant(self.value, is_date)
+            compare = RowQuery._memoise(RowQuery._make_comparison(op, self.value, is_date))
+            def match_values(values):
+                for i in indices:
+                    if i < len(values) and compare(values[i]):
+                        return True
+                return False
+            def match(row):
+                return match_values(row._values) # read-only, so don't unshare
+
+        self._compiled = (columns, match, match_values,)
+        return match
+
+    def compile_values(self, columns):
+        """Bind the query to a list of columns for matching raw lists of values.
+        This works like L{compile}, but the function returned takes a
+        list of values rather than a L{Row}, so that a data source can
+        test its raw data before it creates any row objects.
+        @param columns: the list of L{Column} objects for the values to match
+        @returns: a function that takes a list of values and returns True if it matches, or None if
+        the query needs a full row (a formula)
+        @exception HXLException: if the query needs an aggregate that hasn't been calculated
+        """
+        compiled = self._compiled
+        if compiled is None or compiled[0] is not columns:
+            self.compile(columns)
+            compiled = self._compiled
+        return compiled[2]
 
     def match_value(self, value, op):
         """Try matching as dates, then as numbers, then as simple strings"""
@@ -1209,12 +1578,94 @@ class RowQuery(object):
 
     def _get_saved_indices(self, columns):
         """Cache the column tests, so that we run them only once."""
-        # FIXME - assuming that the columns never change
-        self._saved_indices = []
-        for i in range(len(columns)):
-            if self.pattern.match(columns[i]):
-                self._saved_indices.append(i)
-        return self._saved_indices
+        return get_pattern_indices(self.pattern, columns)
+
+    @staticmethod
+    def _normalise_constant(value, is_date):
+        """Normalise a comparison value for each of the comparison paths.
+        @param value: the raw comparison value
+        @param is_date: if True, try to normalise the value as a date
+        @returns: a tuple of the date value (or None), number value (or None), and string value
+        """
+        date_value = None
+        if is_date:
+            try:
+                date_value = hxl.datatypes.normalise_date(value)
+            except ValueError:
+                pass
+        try:
+            number_value = hxl.datatypes.normalise_number(value)
+        except ValueError:
+            number_value = None
+        return (date_value, number_value, hxl.datatypes.normalise_string(value),)
+
+    @staticmethod
+    def _make_comparison(op, value, is_date):
+        """Make a single-value comparison function for a constant.
+
+        Tries matching as dates, then as numbers, then as simple
+        strings (the same order as L{match_value}), but skips any path
+        that can't apply to the comparison value.
+
+        @param op: the operator function
+        @param value: the raw comparison value
+        @param is_date: if True, try comparing as dates first
+        @returns: a function that takes a cell value and returns a true or false value
+        """
+        date_value, number_value, string_value = RowQuery._normalise_constant(value, is_date)
+        normalise_date = hxl.datatypes.normalise_date
+        normalise_number = hxl.datatypes.normalise_number
+        normalise_string = hxl.datatypes.normalise_string
+
+        if op is RowQuery.operator_re or op is RowQuery.operator_nre:
+            # precompile the patterns; a number can never be a pattern, so skip that path
+            is_negated = op is RowQuery.operator_nre
+            string_regex = re.compile(string_value)
+            date_regex = re.compile(date_value) if date_value is not None else None
+            def compare(s):
+                if date_regex is not None:
+                    try:
+                        return (date_regex.search(normalise_date(s)) is None) == is_negated
+                    except ValueError:
+                        pass
+                return (string_regex.search(normalise_string(s)) is None) == is_negated
+            return compare
+
+        if date_value is None and number_value is None:
+            # plain string comparison (including the "is" conditions)
+            return lambda s: op(normalise_string(s), string_value)
+
+        def compare(s):
+            if date_value is not None:
+                try:
+                    return op(normalise_date(s), date_value)
+                except ValueError:
+                    pass
+            if number_value is not None:
+                try:
+                    return op(normalise_number(s), number_value)
+                except:
+                    pass
+            return op(normalise_string(s), string_value)
+        return compare
+
+    @staticmethod
+    def _memoise(compare):
+        """Remember the results of a comparison function for string values.
+        @param compare: the single-value comparison function
+        @returns: an equivalent function that returns True or False
+        """
+        memo = {}
+        def memoised(s):
+            if type(s) is not str:
+                return bool(compare(s))
+            result = memo.get(s)
+            if result is None:
+                if len(memo) >= QUERY_MEMO_SIZE:
+                    memo.clear()
+                result = memo[s] = bool(compare(s))
+            return result
+        return memoised
 
     @staticmethod
     def parse(query):
@@ -1303,6 +1754,76 @@ class RowQuery(object):
 
 # Static functions
 
+COLUMN_INDEX_CACHE_SIZE = 256
+"""Maximum number of column-index resolutions to keep in the shared cache"""
+
+_column_index_cache = collections.OrderedDict()
+"""Shared LRU cache of resolved indices, keyed on the identity of a column list and a pattern"""
+
+_column_index_cache_lock = threading.Lock()
+
+def _get_cached_indices(columns, key, resolve):
+    """Look up (or resolve and save) the indices for a key against a column list.
+
+    Every row in a dataset normally shares the same list of columns,
+    so we key the cache on the identity of the list. Each entry also
+    keeps a snapshot of the columns it was resolved against, and is
+    used only while the list still compares equal to the snapshot
+    (a fast identity check per column when nothing has changed), so
+    a column replaced or added in place, or a new list that happens
+    to reuse the id, gets a fresh resolution. The entries don't
+    reference the list itself, and only the
+    L{COLUMN_INDEX_CACHE_SIZE} most-recently used are kept.
+
+    @param columns: the list of L{Column} objects
+    @param key: a hashable key for the pattern(s) being resolved
+    @param resolve: a function to call on a cache miss, returning a tuple of indices
+    @returns: a tuple of 0-based indices
+    """
+    cache_key = (id(columns), key,)
+    with _column_index_cache_lock:
+        entry = _column_index_cache.get(cache_key)
+        if entry is not None and entry[0] == columns:
+            _column_index_cache.move_to_end(cache_key)
+            return entry[1]
+    indices = resolve()
+    with _column_index_cache_lock:
+        _column_index_cache[cache_key] = (list(columns), indices,)
+        _column_index_cache.move_to_end(cache_key)
+        while len(_column_index_cache) > COLUMN_INDEX_CACHE_SIZE:
+            _column_index_cache.popitem(last=False)
+    return indices
+
+def get_pattern_indices(pattern, columns):
+    """Get the indices of all columns matching a single tag pattern (cached).
+
+    The result is saved in a shared cache keyed on the column list
+    and the pattern (a L{TagPattern} object or a string spec), so
+    looking up the same pattern for every row of a dataset parses
+    and matches it only once.
+
+    @param pattern: a L{TagPattern} or a string version of one
+    @param columns: a list of L{Column} objects
+    @returns: a (possibly-empty) tuple of 0-based indices, in column order
+    """
+    def resolve():
+        tag_pattern = TagPattern.parse(pattern)
+        return tuple(i for i, column in enumerate(columns) if tag_pattern.match(column))
+    return _get_cached_indices(columns, pattern, resolve)
+
+def get_patterns_indices(tag_patterns, columns):
+    """Get the indices of columns matching a list of tag patterns (cached).
+    Same result as L{get_column_indices}, but saved in the shared cache.
+    @param tag_patterns: a list of tag patterns or a string version of the list
+    @param columns: a list of L{Column} objects
+    @returns: a (possibly-empty) tuple of 0-based indices
+    """
+    if isinstance(tag_patterns, list):
+        key = tuple(tag_patterns)
+    else:
+        key = tag_patterns
+    return _get_cached_indices(columns, ('list', key,), lambda: tuple(get_column_indices(tag_patterns, columns)))
+
 def get_column_indices(tag_patterns, columns):
     """Get a list of column indices that match the tag patterns provided
     @param tag_patterns: a list of tag patterns or a string version of the list
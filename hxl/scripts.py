@@ -71,6 +71,9 @@ EXIT_OK = 0
 EXIT_ERROR = 1
 EXIT_SYNTAX = 2
 
+IMPLODE_MEMORY_LIMIT = 100 * 1024**2
+""" Constant: default memory for hxlimplode to keep rows for a second pass, before using a temporary file """
+
 
 #
 # Console script entry points
@@ -134,7 +137,7 @@ usage: hxlappend [-h] [--encoding [string]] [--sheet [number]]
                  [--expand-merged] [--scan-ckan-resources]
                  [--log debug|info|warning|error|critical|none]
                  [-a file_or_url] [-l LIST] [-x]
-                 [-q <tagspec><op><value>]
+                 [-q <tagspec><op><value>] [--workers n]
                  [infile] [outfile]
 
 Concatenate two HXL datasets
@@ -173,6 +176,8 @@ options:
   -q <tagspec><op><value>, --query <tagspec><op><value>
                         From --append datasets, include only rows
                         matching at least one query.
+  --workers n           Maximum number of datasets to open at the same
+                        time (default: 4).
 ```
 
     """
@@ -260,6 +265,7 @@ usage: hxlcount [-h] [--encoding [string]] [--sheet [number]]
                 [--expand-merged] [--scan-ckan-resources]
                 [--log debug|info|warning|error|critical|none]
                 [-t tag,tag...] [-a statement] [-q <tagspec><op><value>]
+                [--memory-limit size] [--presorted]
                 [infile] [outfile]
 
 Generate aggregate counts for a HXL dataset, similar to a spreadsheet
@@ -295,6 +301,12 @@ options:
                         Aggregator statement
   -q <tagspec><op><value>, --query <tagspec><op><value>
                         Count only rows that match at least one query.
+  --memory-limit size   Approximate memory to use for counting (e.g. 500M
+                        or 2G); count larger numbers of groups using
+                        temporary files.
+  --presorted           Input is already sorted on the tags: stream the
+                        counts in input order, failing if the input is
+                        not sorted.
 ```
 
 """
@@ -358,6 +370,7 @@ usage: hxldedup [-h] [--encoding [string]] [--sheet [number]]
                 [--expand-merged] [--scan-ckan-resources]
                 [--log debug|info|warning|error|critical|none]
                 [-t tag,tag...] [-q <tagspec><op><value>]
+                [--memory-limit size]
                 [infile] [outfile]
 
 Remove duplicate rows from a HXL dataset.
@@ -392,6 +405,9 @@ options:
   -q <tagspec><op><value>, --query <tagspec><op><value>
                         Leave rows alone if they don't match at least one
                         query.
+  --memory-limit size   Approximate memory to use for remembering rows
+                        (e.g. 500M or 2G); use temporary files beyond
+                        that.
 ```
 
 """
@@ -482,7 +498,8 @@ usage: hxlmerge [-h] [--encoding [string]] [--sheet [number]]
                 [--expand-merged] [--scan-ckan-resources]
                 [--log debug|info|warning|error|critical|none] -m
                 filename -k tag,tag... -t tag,tag... [-r] [-O]
-                [-q <tagspec><op><value>]
+                [-q <tagspec><op><value>] [--index-dir dir]
+                [--index-key string]
                 [infile] [outfile]
 
 Merge columns from one HXL dataset into another (similar to SQL join).
@@ -524,6 +541,12 @@ options:
   -q <tagspec><op><value>, --query <tagspec><op><value>
                         Merged data only from rows that match at least
                         one query.
+  --index-dir dir       Directory for keeping persistent indices of merge
+                        datasets, for reuse by later runs (requires
+                        --index-key).
+  --index-key string    Used with --index-dir, a string (such as a version
+                        or checksum) that changes whenever the merge
+                        dataset does.
 ```
 
 """
@@ -696,7 +719,7 @@ usage: hxlexpand [-h] [--encoding [string]] [--sheet [number]]
                  [--remove-headers] [--strip-tags] [--ignore-certs]
                  [--expand-merged] [--scan-ckan-resources]
                  [--log debug|info|warning|error|critical|none]
-                 [-t [tag,tag...]] [-s string] [-c]
+                 [-t [tag,tag...]] [-s string] [-c] [--max-rows n]
                  [-q <tagspec><op><value>]
                  [infile] [outfile]
 
@@ -733,6 +756,8 @@ options:
                         string separating list items (defaults to "|")
   -c, --correlate       correlate list values instead of producing a
                         cartesian product
+  --max-rows n          maximum number of rows to generate from a single
+                        input row
   -q <tagspec><op><value>, --query <tagspec><op><value>
                         Limit list expansion to rows matching at least
                         one query.
@@ -799,7 +824,8 @@ usage: hxlimplode [-h] [--encoding [string]] [--sheet [number]]
                   [--remove-headers] [--strip-tags] [--ignore-certs]
                   [--expand-merged] [--scan-ckan-resources]
                   [--log debug|info|warning|error|critical|none] -L
-                  tagpattern -V tagpattern
+                  tagpattern -V tagpattern [--presorted]
+                  [--labels label,label...] [--memory-limit size]
                   [infile] [outfile]
 
 Implode a long dataset into a wide dataset.
@@ -832,6 +858,15 @@ options:
                         HXL tag pattern for the label column
   -V tagpattern, --value tagpattern
                         HXL tag pattern for the value column
+  --presorted           Input is already grouped by the other columns;
+                        stream the output
+  --labels label,label...
+                        Comma-separated list of labels for the wide
+                        columns, in order
+  --memory-limit size   Approximate memory to use for remembering rows
+                        with --presorted and no --labels (e.g. 500M or
+                        2G); use a temporary file beyond that (default:
+                        100M).
 ```
 
 """
@@ -894,7 +929,7 @@ usage: hxlsort [-h] [--encoding [string]] [--sheet [number]]
                [--remove-headers] [--strip-tags] [--ignore-certs]
                [--expand-merged] [--scan-ckan-resources]
                [--log debug|info|warning|error|critical|none]
-               [-t tag,tag...] [-r]
+               [-t tag,tag...] [-r] [--memory-limit size] [-n n]
                [infile] [outfile]
 
 Sort a HXL dataset.
@@ -927,6 +962,11 @@ options:
                         Comma-separated list of tags to for columns to
                         use as sort keys.
   -r, --reverse         Flag to reverse sort order.
+  --memory-limit size   Approximate memory to use for sorting (e.g. 500M
+                        or 2G); sort larger datasets using temporary
+                        files.
+  -n n, --top n         Output only the first n rows in sort order (uses
+                        memory only for those rows).
 ```
 
 """
@@ -940,7 +980,8 @@ usage: hxlspec [-h] [--encoding [string]] [--sheet [number]]
                [--selector [path]] [--http-header header]
                [--remove-headers] [--strip-tags] [--ignore-certs]
                [--expand-merged] [--scan-ckan-resources]
-               [--log debug|info|warning|error|critical|none]
+               [--log debug|info|warning|error|critical|none] -s
+               spec.json [--explain]
                [infile] [outfile]
 
 Process a HXL JSON spec
@@ -969,6 +1010,10 @@ options:
                         for one that's HXLated
   --log debug|info|warning|error|critical|none
                         Set minimum logging level
+  -s spec.json, --spec spec.json
+                        JSON processing specification
+  --explain             Print the optimised recipe instead of processing
+                        the data
 ```
 
 """
@@ -1157,24 +1202,30 @@ def hxlappend_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         default=False
     )
     add_queries_arg(parser, 'From --append datasets, include only rows matching at least one query.')
+    parser.add_argument(
+        '--workers',
+        help='Maximum number of datasets to open at the same time (default: 4).',
+        metavar='n',
+        type=int
+    )
 
     args = parser.parse_args(args)
 
     do_common_args(args)
 
-    append_sources = []
-    for append_source in args.append:
-        append_sources.append(hxl.data(append_source, make_input_options(args)))
+    # opened by the filter, possibly concurrently
+    append_sources = list(args.append)
     for list_source in args.list:
-        for append_source in hxl.filters.AppendFilter.parse_external_source_list(hxl.data(list_source, make_input_options(args))):
-            append_sources.append(hxl.data(append_source, make_input_options(args)))
+        append_sources += hxl.filters.AppendFilter.parse_external_source_list(hxl.data(list_source, make_input_options(args)))
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
         filter = hxl.filters.AppendFilter(
             source,
             append_sources=append_sources,
             add_columns=(not args.exclude_extra_columns),
-            queries=args.query
+            queries=args.query,
+            workers=args.workers,
+            input_options=make_input_options(args)
         )
         hxl.input.write_hxl(output.output, filter, show_headers=not args.remove_headers, show_tags=not args.strip_tags)
 
@@ -1298,20 +1349,36 @@ def hxlcount_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
     parser.add_argument(
         '-a',
         '--aggregator',
-        help='Aggregator statement. Aggregators are count(), sum(), average(), min(), max(), and concat() (e.g. "sum(#affected+f) as Total Girls In Need#affected+f+total")',
+        help='Aggregator statement. Aggregators are count(), sum(), average(), min(), max(), concat(), count_distinct(), median(), and stddev() (e.g. "sum(#affected+f) as Total Girls In Need#affected+f+total")',
         metavar='statement',
         action='append',
         type=hxl.filters.Aggregator.parse,
         default=[]
         )
     add_queries_arg(parser, 'Count only rows that match at least one query.')
+    parser.add_argument(
+        '--memory-limit',
+        help='Approximate memory to use for counting (e.g. 500M or 2G); count larger numbers of groups using temporary files.',
+        metavar='size',
+        type=parse_size
+        )
+    parser.add_argument(
+        '--presorted',
+        help='Input is already sorted on the tags: stream the counts in input order, failing if the input is not sorted.',
+        action='store_const',
+        const=True,
+        default=False
+        )
 
     args = parser.parse_args(args)
 
     do_common_args(args)
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
-        filter = hxl.filters.CountFilter(source, patterns=args.tags, aggregators=args.aggregator, queries=args.query)
+        filter = hxl.filters.CountFilter(
+            source, patterns=args.tags, aggregators=args.aggregator, queries=args.query, memory_limit=args.memory_limit,
+            presorted=args.presorted, check_sorted=args.presorted
+        )
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
     return EXIT_OK
@@ -1371,13 +1438,19 @@ def hxldedup_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         type=hxl.model.TagPattern.parse_list
         )
     add_queries_arg(parser, 'Leave rows alone if they don\'t match at least one query.')
+    parser.add_argument(
+        '--memory-limit',
+        help='Approximate memory to use for remembering rows (e.g. 500M or 2G); use temporary files beyond that.',
+        metavar='size',
+        type=parse_size
+        )
 
     args = parser.parse_args(args)
 
     do_common_args(args)
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
-        filter = hxl.filters.DeduplicationFilter(source, args.tags, args.query)
+        filter = hxl.filters.DeduplicationFilter(source, args.tags, args.query, memory_limit=args.memory_limit)
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
     return EXIT_OK
@@ -1492,6 +1565,16 @@ def hxlmerge_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         default=False
     )
     add_queries_arg(parser, 'Merged data only from rows that match at least one query.')
+    parser.add_argument(
+        '--index-dir',
+        help='Directory for keeping persistent indices of merge datasets, for reuse by later runs (requires --index-key).',
+        metavar='dir'
+    )
+    parser.add_argument(
+        '--index-key',
+        help='Used with --index-dir, a string (such as a version or checksum) that changes whenever the merge dataset does.',
+        metavar='string'
+    )
 
     args = parser.parse_args(args)
 
@@ -1501,7 +1584,7 @@ def hxlmerge_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         filter = hxl.filters.MergeDataFilter(
             source, merge_source=merge_source,
             keys=args.keys, tags=args.tags, replace=args.replace, overwrite=args.overwrite,
-            queries=args.query
+            queries=args.query, index_dir=args.index_dir, index_key=args.index_key
         )
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
@@ -1688,6 +1771,13 @@ def hxlexpand_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         default=False
         )
 
+    parser.add_argument(
+        '--max-rows',
+        help='maximum number of rows to generate from a single input row',
+        metavar='n',
+        type=int
+        )
+
     add_queries_arg(parser, 'Limit list expansion to rows matching at least one query.')
 
     args = parser.parse_args(args)
@@ -1695,7 +1785,7 @@ def hxlexpand_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
     do_common_args(args)
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
-        filter = hxl.filters.ExpandListsFilter(source, patterns=args.tags, separator=args.separator, correlate=args.correlate, queries=args.query)
+        filter = hxl.filters.ExpandListsFilter(source, patterns=args.tags, separator=args.separator, correlate=args.correlate, queries=args.query, max_rows=args.max_rows)
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
     return EXIT_OK
@@ -1774,12 +1864,45 @@ def hxlimplode_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         type=hxl.model.TagPattern.parse,
         )
 
+    parser.add_argument(
+        '--presorted',
+        help='Input is already grouped by the other columns; stream the output',
+        action='store_const',
+        const=True,
+        default=False
+        )
+
+    parser.add_argument(
+        '--labels',
+        help='Comma-separated list of labels for the wide columns, in order',
+        metavar='label,label...',
+        type=lambda s: [label.strip() for label in s.split(',')]
+        )
+
+    parser.add_argument(
+        '--memory-limit',
+        help='Approximate memory to use for remembering rows with --presorted and no --labels (e.g. 500M or 2G); use a temporary file beyond that (default: 100M).',
+        metavar='size',
+        type=parse_size,
+        default=IMPLODE_MEMORY_LIMIT
+        )
+
     args = parser.parse_args(args)
 
     do_common_args(args)
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
-        filter = hxl.filters.ImplodeFilter(source, label_pattern=args.label, value_pattern=args.value)
+        if args.presorted and args.labels is None:
+            # need a repeatable source for the first pass over the labels;
+            # standard input can't be reopened, so spill to disk past the limit
+            source = source.cache(max_memory=args.memory_limit)
+        filter = hxl.filters.ImplodeFilter(
+            source,
+            label_pattern=args.label,
+            value_pattern=args.value,
+            presorted=args.presorted,
+            labels=args.labels
+        )
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
     return EXIT_OK
@@ -1854,12 +1977,28 @@ def hxlsort_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         const=True,
         default=False
         )
+    parser.add_argument(
+        '--memory-limit',
+        help='Approximate memory to use for sorting (e.g. 500M or 2G); sort larger datasets using temporary files.',
+        metavar='size',
+        type=parse_size
+        )
+    parser.add_argument(
+        '-n',
+        '--top',
+        help='Output only the first n rows in sort order (uses memory only for those rows).',
+        metavar='n',
+        type=int
+        )
     args = parser.parse_args(args)
 
     do_common_args(args)
 
     with make_source(args, stdin) as source, make_output(args, stdout) as output:
-        filter = hxl.filters.SortFilter(source, args.tags, args.reverse)
+        if args.top is not None:
+            filter = hxl.filters.TopFilter(source, args.top, args.tags, args.reverse)
+        else:
+            filter = hxl.filters.SortFilter(source, args.tags, args.reverse, memory_limit=args.memory_limit)
         hxl.input.write_hxl(output.output, filter, show_tags=not args.strip_tags)
 
     return EXIT_OK
@@ -1901,11 +2040,22 @@ def hxlspec_main(args, stdin=STDIN, stdout=sys.stdout, stderr=sys.stderr):
         metavar="spec.json",
         type=get_json,
     )
+    parser.add_argument(
+        '--explain',
+        help="Print the optimised recipe instead of processing the data",
+        action='store_const',
+        const=True,
+        default=False
+    )
 
     args = parser.parse_args(args)
 
     do_common_args(args)
 
+    if args.explain:
+        stdout.write(hxl.filters.explain_recipe(args.spec.get('recipe', [])))
+        return EXIT_OK
+
     with make_input(args, stdin) as input, make_output(args, stdout) as output:
         source = hxl.input.from_spec(args.spec, input=input, allow_local_ok=True)
         hxl.input.write_hxl(output, source, show_tags=not args.strip_tags)
@@ -2243,6 +2393,22 @@ def make_headers (args):
     return http_headers
 
 
+def parse_size(s):
+    """Parse a memory size like "500M" or "2G" (or a plain number of bytes) from the command line."""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    s = s.strip().upper()
+    if s.endswith('B'):
+        s = s[:-1]
+    multiplier = 1
+    if s and s[-1] in units:
+        multiplier = units[s[-1]]
+        s = s[:-1]
+    try:
+        return int(float(s) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Bad size: {}'.format(s))
+
+
 
 class FileOutput(object):
 
@@ -9,7 +9,7 @@ License: Public Domain
 
 import unittest
 
-import datetime, hxl
+import datetime, hxl, os, tempfile
 
 # Mock URL access so that tests work offline
 from . import URL_MOCK_TARGET, URL_MOCK_OBJECT
@@ -235,6 +235,79 @@ class TestRecipe(AbstractBaseFilterTest):
         self.assertEqual(type(filtered).__name__, 'RowFilter')
 
 
+class TestOptimiseRecipe(AbstractBaseFilterTest):
+
+    def assertOptimised(self, recipe, expected):
+        self.assertEqual(expected, hxl.filters.optimise_recipe(recipe))
+        # the result must be the same either way
+        self.assertEqual(
+            hxl.filters.from_recipe(hxl.data(DATA), recipe, optimise=False).values,
+            hxl.filters.from_recipe(hxl.data(DATA), recipe).values
+        )
+
+    def test_fuse_without_rows(self):
+        self.assertOptimised(
+            [{'filter': 'without_rows', 'queries': 'org=NGO A'}, {'filter': 'without_rows', 'queries': ['adm1=Coast']}],
+            [{'filter': 'without_rows', 'queries': ['org=NGO A', 'adm1=Coast']}]
+        )
+
+    def test_fuse_without_columns(self):
+        self.assertOptimised(
+            [{'filter': 'without_columns', 'excludes': '#org,#adm1'}, {'filter': 'without_columns', 'excludes': '#sector'}],
+            [{'filter': 'without_columns', 'excludes': ['#org', '#adm1', '#sector']}]
+        )
+
+    def test_drop_redundant(self):
+        spec = {'filter': 'with_rows', 'queries': 'org=NGO A'}
+        self.assertOptimised([spec, spec], [spec])
+        spec = {'filter': 'with_columns', 'includes': '#org,#affected'}
+        self.assertOptimised([spec, {'filter': 'without_columns', 'excludes': '#adm1'}], [spec])
+        # an empty with_columns keeps every column
+        spec = {'filter': 'with_columns', 'includes': ''}
+        without = {'filter': 'without_columns', 'excludes': '#org'}
+        self.assertOptimised([spec, without], [spec, without])
+
+    def test_push_rows_ahead(self):
+        sort = {'filter': 'sort', 'tags': '#affected'}
+        clean = {'filter': 'clean_data', 'upper': '#org'}
+        rows = {'filter': 'with_rows', 'queries': 'adm1=coast'}
+        self.assertOptimised([clean, sort, rows], [rows, clean, sort])
+        # not past a step that changes the columns being tested
+        rows = {'filter': 'with_rows', 'queries': 'org=NGO A'}
+        self.assertOptimised([clean, rows], [clean, rows])
+        # not with aggregate queries
+        rows = {'filter': 'with_rows', 'queries': 'affected is max'}
+        self.assertOptimised([clean, rows], [clean, rows])
+
+    def test_push_columns_ahead(self):
+        replace = {'filter': 'replace_data', 'original': 'NGO A', 'replacement': 'NGO Alpha', 'pattern': '#org'}
+        columns = {'filter': 'with_columns', 'includes': '#org'}
+        self.assertOptimised([replace, columns], [columns, replace])
+        replace['queries'] = 'adm1=Coast'
+        self.assertOptimised([replace, columns], [replace, columns])
+
+    def test_drop_sort_before_count(self):
+        sort = {'filter': 'sort', 'tags': '#affected'}
+        count = {'filter': 'count', 'patterns': '#adm1'}
+        self.assertOptimised([sort, count], [count])
+        count['aggregators'] = 'min(#affected) as Minimum#affected+min'
+        self.assertOptimised([sort, count], [sort, count])
+        # a presorted count needs the sort
+        count = {'filter': 'count', 'patterns': '#org', 'presorted': True}
+        self.assertOptimised([sort, count], [sort, count])
+        sort = {'filter': 'sort', 'tags': '#org'}
+        self.assertOptimised([sort, count], [sort, count])
+        self.assertEqual(
+            [['NGO A', 2], ['NGO B', 2]],
+            hxl.filters.from_recipe(hxl.data(DATA), [sort, count]).values
+        )
+
+    def test_explain(self):
+        text = hxl.filters.explain_recipe([{'filter': 'sort'}, {'filter': 'count', 'patterns': '#org'}])
+        self.assertTrue(text.startswith('1. {"filter": "count", "patterns": "#org"}\n'))
+        self.assertTrue('Dropped sort before count' in text)
+
+
 #
 # Test classes
 #
@@ -349,11 +422,79 @@ class TestAppendFilter(AbstractBaseFilterTest):
         filtered = self.source.append_external_list('http://example.org/append-source-list.csv')
         self.assertEqual(EXPECTED_VALUES, filtered.values)
 
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_workers(self):
+        # concurrent opening must not change the order of the output
+        urls = ['http://example.org/append-source-1.csv', 'http://example.org/append-source-2.csv'] * 3
+        serial = self.source.append(urls, workers=1)
+        concurrent = self.source.append(urls, workers=4)
+        self.assertEqual(serial.headers, concurrent.headers)
+        values = serial.values
+        self.assertEqual(16, len(values))
+        self.assertEqual(values, concurrent.values)
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_workers_error(self):
+        # a bad source raises in the constructor, as it would without threads
+        urls = ['http://example.org/append-source-1.csv', 'http://example.org/no-such-source.csv']
+        urls += ['http://example.org/append-source-2.csv'] * 20
+        for workers in (1, 4):
+            with self.assertRaises(IOError):
+                self.source.append(urls, workers=workers)
+
+    def test_workers_mixed(self):
+        # datasets and filenames together, in their original order
+        with tempfile.TemporaryDirectory() as dir:
+            filename = os.path.join(dir, 'append.csv')
+            with open(filename, 'w') as output:
+                output.writelines(hxl.data(self.APPEND_DATA).gen_csv())
+            filtered = hxl.filters.AppendFilter(
+                self.source,
+                [filename, self.append_source],
+                workers=2,
+                input_options=hxl.InputOptions(allow_local=True)
+            )
+            self.assertEqual(self.COMBINED_DATA[2:] + self.COMBINED_DATA[6:], filtered.values)
+
     def test_queries(self):
         #self.assertEqual(self.COMBINED_DATA_FILTERED[2:], self.source.append(self.append_source, queries='').values)
         pass # need a new query
 
         
+class TestBatchIteration(AbstractBaseFilterTest):
+
+    def assertBatches(self, make_filter, size=2):
+        # compare with ordinary iteration over an identical filter
+        expected = [[row.values, row.row_number] for row in make_filter(hxl.data(DATA))]
+        batches = list(make_filter(hxl.data(DATA)).iter_batches(size))
+        for batch in batches:
+            self.assertTrue(0 < len(batch) <= size)
+        self.assertEqual(expected, [[row.values, row.row_number] for batch in batches for row in batch])
+
+    def test_source(self):
+        self.assertBatches(lambda source: source)
+        self.assertEqual([4], [len(batch) for batch in hxl.data(DATA).iter_batches()])
+
+    def test_row_filter(self):
+        self.assertBatches(lambda source: source.with_rows('org=NGO B'), size=1)
+        self.assertBatches(lambda source: source.without_rows('org=NGO B', mask='adm1=Coast'))
+
+    def test_column_filter(self):
+        self.assertBatches(lambda source: source.with_columns(['#org', '#affected']))
+        self.assertBatches(lambda source: source.with_columns('#adm1'))
+        self.assertBatches(lambda source: source.with_columns('#nothing'))
+
+    def test_replace_data_filter(self):
+        self.assertBatches(lambda source: source.replace_data('ngo a', 'NGO Alpha', '#org'))
+        self.assertBatches(lambda source: source.replace_data('NGO ([AB])', r'NGO \1\1', use_regex=True, queries='adm1=Coast'))
+
+    def test_clean_data_filter(self):
+        self.assertBatches(lambda source: source.clean_data(upper='#org', queries='#sector=Education'))
+
+    def test_default(self):
+        self.assertBatches(lambda source: source.add_columns('#meta+x=x').with_rows('#org=NGO A').dedup('#sector'))
+
+
 class TestCacheFilter(AbstractBaseFilterTest):
 
     def test_headers(self):
@@ -373,6 +514,15 @@ class TestCacheFilter(AbstractBaseFilterTest):
         self.assertEqual(4, len(rows1))
         self.assertEqual(rows1, rows2)
 
+    def test_shared_values(self):
+        # rows passed through unchanged must not let changes leak back into the cache
+        source = hxl.data(DATA).cache()
+        for row in source.with_rows('org=NGO A').without_columns(['#affected']).with_rows('#adm1=Coast'):
+            row.values[0] = 'Changed'
+        for row in source.with_rows('org=NGO A'):
+            row.values[0] = 'Changed'
+        self.assertEqual(DATA[2:], source.values)
+
     def test_repeat_sub(self):
         # Test repeating a cache filter backing another filter
         source = hxl.data(DATA).cache().with_rows('org=NGO A')
@@ -381,6 +531,80 @@ class TestCacheFilter(AbstractBaseFilterTest):
         self.assertEqual(2, len(rows1))
         self.assertEqual(rows1, rows2)
 
+    def test_max_memory(self):
+        # rows beyond the limit are saved to disk and replayed from there
+        expected = [(row.values, row.row_number, row.source_row_number) for row in hxl.data(DATA).cache()]
+        for max_memory in (1, 500, 10**9):
+            source = hxl.data(DATA).cache(max_memory=max_memory)
+            self.assertTrue(source.is_cached)
+            for i in range(2):
+                self.assertEqual(expected, [(row.values, row.row_number, row.source_row_number) for row in source])
+
+    def test_max_memory_filtered(self):
+        # original row numbers are preserved
+        def numbers(source):
+            return [(row.row_number, row.source_row_number) for row in source]
+        expected = numbers(hxl.data(DATA).with_rows('org=NGO B'))
+        source = hxl.data(DATA).with_rows('org=NGO B').cache(max_memory=1)
+        self.assertEqual(expected, numbers(source))
+        self.assertEqual(expected, numbers(source))
+
+    def test_max_memory_max_rows(self):
+        source = hxl.filters.CacheFilter(hxl.data(DATA), max_rows=3, max_memory=1)
+        self.assertEqual(DATA[2:5], source.values)
+        self.assertTrue(source.overflow)
+        self.assertEqual(DATA[2:5], source.values)
+
+
+class TestColumnarCacheFilter(AbstractBaseFilterTest):
+
+    def test_rows(self):
+        source = self.source.cache(columnar=True)
+        self.assertTrue(source.is_columnar)
+        self.assertEqual(DATA[0], source.headers)
+        self.assertEqual(DATA[1], source.display_tags)
+        self.assertEqual(DATA[2:], source.values)
+        # repeatable
+        self.assertEqual(DATA[2:], source.values)
+
+    def test_row_numbers(self):
+        expected = [(row.row_number, row.source_row_number) for row in hxl.data(DATA).with_rows('org=NGO B')]
+        source = hxl.data(DATA).with_rows('org=NGO B').cache(columnar=True)
+        self.assertEqual(expected, [(row.row_number, row.source_row_number) for row in source])
+
+    def test_short_rows(self):
+        data = [['#org', '#adm1', '#affected'], ['NGO A', 'Coast'], ['NGO B', 'Plains', '100', 'extra']]
+        source = hxl.data(data).cache(columnar=True)
+        self.assertEqual(data[1:], source.values)
+        self.assertEqual([['Coast', 1], ['Plains', 1]], source.count('#adm1').values)
+        self.assertEqual('100', source.max('#affected'))
+        self.assertEqual({'NGO A', 'NGO B', 'Coast', 'Plains', '100', 'extra'}, source.get_value_set())
+
+    def test_interned(self):
+        source = hxl.data(DATA).cache(columnar=True)
+        values = source.get_column_values(0)
+        self.assertIs(values[0], values[3])
+
+    def test_typed_columns(self):
+        source = hxl.data(DATA).cache(columnar=True)
+        self.assertEqual([200, 100, 300, 150], source.get_column_numbers(3))
+        self.assertEqual([None, None, None, None], source.get_column_numbers(0))
+
+    def test_aggregates(self):
+        cached = self.source.cache(columnar=True)
+        self.assertEqual(self.source.min('#affected'), cached.min('#affected'))
+        self.assertEqual(self.source.max('#affected'), cached.max('#affected'))
+        self.assertEqual(self.source.get_value_set('#adm1'), cached.get_value_set('#adm1'))
+        self.assertEqual(self.source.sort(['#adm1', '#affected'], reverse=True).values, cached.sort(['#adm1', '#affected'], reverse=True).values)
+        self.assertEqual(self.source.count('#org').values, cached.count('#org').values)
+        self.assertEqual(self.source.count('#adm1', 'sum(#affected) as Total#affected').values, cached.count('#adm1', 'sum(#affected) as Total#affected').values)
+        self.assertEqual(self.source.count('#org', queries='adm1=Coast').values, cached.count('#org', queries='adm1=Coast').values)
+
+    def test_recipe(self):
+        source = hxl.data(DATA).recipe([{'filter': 'cache', 'columnar': True}])
+        self.assertTrue(source.is_columnar)
+        self.assertEqual(DATA[2:], source.values)
+
 
 class TestCleanDataFilter(AbstractBaseFilterTest):
 
@@ -590,6 +814,28 @@ class TestCleanDataFilter(AbstractBaseFilterTest):
         ]
         self.assertEqual(DATA_OUT, self.source.clean_data(lower='sector', queries='adm1=Plains').values)
 
+    def test_untouched_columns(self):
+        # columns without any cleaning keep their original values (not converted to strings)
+        DATA_IN = [
+            ['#org', '#affected', '#date'],
+            ['  NGO A ', 200, None],
+        ]
+        self.assertEqual([['NGO A', 200, None]], hxl.data(DATA_IN).clean_data(whitespace='org').values)
+        self.assertEqual(DATA_IN[1:], hxl.data(DATA_IN).clean_data(upper='sector').values)
+
+    def test_repeated_dates(self):
+        # dates are normalised once and remembered, including failures
+        DATA_IN = [
+            ['#date', '#adm1'],
+            ['1/Mar/2017', 'Coast'],
+            ['bad', 'Plains'],
+            ['1/Mar/2017', 'Plains'],
+            ['bad', 'Coast'],
+        ]
+        source = hxl.data(DATA_IN).clean_data(date='date', purge=True)
+        self.assertEqual(['2017-03-01', '', '2017-03-01', ''], [values[0] for values in source.values])
+        self.assertEqual({'1/Mar/2017': '2017-03-01', 'bad': ''}, source._date_cache)
+
 
 class TestColumnFilter(AbstractBaseFilterTest):
 
@@ -726,6 +972,117 @@ class TestCountFilter(AbstractBaseFilterTest):
         self.assertEqual(expected[1], filtered.display_tags)
         self.assertEqual(expected[2:], filtered.values)
 
+    def test_count_distinct_aggregator(self):
+        filtered = self.source.count('org', 'count_distinct(#adm1) as Districts#adm1+count')
+        self.assertEqual([['NGO A', 2], ['NGO B', 2]], filtered.values)
+        filtered = self.source.count('adm1', 'count_distinct(#org) as Orgs#org+count')
+        self.assertEqual([['Coast', 2], ['Plains', 2]], filtered.values)
+
+    def test_median_aggregator(self):
+        filtered = self.source.count('org', 'median(#affected) as Median#affected+median')
+        self.assertEqual([['NGO A', 175], ['NGO B', 200]], filtered.values)
+        filtered = self.source.count(aggregators='median(#affected) as Median#affected+median')
+        self.assertEqual([[175]], filtered.values)
+
+    def test_stddev_aggregator(self):
+        filtered = self.source.count('org', 'stddev(#affected) as Std dev#affected+stddev')
+        self.assertEqual([['NGO A', 25], ['NGO B', 100]], filtered.values)
+
+    def test_merge_states(self):
+        # merging the states from two halves gives the same result as one pass
+        rows = list(self.source)
+        for type in hxl.filters.Aggregator.STATE_CLASSES:
+            aggregator = hxl.filters.Aggregator.parse('{}(#affected)'.format(type))
+            expected = aggregator.make_state()
+            for row in rows:
+                aggregator.update(expected, row)
+            for split in range(len(rows) + 1):
+                first = aggregator.make_state()
+                second = aggregator.make_state()
+                for row in rows[:split]:
+                    aggregator.update(first, row)
+                for row in rows[split:]:
+                    aggregator.update(second, row)
+                first.merge(second)
+                self.assertAlmostEqual(expected.finalise(), first.finalise())
+
+    def test_deprecated_evaluate_row(self):
+        # the pre-state API still works, with a warning
+        aggregator = hxl.filters.Aggregator.parse('sum(#affected)')
+        with self.assertWarns(DeprecationWarning):
+            self.assertIsNone(aggregator.value)
+        for row in self.source:
+            with self.assertWarns(DeprecationWarning):
+                aggregator.evaluate_row(row)
+        state = aggregator.make_state()
+        for row in self.source:
+            aggregator.update(state, row)
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(state.finalise(), aggregator.value)
+
+    def test_spill(self):
+        # saving partial results to temporary files gives the same result
+        aggregators = [
+            'count() as Count#meta+count',
+            'sum(#affected) as Total#affected+total',
+            'average(#affected) as Average#affected+average',
+            'min(#affected) as Min#affected+min',
+            'max(#affected) as Max#affected+max',
+            'concat(#org) as Orgs#org+list',
+            'count_distinct(#org) as Orgs#org+count',
+            'median(#affected) as Median#affected+median',
+            'stddev(#affected) as Std dev#affected+stddev',
+        ]
+        for patterns in (['#adm1'], ['#adm1', '#org'], ['#sector']):
+            expected = self.source.count(patterns, aggregators).values
+            for max_groups in (1, 2):
+                filter = hxl.filters.CountFilter(self.source, patterns, aggregators, max_groups=max_groups)
+                self.assertEqual(expected, filter.values)
+                self.assertEqual(expected, filter.values) # replay from saved runs
+            self.assertEqual(expected, self.source.count(patterns, aggregators, memory_limit=1).values)
+            self.assertEqual(expected, self.source.count(patterns, aggregators, memory_limit=10**9).values)
+
+    def test_spill_fan_in(self):
+        # more runs than can be merged at once
+        DATA_IN = [['#org', '#affected']] + [['Org {}'.format(i % 150), str(i)] for i in range(600)]
+        source = hxl.data(DATA_IN).cache()
+        aggregators = ['count() as Count#meta+count', 'sum(#affected) as Total#affected+total']
+        expected = source.count('#org', aggregators).values
+        filter = hxl.filters.CountFilter(source, '#org', aggregators, max_groups=1)
+        self.assertEqual(expected, filter.values)
+        self.assertTrue(len(filter._run_files) <= filter.MERGE_FAN_IN)
+        self.assertEqual(expected, source.count('#org', aggregators, memory_limit=1).values)
+
+    def test_presorted(self):
+        aggregators = ['count() as Count#meta+count', 'sum(#affected) as Total#affected+total']
+        for patterns in (['#adm1'], ['#org', '#adm1']):
+            expected = self.source.count(patterns, aggregators).values
+            sorted_source = self.source.sort(patterns)
+            self.assertEqual(expected, sorted_source.count(patterns, aggregators, presorted=True, check_sorted=True).values)
+            self.assertEqual(
+                list(reversed(expected)),
+                self.source.sort(patterns, reverse=True).count(patterns, aggregators, presorted=True, check_sorted=True).values
+            )
+
+    def test_presorted_numeric(self):
+        # sorted numerically, the way SortFilter sorts
+        DATA_IN = [['#affected'], ['9'], ['9'], ['10']]
+        self.assertEqual(
+            [['9', 2], ['10', 1]],
+            hxl.data(DATA_IN).count('#affected', presorted=True, check_sorted=True).values
+        )
+
+    def test_presorted_not_sorted(self):
+        # without the check, groups come out as they appear
+        self.assertEqual(
+            [['NGO A', 1], ['NGO B', 2], ['NGO A', 1]],
+            self.source.count('#org', presorted=True).values
+        )
+        with self.assertRaises(hxl.filters.HXLFilterException):
+            self.source.count('#org', presorted=True, check_sorted=True).values
+        with self.assertRaises(hxl.filters.HXLFilterException):
+            self.source.count('#adm1', presorted=True, check_sorted=True).values
+
     def test_aggregator_dates(self):
         DATA_IN = [
             ['#event', '#date'],
@@ -830,6 +1187,26 @@ class TestDeduplicationFilter (AbstractBaseFilterTest):
     def test_queries(self):
         self.assertEqual(self.DATA_OUT_FILTERED[2:], self.source.dedup(queries='sector=Education').values)
 
+    def test_patterns(self):
+        self.assertEqual([DATA[2], DATA[3]], self.source.dedup('#org').values)
+        self.assertEqual([DATA[2], DATA[3], DATA[5]], hxl.data(self.DATA_IN).dedup(['#org', '#sector']).values)
+
+    def test_digests(self):
+        filter = self.source.dedup()
+        filter.values
+        self.assertEqual(4, len(filter.seen_map))
+        for digest in filter.seen_map:
+            self.assertEqual(hxl.filters.DeduplicationFilter.DIGEST_SIZE, len(digest))
+
+    def test_memory_limit(self):
+        # moving digests to disk gives the same result
+        for memory_limit in (1, 250):
+            self.assertEqual(self.DATA_OUT[2:], hxl.data(self.DATA_IN).dedup(memory_limit=memory_limit).values)
+            self.assertEqual(
+                self.DATA_OUT_FILTERED[2:],
+                hxl.data(self.DATA_IN).dedup(queries='sector=Education', memory_limit=memory_limit).values
+            )
+
 
 class TestMergeDataFilter(AbstractBaseFilterTest):
 
@@ -885,6 +1262,41 @@ class TestMergeDataFilter(AbstractBaseFilterTest):
     def test_values(self):
         self.assertEqual(self.MERGE_OUT[2:], self.merged.values)
 
+    def test_index_key(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            merged = self.source.merge_data(hxl.data(self.MERGE_IN), '#adm1-code', '#adm1+code', index_dir=index_dir, index_key='v1')
+            self.assertEqual(self.MERGE_OUT[2:], merged.values)
+            self.assertEqual(1, len(os.listdir(index_dir)))
+            # the same key reuses the index without reading the rows
+            merged = self.source.merge_data(hxl.data(self.MERGE_IN[:2]), '#adm1-code', '#adm1+code', index_dir=index_dir, index_key='v1')
+            self.assertEqual(self.MERGE_OUT[2:], merged.values)
+            merged = self.source.merge_data(hxl.data(self.MERGE_IN[:2]), '#adm1-code', '#adm1+code', index_dir=index_dir, index_key='v2')
+            self.assertEqual(['', '', '', ''], [values[4] for values in merged.values])
+            self.assertEqual(2, len(os.listdir(index_dir)))
+
+    def test_index_requires_key(self):
+        with self.assertRaises(hxl.filters.HXLFilterException):
+            self.source.merge_data(hxl.data(self.MERGE_IN), '#adm1-code', '#adm1+code', index_dir='/tmp')
+
+    def test_index_closed(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            merged = self.source.merge_data(hxl.data(self.MERGE_IN).cache(), '#adm1-code', '#adm1+code', index_dir=index_dir, index_key='v1')
+            for i in range(2):
+                self.assertEqual(self.MERGE_OUT[2:], merged.values)
+                self.assertIsNone(merged._merge_values)
+            rows = iter(merged)
+            next(rows)
+            self.assertIsNotNone(merged._merge_values)
+            rows.close() # stopped early
+            self.assertIsNone(merged._merge_values)
+
+    def test_index_eviction(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            for i in range(hxl.filters.MergeDataFilter.INDEX_MAX_FILES + 3):
+                merged = self.source.merge_data(hxl.data(self.MERGE_IN), '#adm1-code', '#adm1+code', index_dir=index_dir, index_key=str(i))
+                self.assertEqual(self.MERGE_OUT[2:], merged.values)
+            self.assertEqual(hxl.filters.MergeDataFilter.INDEX_MAX_FILES, len(os.listdir(index_dir)))
+
     def test_merge_patterns(self):
         SOURCE_DATA = [
             ['P-code', 'District'],
@@ -974,6 +1386,35 @@ class TestMergeDataFilter(AbstractBaseFilterTest):
         self.assertEqual(MERGE_OUT[2:], merged.values)
 
 
+class TestParallelFilter(AbstractBaseFilterTest):
+
+    def make_chain(self, source):
+        return source.clean_data(upper='#org').replace_data('wash', 'Water', '#sector').with_rows('#affected > 120').add_columns('#x={{#affected * 2}}')
+
+    def test_same_output(self):
+        filtered = self.make_chain(hxl.data(DATA)).parallel(workers=2, batch_size=1)
+        self.assertEqual(4, len(filtered.stages))
+        self.assertEqual(self.make_chain(hxl.data(DATA)).values, filtered.values)
+        self.assertEqual([0, 1, 2], [row.row_number for row in self.make_chain(hxl.data(DATA)).parallel(workers=2, batch_size=1)])
+
+    def test_stateful_stage(self):
+        # only the stateless stages after the dedup run in parallel
+        filtered = self.make_chain(hxl.data(DATA).dedup('#org')).parallel(workers=2)
+        self.assertEqual(4, len(filtered.stages))
+        self.assertIsInstance(filtered.base, hxl.filters.DeduplicationFilter)
+        self.assertEqual(self.make_chain(hxl.data(DATA).dedup('#org')).values, filtered.values)
+
+    def test_pass_through(self):
+        filtered = hxl.data(DATA).sort('#affected').parallel(workers=2)
+        self.assertEqual([], filtered.stages)
+        self.assertEqual(hxl.data(DATA).sort('#affected').values, filtered.values)
+
+    def test_recipe(self):
+        filtered = hxl.data(DATA).recipe([{'filter': 'clean_data', 'upper': '#org'}, {'filter': 'parallel', 'workers': 2}])
+        self.assertEqual('ParallelFilter', type(filtered).__name__)
+        self.assertEqual(hxl.data(DATA).clean_data(upper='#org').values, filtered.values)
+
+
 class TestRenameFilter(AbstractBaseFilterTest):
 
     spec = '#sector:Sub-sector#subsector'
@@ -1065,7 +1506,38 @@ class TestReplaceFilter(AbstractBaseFilterTest):
         self.assertEqual('Other', source.values[0][0]) # defaulted
         self.assertEqual('WASH', source.values[0][1]) # not defaulted (wrong column)
         self.assertEqual('NGO Bravo', source.values[1][0]) # not defaulted (had a match)
-        
+
+    def test_map_order(self):
+        # the first applicable replacement wins, whether exact or regex
+        MAPPING = [
+            ['#x_pattern', '#x_substitution', '#x_tag', '#x_regex'],
+            ['^NGO A$', 'Alpha (regex)', 'org', 'True'],
+            ['NGO A', 'Alpha (exact)', 'org', ''],
+            ['NGO B', 'Bravo (exact)', 'org', ''],
+            ['^NGO B$', 'Bravo (regex)', 'org', 'True'],
+            ['(Coa)st', r'\1stal', '', 'True'],
+        ]
+        source = self.source.replace_data_map(hxl.data(MAPPING))
+        self.assertEqual(
+            [['Alpha (regex)', 'Coastal'], ['Bravo (exact)', 'Plains'], ['Bravo (exact)', 'Coastal'], ['Alpha (regex)', 'Plains']],
+            [[values[0], values[2]] for values in source.values]
+        )
+
+    def test_large_map(self):
+        MAPPING = [['#x_pattern', '#x_substitution', '#x_tag', '#x_regex']]
+        for i in range(1000):
+            MAPPING.append(['Place {}'.format(i), 'Replaced {}'.format(i), 'adm1', ''])
+            MAPPING.append(['^Place {}x$'.format(i), 'Regex {}'.format(i), 'adm1', 'True'])
+        MAPPING.append(['Plains', 'Plains District', 'adm1', ''])
+        source = self.source.replace_data_map(hxl.data(MAPPING))
+        self.assertEqual(['Coast', 'Plains District', 'Coast', 'Plains District'], [values[2] for values in source.values])
+
+        DATA = [['#adm1'], ['place 999'], ['Place 12x'], ['Place 1000']]
+        self.assertEqual(
+            [['Replaced 999'], ['Regex 12'], ['Place 1000']],
+            hxl.data(DATA).replace_data_map(hxl.data(MAPPING)).values
+        )
+
 
     def test_replace_after_append(self):
         # will test with different lengths of value arrays
@@ -1160,6 +1632,16 @@ class TestRowFilter(unittest.TestCase):
         self.assertEqual(self.DATA[3:5], self.source.with_rows(['#sector=education']).values)
         self.assertEqual(self.DATA[3:5], self.source.with_rows('#sector=education').values)
 
+    def test_push_down(self):
+        def make_chain(source):
+            return source.without_rows('#adm1=Plains', mask='#org=NGO A').with_rows('#sector~^ed|^wa').with_columns('#org,#affected')
+        pushed = make_chain(hxl.data(self.DATA))
+        self.assertIsNotNone(pushed.push_down())
+        self.assertEqual(make_chain(self.source).values, pushed.values)
+        self.assertEqual([0, 1, 2], [row.row_number for row in make_chain(hxl.data(self.DATA))])
+        # formulas need a full row
+        self.assertIsNone(hxl.data(self.DATA).with_rows('#affected > {{#affected}}').push_down())
+
     def test_with_rows_formula(self):
         DATA = [
             ['#foo1', '#foo2'],
@@ -1251,6 +1733,44 @@ class TestSortFilter(AbstractBaseFilterTest):
             return float(r[3])
         self.assertEqual(sorted(DATA[2:], key=key), self.source.sort('#affected').values)
 
+    def test_external(self):
+        # sorting in small runs saved to temporary files gives the same result
+        for keys in (None, ['#adm1', '#sector']):
+            for reverse in (False, True):
+                expected = self.source.sort(keys, reverse=reverse).values
+                for run_size in (1, 2):
+                    filter = hxl.filters.SortFilter(self.source, keys or [], reverse=reverse, run_size=run_size)
+                    self.assertEqual(expected, filter.values)
+                    self.assertEqual(expected, filter.values) # replay from saved runs
+                self.assertEqual(expected, self.source.sort(keys, reverse=reverse, memory_limit=1).values)
+                self.assertEqual(expected, self.source.sort(keys, reverse=reverse, memory_limit=10**9).values)
+
+    def test_external_row_numbers(self):
+        rows = list(hxl.filters.SortFilter(self.source, run_size=2))
+        self.assertEqual(list(range(len(rows))), [row.row_number for row in rows])
+
+    def test_external_fan_in(self):
+        # more runs than can be merged at once (merged in several passes, still stable)
+        DATA_IN = [['#adm1', '#affected']] + [['Region {}'.format(i % 7), str(i % 5)] for i in range(300)]
+        source = hxl.data(DATA_IN).cache()
+        for reverse in (False, True):
+            expected = source.sort('#affected', reverse=reverse).values
+            filter = hxl.filters.SortFilter(source, '#affected', reverse=reverse, run_size=1)
+            self.assertEqual(expected, filter.values)
+            self.assertTrue(len(filter._run_files) <= filter.MERGE_FAN_IN)
+            self.assertEqual(expected, filter.values) # replay from merged runs
+
+    def test_top(self):
+        for keys in (None, '#affected', ['#adm1', '#sector']):
+            for reverse in (False, True):
+                expected = self.source.sort(keys, reverse=reverse).values
+                for n in (0, 1, 2, 10):
+                    self.assertEqual(expected[:n], self.source.top(n, keys, reverse=reverse).values)
+
+    def test_top_load(self):
+        filter = hxl.filters.from_recipe(self.source, {'filter': 'top', 'n': 2, 'tags': '#affected', 'reverse': True})
+        self.assertEqual(self.source.sort('#affected', reverse=True).values[:2], filter.values)
+
     def test_minmax_years(self):
         DATA = [
             ['#date+year', '#affected', '#adm1'],
@@ -1334,6 +1854,20 @@ class TestExplodeFilter(AbstractBaseFilterTest):
             self.DATA_OUT[2:]
         )
 
+    def test_multiple_groups(self):
+        DATA_IN = [
+            ['Province', '2015', '2016', 'Female', 'Male', 'Source'],
+            ['#adm1', '#affected+label', '#affected+label', '#reached+label', '#reached+label', '#meta+source'],
+            ['Coast', '100', '200', '30', '40'],
+        ]
+        VALUES_OUT = [
+            ['Coast', '2015', '100', 'Female', '30', ''],
+            ['Coast', '2015', '100', 'Male', '40', ''],
+            ['Coast', '2016', '200', 'Female', '30', ''],
+            ['Coast', '2016', '200', 'Male', '40', ''],
+        ]
+        self.assertEqual(VALUES_OUT, hxl.data(DATA_IN).explode().values)
+
 
 class TestImplodeFilter(AbstractBaseFilterTest):
 
@@ -1381,6 +1915,42 @@ class TestImplodeFilter(AbstractBaseFilterTest):
             source = hxl.data(self.DATA_IN).implode(label_pattern="#group", value_pattern="#foo")
             source.columns
 
+    def test_value_column_position(self):
+        # the value column doesn't have to be last
+        DATA_IN = [
+            ['#adm1', '#affected', '#group', '#date'],
+            ['Coast', '200', 'Girls', '2016'],
+            ['Coast', '150', 'Boys', '2016'],
+        ]
+        source = hxl.data(DATA_IN).implode(label_pattern="#group", value_pattern="#affected")
+        self.assertEqual([['Coast', '2016', '150', '200']], source.values)
+
+    def test_presorted(self):
+        # labels from a first pass over a cached source
+        source = hxl.data(self.DATA_IN).cache().implode("#group", "#affected", presorted=True)
+        self.assertEqual(self.DATA_OUT[0], source.headers)
+        self.assertEqual(self.DATA_OUT[2:], source.values)
+
+        # a first pass needs a repeatable source
+        with self.assertRaises(hxl.filters.HXLFilterException):
+            hxl.data(self.DATA_IN).implode("#group", "#affected", presorted=True).columns
+
+    def test_labels(self):
+        LABELS = ['Girls', 'Boys']
+        EXPECTED = [
+            ['Coast', '2016', '200', '150'],
+            ['Plains', '2016', '300', '450'],
+        ]
+        for presorted in (False, True,):
+            source = hxl.data(self.DATA_IN).implode("#group", "#affected", presorted=presorted, labels=LABELS)
+            self.assertEqual(['Province', 'Date'] + LABELS, source.headers)
+            self.assertEqual(EXPECTED, source.values)
+
+    def test_explode_round_trip(self):
+        exploded = hxl.data(self.DATA_IN).implode("#group", "#affected").explode()
+        source = exploded.implode("#affected+header", "#affected+value", presorted=True, labels=self.DATA_OUT[0][2:])
+        self.assertEqual(self.DATA_OUT[2:], source.values)
+
         
 class TestExpandListsFilter(AbstractBaseFilterTest):
     DATA_IN = [
@@ -1446,7 +2016,25 @@ class TestExpandListsFilter(AbstractBaseFilterTest):
         ]
         source = hxl.data(DATA_IN).expand_lists(correlate=True)
         self.assertEqual(VALUES_OUT, source.values)
-        
+
+    def test_short_rows(self):
+        DATA_IN = [
+            ["#adm1", "#org+list", "#sector+list"],
+            ["Coast", "Org A | Org B"],
+        ]
+        VALUES_OUT = [
+            ["Coast", "Org A", ""],
+            ["Coast", "Org B", ""],
+        ]
+        self.assertEqual(VALUES_OUT, hxl.data(DATA_IN).expand_lists().values)
+        self.assertEqual(VALUES_OUT, hxl.data(DATA_IN).expand_lists(correlate=True).values)
+
+    def test_max_rows(self):
+        with self.assertLogs('hxl.filters', level='WARNING'):
+            self.assertEqual(self.DATA_OUT[2:4] + self.DATA_OUT[8:], hxl.data(self.DATA_IN).expand_lists(max_rows=2).values)
+        # no warning when a row stays within the limit
+        self.assertEqual(self.DATA_OUT[2:], hxl.data(self.DATA_IN).expand_lists(max_rows=6).values)
+
 
 class TestFillDataFilter(AbstractBaseFilterTest):
 
@@ -359,5 +359,11 @@ class TestEval(unittest.TestCase):
     def test_nested_functions(self):
         self.assertEqual(5, e.eval(self.row, 'round(round(3.4) + round(1.9))'))
 
+    def test_compiled(self):
+        formula = e.compile('#affected+f+children + #affected+m+children').bind(self.row.columns)
+        self.assertEqual(300, formula.eval(self.row))
+        row = hxl.model.Row(columns=self.row.columns, values=["Org B", "Plains", "1", "2", "3", "4"])
+        self.assertEqual(3, formula.eval(row))
+        self.assertIs(formula, e.compile('#affected+f+children + #affected+m+children'))
 
 
@@ -570,6 +570,22 @@ class TestParser(unittest.TestCase):
             tags = source.tags
         self.assertEqual(TestParser.EXPECTED_TAGS, tags)
 
+    def test_intern_values(self):
+        for filename in (FILE_CSV, FILE_XLSX,):
+            with hxl.data(filename, InputOptions(allow_local=True, intern_values=True)) as source:
+                rows = [row.values for row in source]
+            self.assertEqual(TestParser.EXPECTED_ROW_COUNT, len(rows))
+            self.assertIs(rows[0][1], rows[3][1]) # WASH
+            self.assertIs(rows[1][3], rows[3][3]) # OMS
+
+    def test_intern_limit(self):
+        with hxl.data(FILE_CSV, InputOptions(allow_local=True, intern_values=True, intern_limit=2)) as source:
+            rows = [row.values for row in source]
+            self.assertEqual(TestParser.EXPECTED_CONTENT, rows)
+            # stopped sharing values for columns with more than two distinct values
+            self.assertIsNone(source._intern_tables[0])
+            self.assertEqual({'1 March 2015', ''}, set(source._intern_tables[8]))
+
     def test_empty_header_row(self):
         """Test for exception parsing an empty header row"""
         DATA = [
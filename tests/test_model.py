@@ -6,7 +6,7 @@ October 2014
 License: Public Domain
 """
 
-import io, unittest
+import io, unittest, unittest.mock
 import hxl
 from hxl.datatypes import normalise_string
 from hxl.model import TagPattern, Dataset, Column, Row, RowQuery
@@ -94,6 +94,37 @@ class TestPattern(unittest.TestCase):
         self.assertFalse(pattern.match(Column.parse('#foo')))
         self.assertFalse(pattern.match(Column.parse('#foo+a+b')))
 
+    def test_changed_attributes(self):
+        pattern = TagPattern.parse('#tag+xxx')
+        column = Column(tag='#tag', attributes=['foo'])
+        self.assertFalse(pattern.match(column))
+        column.add_attribute('xxx')
+        self.assertTrue(pattern.match(column))
+        column.remove_attribute('xxx')
+        self.assertFalse(pattern.match(column))
+
+    def test_vocabulary_full(self):
+        # attributes beyond the vocabulary limit match using sets
+        with unittest.mock.patch.object(hxl.model, 'ATTRIBUTE_VOCABULARY_SIZE', len(hxl.model._attribute_bits)):
+            column = Column(tag='#tag', attributes=['f', 'vocabtest1'])
+            self.assertIsNone(column.attribute_mask)
+            self.assertTrue(TagPattern.parse('#tag+f').match(column))
+            self.assertTrue(TagPattern.parse('#tag+vocabtest1').match(column))
+            self.assertFalse(TagPattern.parse('#tag-vocabtest1').match(column))
+            self.assertTrue(TagPattern.parse('#tag+f+vocabtest1!').match(column))
+            self.assertFalse(TagPattern.parse('#tag+f!').match(column))
+            self.assertFalse(TagPattern.parse('#tag+vocabtest2').match(Column(tag='#tag', attributes=['f'])))
+            self.assertNotIn('vocabtest1', hxl.model._attribute_bits)
+
+    def test_assigned_attributes(self):
+        pattern = TagPattern.parse('#tag+xxx')
+        column = Column(tag='#tag', attributes=['foo'])
+        self.assertFalse(pattern.match(column))
+        column.attributes = ['foo', 'xxx']
+        self.assertTrue(pattern.match(column))
+        with self.assertRaises(AttributeError):
+            column.attributes.discard('xxx')
+
     def test_find_column_index(self):
         pattern = TagPattern.parse('#adm1')
         data = hxl.data(DATA)
@@ -117,6 +148,19 @@ class TestPattern(unittest.TestCase):
         self.assertEqual({'foo'}, pattern.include_attributes)
         self.assertEqual({'xxx'}, pattern.exclude_attributes)
 
+    def test_parse_memoised(self):
+        # memoised parsing still gives each caller its own pattern
+        pattern = TagPattern.parse('#tag+foo')
+        self.assertIsNot(pattern, TagPattern.parse('#tag+foo'))
+        column = Column(tag='#tag', attributes=['foo'])
+        self.assertTrue(pattern.match(column))
+        with self.assertRaises(AttributeError):
+            pattern.include_attributes.add('bar')
+        pattern.include_attributes = {'foo', 'bar'}
+        self.assertFalse(pattern.match(column)) # compiled form discarded
+        self.assertEqual({'foo'}, TagPattern.parse('#tag+foo').include_attributes)
+        self.assertTrue(TagPattern.parse('#tag+foo').match(column))
+
     def test_parse_list(self):
         patterns = TagPattern.parse_list('tag+foo,tag-xxx')
         for pattern in patterns:
@@ -281,6 +325,20 @@ class TestRow(unittest.TestCase):
     def test_row_number(self):
         self.assertEqual(TestRow.ROW_NUMBER, self.row.row_number)
 
+    def test_changed_columns(self):
+        # resolved column indices follow changes to the shared column list
+        self.assertEqual('WFP', self.row.get('#org'))
+        self.row.columns[1] = Column.parse('#adm1')
+        self.assertIsNone(self.row.get('#org'))
+        self.assertEqual('WFP', self.row.get('#adm1'))
+        self.row.columns[2] = Column.parse('#org')
+        self.assertEqual('Liberia', self.row.get('#org'))
+
+    def test_column_index_cache_bounded(self):
+        for i in range(hxl.model.COLUMN_INDEX_CACHE_SIZE + 10):
+            Row(columns=[Column.parse('#org')], values=['WFP']).get('#org')
+        self.assertTrue(len(hxl.model._column_index_cache) <= hxl.model.COLUMN_INDEX_CACHE_SIZE)
+
     def test_data(self):
         self.assertEqual(TestRow.CONTENT, self.row.values)
 
@@ -316,6 +374,30 @@ class TestRow(unittest.TestCase):
         self.assertTrue(type(result) is list)
         self.assertEqual(1, len(result))
 
+    def test_get_separate_columns(self):
+        # cached column indices must not leak between column lists
+        columns = [Column.parse(tag) for tag in ['#country', '#org']]
+        row = Row(columns=columns, values=['Guinea', 'UNICEF'])
+        self.assertEqual('WFP', self.row.get('#org'))
+        self.assertEqual('UNICEF', row.get('#org'))
+        self.assertEqual(['Liberia'], self.row.get_all('#country'))
+        self.assertEqual(['Guinea'], row.get_all('#country'))
+
+    def test_key(self):
+        self.assertEqual(('wfp', 'liberia',), self.row.key(['#org', '#country']))
+        self.assertEqual(('wfp',), self.row.key('#org'))
+
+    def test_shared(self):
+        shared = Row(self.row.columns, self.row.share_values(), shared=True)
+        self.assertIs(self.row.share_values(), shared.share_values())
+        self.assertEqual('WFP', shared.get('#org'))
+        # modifying either row copies the list first
+        shared.values[1] = 'UNICEF'
+        self.row.values[1] = 'UNHCR'
+        self.assertEqual('UNICEF', shared.get('#org'))
+        self.assertEqual('UNHCR', self.row.get('#org'))
+        self.assertEqual(self.CONTENT[1], 'WFP')
+
     def test_dictionary(self):
         self.assertEqual({
             '#country': 'Liberia',
@@ -460,6 +542,24 @@ class TestRowQuery(unittest.TestCase):
         self.assertTrue(RowQuery.parse("inneed>400").match_row(self.row))
         self.assertTrue(RowQuery.parse("inneed<600").match_row(self.row))
 
+    def test_compiled_columns(self):
+        # a compiled query must rebind when it sees a different column list
+        query = RowQuery.parse("adm1=coast")
+        self.assertTrue(query.match_row(self.row))
+        row = Row(columns=[Column.parse('#sector'), Column.parse('#adm1')], values=['Coast', 'Plains'])
+        self.assertFalse(query.match_row(row))
+        self.assertTrue(query.match_row(self.row))
+
+    def test_compiled_mixed_values(self):
+        # numbers and strings in the same column still use the fallback order
+        query = RowQuery.parse("affected<50")
+        columns = [Column.parse('#affected')]
+        match = query.compile(columns)
+        self.assertTrue(match(Row(columns, ['9'])))
+        self.assertFalse(match(Row(columns, ['100'])))
+        self.assertFalse(match(Row(columns, ['n/a'])))
+        self.assertTrue(match(Row(columns, ['9'])))
+
     AGGREGATE_DATA = [
         ['#adm1', '#affected'],
         ['Coast', '100'],
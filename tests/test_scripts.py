@@ -134,6 +134,10 @@ class TestCount(BaseTest):
     def test_count_colspec(self):
         self.assertOutput(['-t', 'org,adm1', '-a', 'count() as Activities#output+activities'], 'count-output-colspec.csv')
 
+    def test_memory_limit(self):
+        self.assertOutput(['-t', 'org,adm1', '--memory-limit', '1'], 'count-output-simple.csv')
+        self.assertOutput(['-t', 'org,adm1', '-a', 'sum(targeted) as Total targeted#targeted+total', '--memory-limit', '1K'], 'count-output-aggregated.csv')
+
 
 class TestCut(BaseTest):
     """
@@ -153,6 +157,28 @@ class TestCut(BaseTest):
         self.assertOutput(['--exclude', 'population+sex,targeted'], 'cut-output-excludes.csv')
 
 
+class TestImplode(BaseTest):
+    """
+    Test the hxlimplode command-line tool.
+    """
+
+    def setUp(self):
+        self.function = hxl.scripts.hxlimplode_main
+        self.input_file = 'input-simple.csv'
+
+    def test_default(self):
+        self.assertOutput(['-L', 'population+sex', '-V', 'targeted'], 'implode-output-default.csv')
+
+    def test_presorted(self):
+        self.assertOutput(['-L', 'population+sex', '-V', 'targeted', '--presorted', '--labels', 'Hombres,Mujeres'], 'implode-output-default.csv')
+
+    def test_presorted_no_labels(self):
+        # rows for the label pass go to a temporary file past the memory limit
+        self.assertOutput(['-L', 'population+sex', '-V', 'targeted', '--presorted'], 'implode-output-default.csv')
+        self.assertOutput(['-L', 'population+sex', '-V', 'targeted', '--presorted', '--memory-limit', '1'], 'implode-output-default.csv')
+        self.assertOutput(['-L', 'population+sex', '-V', 'targeted', '--presorted', '--memory-limit', '1K'], 'implode-output-default.csv')
+
+
 class TestMerge(BaseTest):
     """
     Test the hxlmerge command-line tool.
@@ -265,6 +291,14 @@ class TestSort(BaseTest):
         self.assertOutput(['-r'], 'sort-output-reverse.csv')
         self.assertOutput(['--reverse'], 'sort-output-reverse.csv')
 
+    def test_top(self):
+        self.assertOutput(['-n', '100'], 'sort-output-default.csv')
+        self.assertOutput(['--top', '100', '-r'], 'sort-output-reverse.csv')
+
+    def test_memory_limit(self):
+        self.assertOutput(['--memory-limit', '1K'], 'sort-output-default.csv')
+        self.assertOutput(['-t', 'country', '--memory-limit', '100'], 'sort-output-tags.csv')
+
 
 class TestTag(BaseTest):
     """